@@ -27,7 +27,6 @@ setup(name='syschangemon',
         'peewee >= 2.8.0',
         'binaryornot >= 0.4.0',
         'partialhash >= 1.1.3',
-        'diff_match_patch >= 20121119',
         'jinja2 == 2.6',
         'python-dateutil >= 2.5.0',
         'pytz >= 2016.1',
@@ -35,6 +34,10 @@ setup(name='syschangemon',
         'enum34 >= 1.1.2',
         'parsedatetime >= 2.1',
         ],
+    extras_require={
+        ### Required by benchmarks in tests/benchmark
+        'bench': ['diff_match_patch >= 20121119'],
+        },
     setup_requires=[],
     entry_points="""
         [console_scripts]
@@ -1,4 +1,5 @@
 """syschangemon base controller."""
+import csv
 import smtplib
 import socket
 from email.mime.multipart import MIMEMultipart
@@ -7,10 +8,12 @@ from email.mime.text import MIMEText
 import sys
 from cement.core.controller import CementBaseController, expose
 from cement.core import hook
-from syschangemon.cli.ext.pluginbase import UnsupportedException
+from syschangemon.cli.ext.collector import Collector
+from syschangemon.core.exc import SysChangeMonConfigError
 from syschangemon.core.jinjaoutput import JinjaOutputHandler
-from syschangemon.core.model import Model
+from syschangemon.core.model import Model, cache
 from syschangemon.core.sessiondiff import SessionDiff
+from syschangemon.core.textdiff import TextDiff
 from peewee import OperationalError
 from tzlocal.unix import get_localzone
 from datetime import datetime
@@ -40,13 +43,51 @@ class SysChangeMonBaseController(CementBaseController):
     def _setup(self, app):
         super(SysChangeMonBaseController, self)._setup(app)
 
-        plugins = {}
-        for h in app.handler.list('state_plugin'):
-            plugin = h()
-            plugin.setup(self.app)
-            plugins[plugin.label] = plugin
-
-        self.plugins = plugins
+        # state plugins set up so far, commands not collecting or diffing need none
+        self.plugins = {}
+
+    def _phase_plugins(self, phase):
+        """
+        Get state plugins taking part in a command phase, setting them up on first use
+
+        :param phase: 'collect' or 'diff'
+        :return: dict of label -> plugin
+        """
+        res = {}
+        for h in self.app.handler.list('state_plugin'):
+            if phase not in h.phases:
+                continue
+            label = h.Meta.label
+            if label not in self.plugins:
+                plugin = h()
+                plugin.setup(self.app)
+                self.plugins[label] = plugin
+            res[label] = self.plugins[label]
+        return res
+
+    def _session_storage(self):
+        """
+        Get session storage mode: 'full' stores every state, 'delta' only changes to the previous session
+        """
+        if 'session_storage' not in self.app.config.keys('syschangemon'):
+            return 'full'
+        res = self.app.config.get('syschangemon', 'session_storage').strip().lower()
+        if res not in ['full', 'delta']:
+            raise SysChangeMonConfigError("invalid session_storage: %s - use 'full' or 'delta'" % res)
+        return res
+
+    def _text_diff(self):
+        """
+        Get TextDiff caching its results in the storage database
+        """
+        kwargs = {}
+        if 'text_diff_max_size' in self.app.config.keys('syschangemon'):
+            try:
+                kwargs['max_size'] = int(self.app.config.get('syschangemon', 'text_diff_max_size'))
+            except ValueError:
+                raise SysChangeMonConfigError("invalid text_diff_max_size: %s - use a number of characters" %
+                                              self.app.config.get('syschangemon', 'text_diff_max_size'))
+        return TextDiff(self.app.storage.db, **kwargs)
 
     @expose(help='export system state stored in session as CSV (default: most recent session)')
     def export(self):
@@ -71,8 +112,16 @@ class SysChangeMonBaseController(CementBaseController):
         if sess is None:
             sess = recent[0]
 
-        q = db.states.find(sessionid=sess['uuid'])
-        db.db.freeze(q, format='csv', file_obj=sys.stdout)
+        states = sess.find_states()
+        keys = set()
+        for state in states:
+            keys |= set(state.keys())
+        fields = ['sessionid', 'url', 'plugin']
+        fields += sorted(keys - set(fields))
+        writer = csv.DictWriter(sys.stdout, fieldnames=fields)
+        writer.writeheader()
+        for state in states:
+            writer.writerow(state)
 
         self.app.exit_code = 0
         return
@@ -108,8 +157,7 @@ class SysChangeMonBaseController(CementBaseController):
         db = self.app.storage.db
         assert isinstance(db, Model)
 
-        for sess in db.find_sessions():
-            sess.delete()
+        db.delete_sessions(db.find_sessions())
 
         self.collect()
 
@@ -129,46 +177,34 @@ class SysChangeMonBaseController(CementBaseController):
 
         session = db.new_session()
         session['start_time'] = datetime.now(tz=get_localzone())
+        if self._session_storage() == 'delta':
+            try:
+                parent = db.last_closed_session()
+            except OperationalError:
+                # expected on empty db
+                parent = None
+            if parent is not None:
+                session['parent'] = parent['uuid']
         session.save()
 
-        plugins = self.plugins
+        plugins = self._phase_plugins('collect')
 
-        urls = []
-        for plugin in plugins.values():
-            urls += plugin.list_urls()
+        collector = Collector(session, plugins, self.app.log)
+        self.app.log.debug("%s" % collector)
+        collector.run()
 
         for plugin in plugins.values():
-            urls = plugin.process_urls(urls)
-
-        for label, plugin in plugins.items():
-            with db.transaction():
-                for url in urls:
-                    try:
-                        statedict = plugin.get_state(url)
-                        if statedict is not None:
-                            state = session.new_state(url=url, plugin=label, **statedict)
-                            #self.app.log.debug("read state: %s" % state)
-                            state.save()
-                    except UnsupportedException:
-                        pass
-
-        with db.transaction():
-            for state in session.find_states():
-                for plugin in plugins.values():
-                    old = state.copy()
-                    new = plugin.process_state(state)
-                    if old != new:
-                        state.save()
-                        #self.app.log.debug("updated state: %s" % state)
+            plugin.process_session(session)
 
         for res in hook.run('enumerate', self.app):
             self.app.log.debug('enumerate result: %s' % res)
 
         session['hostname'] = socket.gethostbyaddr(socket.gethostname())[0]
-        session['item_count'] = len(urls)
+        session['item_count'] = collector.url_count
         session['closed'] = True
         session['end_time'] = datetime.now(tz=get_localzone())
         session.save()
+        self.app.log.debug(repr(cache))
 
         print("session " + session['uuid'] + " saved")
 
@@ -187,10 +223,13 @@ class SysChangeMonBaseController(CementBaseController):
 
             recent_sessions = db.recent_closed_sessions(session_keep)
             assert isinstance(recent_sessions, list)
+            expunge = []
             for sess in db.find_sessions():
                 if sess not in recent_sessions:
                     self.app.log.debug("Expunging old session {}".format(sess['uuid']))
-                    sess.delete()
+                    expunge.append(sess)
+            # delta states of expunged sessions are compacted into the oldest kept session
+            db.delete_sessions(expunge)
         except OperationalError:
             # expected on empty db
             pass
@@ -208,11 +247,25 @@ class SysChangeMonBaseController(CementBaseController):
             # expected on empty db
             pass
 
+        removed = db.blobs.gc()
+        self.app.log.debug("Removed {} unreferenced blobs".format(removed))
+        removed = self._text_diff().gc()
+        self.app.log.debug("Removed {} unused text diffs".format(removed))
+
         # TODO: implement low level db cleanup, eg: db.query('VACUUM')
 
         self.app.exit_code = 0
         return
 
+    def _render_report(self, diff, is_empty, template, fd):
+        # states and diffs are generated while rendering, the output is written to fd chunk by chunk
+        diff_dict = dict(diff.__dict__)
+        diff_dict['is_empty'] = is_empty
+        diff_dict['lost_states'] = diff.lost_states
+        diff_dict['found_states'] = diff.found_states
+        diff_dict['diffs'] = diff.diffs
+        self.app.output.stream(diff_dict, fd, template=template)
+
     @expose(help='diff two sessions and save report in database (default: most recent sessions)')
     def diff(self):
         self.app.log.debug("Inside SysChangeMonBaseController.diff()")
@@ -245,25 +298,27 @@ class SysChangeMonBaseController(CementBaseController):
         if new_sess is None:
             new_sess = recent[0]
 
-        diff = SessionDiff(old_sess, new_sess)
+        text_diff = self._text_diff()
+        diff = SessionDiff(old_sess, new_sess, text_diff)
 
-        for plugin in self.plugins.values():
+        for plugin in self._phase_plugins('diff').values():
             diff = plugin.process_diff(diff)
+            diff.item_processors.append(plugin.process_diff_item)
 
         #pprint.pprint(diff.__dict__)
 
-        diff_dict = diff.__dict__
-        diff_dict['is_empty'] = diff.is_empty
-        report_txt = self.app.render(diff_dict, 'report_txt.html', out=None)
-        report_html = self.app.render(diff_dict, 'report_html.html', out=None)
-        #print(report)
+        is_empty = diff.is_empty
 
         dbrep = db.new_report()
-        dbrep['text'] = report_txt
-        dbrep['html'] = report_html
-        dbrep['hostname'] = new_sess['hostname']
-        dbrep['is_empty'] = diff.is_empty
-        dbrep.save()
+        with db.transaction():
+            for part, template in [('text', 'report_txt.html'), ('html', 'report_html.html')]:
+                with dbrep.writer(part) as fd:
+                    self._render_report(diff, is_empty, template, fd)
+            dbrep['hostname'] = new_sess['hostname']
+            dbrep['is_empty'] = is_empty
+            dbrep.save()
+        self.app.log.debug(repr(text_diff))
+        self.app.log.debug(repr(cache))
 
         print('report ' + dbrep['uuid'] + " saved")
 
@@ -290,10 +345,9 @@ class SysChangeMonBaseController(CementBaseController):
             if report is None:
                 report = db.last_report()
 
-            if self.app.pargs.prefer_html:
-                print(report['html'])
-            else:
-                print(report['text'])
+            for chunk in report.chunks('html' if self.app.pargs.prefer_html else 'text'):
+                sys.stdout.write(chunk)
+            print()
         except OperationalError:
             print('no report found')
             self.app.exit_code = 2
@@ -343,8 +397,9 @@ class SysChangeMonBaseController(CementBaseController):
             msg['From'] = str(params['from'])
             msg['To'] = str(params['to_addr'])
 
-            part1 = MIMEText(str(report['text']), 'plain')
-            part2 = MIMEText(str(report['html']), 'html')
+            # mail parts are built in memory
+            part1 = MIMEText(report.text('text'), 'plain')
+            part2 = MIMEText(report.text('html'), 'html')
 
             msg.attach(part1)
             msg.attach(part2)
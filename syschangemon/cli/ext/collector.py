@@ -0,0 +1,235 @@
+"""Collect pipeline for syschangemon."""
+import itertools
+import queue
+import sys
+import threading
+
+from syschangemon.cli.ext.pluginbase import StatePluginBase
+
+# end of stream marker
+_END = object()
+
+
+class _Failure:
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Collector:
+    """
+    Streaming collect pipeline of state plugins.
+
+    Stages are connected by bounded queues, so memory use depends on the queue depth instead of
+    the number of urls:
+
+    - enumerate: urls of list_urls() of every plugin, passed through process_urls() of every plugin
+    - route: each url is queued for the plugins declaring its scheme in url_schemes, and for
+      legacy plugins declaring none, which reject unsupported urls by raising UnsupportedException
+    - get_states: each plugin runs get_states() over its queue in a worker thread
+    - process_state: every plugin implementing it processes each state
+    - write: StateWriter in batches
+
+    Processing and writing stay in the calling thread, the only one accessing the database.
+    Plugins needing all states of the session written first opt in to a post-pass by setting
+    post_process_prefixes, only states with those url prefixes are read back for their
+    post_process_state().
+    """
+
+    def __init__(self, session, plugins, log, queue_depth=1000):
+        """
+        :param session: Session to collect states of
+        :param plugins: dict of label -> state plugin
+        :param log: application log handler
+        :param queue_depth: maximum number of urls or states waiting between two stages
+        """
+        self.session = session
+        self.plugins = plugins
+        self.log = log
+        self.queue_depth = queue_depth
+        self.model = session._model
+        self.stages = [plugin for plugin in plugins.values()
+                       if type(plugin).process_state is not StatePluginBase.process_state]
+        self.post_stages = [plugin for plugin in plugins.values() if len(plugin.post_process_prefixes) > 0]
+        # plugins reading file contents get them from plugins reading the files anyway
+        readers = [plugin for plugin in plugins.values()
+                   if type(plugin).content_limit is not StatePluginBase.content_limit]
+        for plugin in plugins.values():
+            plugin.content_readers = readers
+        # scheme -> labels of plugins declaring it, plugins without url_schemes get every url
+        self.probing = [label for label, plugin in plugins.items() if plugin.url_schemes is None]
+        self.scheme_index = {}
+        for label, plugin in plugins.items():
+            for scheme in plugin.url_schemes or ():
+                self.scheme_index.setdefault(scheme, []).append(label)
+        for scheme in self.scheme_index.keys():
+            self.scheme_index[scheme] += self.probing
+        self.routed = set(self.probing).union(*self.scheme_index.values())
+        # set by failing stages or the consumer to stop all stages
+        self.stop = threading.Event()
+        # set by the consumer once it does not read results any more
+        self.done = threading.Event()
+        self.url_count = 0
+        self.post_processed = 0
+
+    def urls(self):
+        """
+        Get urls to collect
+
+        list_urls() and process_urls() are called here, in the calling thread, since plugins may
+        access the database in them. Only iteration of the returned urls is left to the pipeline.
+
+        :return: iterable of urls
+        """
+        urls = itertools.chain.from_iterable([plugin.list_urls() for plugin in self.plugins.values()])
+        for plugin in self.plugins.values():
+            urls = plugin.process_urls(urls)
+        return urls
+
+    def route(self, url):
+        """
+        Get labels of plugins to pass url to
+
+        :param url: url
+        :return: list of plugin labels
+        """
+        return self.scheme_index.get(url.partition(':')[0], self.probing)
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def _drain(self, q):
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise _Stopped()
+                continue
+            if item is _END:
+                return
+            yield item
+
+    def _run_stage(self, out, target, *args):
+        # run stage in a worker thread, report end of stream or failure to the consumer
+        try:
+            target(*args)
+            self._put(out, _END)
+        except _Stopped:
+            pass
+        except BaseException:
+            failure = _Failure(sys.exc_info())
+            self.stop.set()
+            while not self.done.is_set():
+                try:
+                    out.put(failure, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+    def _enumerate(self, inputs, urls):
+        for url in urls:
+            self.url_count += 1
+            for label in self.route(url):
+                self._put(inputs[label], url)
+        for q in inputs.values():
+            self._put(q, _END)
+
+    def _get_states(self, label, plugin, q, out):
+        for url, statedict in plugin.get_states(self._drain(q)):
+            if statedict is not None:
+                self._put(out, (label, url, statedict))
+
+    def states(self, urls):
+        """
+        Generate processed states of urls
+
+        :param urls: iterable of urls
+        :return: generator of State
+        """
+        # plugins no url is routed to need no worker
+        inputs = dict((label, queue.Queue(self.queue_depth)) for label in self.routed)
+        out = queue.Queue(self.queue_depth)
+        threads = [threading.Thread(target=self._run_stage, args=(out, self._enumerate, inputs, urls))]
+        for label in self.routed:
+            threads.append(threading.Thread(target=self._run_stage,
+                                            args=(out, self._get_states, label, self.plugins[label], inputs[label], out)))
+        self.stop.clear()
+        self.done.clear()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            running = len(threads)
+            while running > 0:
+                item = out.get()
+                if item is _END:
+                    running -= 1
+                    continue
+                if isinstance(item, _Failure):
+                    raise item.exc_info[1].with_traceback(item.exc_info[2])
+                (label, url, statedict) = item
+                state = self.session.new_state(url=url, plugin=label, **statedict)
+                #self.log.debug("read state: %s" % state)
+                for stage in self.stages:
+                    state = stage.process_state(state)
+                yield state
+        finally:
+            self.stop.set()
+            self.done.set()
+            for thread in threads:
+                thread.join()
+
+    def post_process(self, writer):
+        """
+        Run post-pass of plugins opting in, only changed states are written again
+
+        :param writer: StateWriter of the session
+        """
+        with self.model.transaction():
+            for plugin in self.post_stages:
+                for prefix in plugin.post_process_prefixes:
+                    for state in self.session.iter_states(prefix=prefix):
+                        old = state.copy()
+                        state = plugin.post_process_state(state)
+                        if state != old:
+                            writer.add(state)
+                            self.post_processed += 1
+            writer.flush()
+
+    def run(self, urls=None):
+        """
+        Collect, process and write states
+
+        :param urls: iterable of urls to collect, see urls() if None
+        :return: StateWriter used
+        """
+        if urls is None:
+            urls = self.urls()
+        # session was just created, states need no existence check
+        writer = self.session.state_writer(fresh=True)
+        with self.model.transaction():
+            for state in self.states(urls):
+                writer.add(state)
+            writer.flush()
+            writer.delete_missing()
+        self.log.debug("%s" % writer)
+
+        if len(self.post_stages) > 0:
+            self.post_process(writer)
+            self.log.debug("post-processed %d changed states" % self.post_processed)
+        return writer
+
+    def __repr__(self):
+        return "collector: schemes %s, probing %s, stages %s, post-pass %s" % (
+            sorted(self.scheme_index.keys()), self.probing,
+            [p.label for p in self.stages], [p.label for p in self.post_stages])
@@ -11,6 +11,11 @@ class StatePluginInterface(Interface):
 
     Meta = Attribute('Handler Meta-data')
 
+    phases = Attribute('Command phases the plugin takes part in: collect, diff')
+
+    url_schemes = Attribute('URL schemes of states collected by get_state(), '
+                            'None if unsupported urls are rejected by raising UnsupportedException')
+
     def _setup(self, app_obj):
         """
         The setup function is called during application initialization and
@@ -48,21 +53,74 @@ class StatePluginBase(CementBaseHandler):
         self.app = app_obj
         #print("Doing work @ _setup!")
 
+    # command phases the plugin is set up for, see SysChangeMonBaseController._phase_plugins()
+    phases = ('collect', 'diff')
+
+    # url schemes get_state() handles, urls of other schemes are not passed to it, see Collector.
+    # None (legacy plugins) means any url may be passed, unsupported ones raise UnsupportedException
+    url_schemes = None
+
     def list_urls(self):
         return []
 
     def get_state(self, url):
         raise UnsupportedException
 
+    def get_states(self, urls):
+        for url in urls:
+            try:
+                yield url, self.get_state(url)
+            except UnsupportedException:
+                pass
+
     def process_urls(self, urls):
         return urls
 
     def process_state(self, state):
         return state
 
+    # plugins implementing content_limit(), set by Collector, see wanted_content()
+    content_readers = ()
+
+    def content_limit(self, path, size):
+        """
+        Get how much of a file's contents the plugin reads in process_state()
+
+        Plugins reading files (eg. file) keep contents in the transient '_read' state key only
+        up to the largest limit of all plugins, so it is not read twice.
+
+        :param path: file path
+        :param size: file size, None if unknown
+        :return: number of bytes, 0 if the contents are not needed
+        """
+        return 0
+
+    def wanted_content(self, path, size):
+        """
+        Get how much of a file's contents content_readers need
+
+        :param path: file path
+        :param size: file size, None if unknown
+        :return: number of bytes, 0 if the contents are not needed
+        """
+        return max([0] + [plugin.content_limit(path, size) for plugin in self.content_readers])
+
+    # url prefixes of states passed to post_process_state() after all states of a session are
+    # written, only plugins needing states of other plugins should set this, see Collector
+    post_process_prefixes = ()
+
+    def post_process_state(self, state):
+        return state
+
+    def process_session(self, session):
+        pass
+
     def process_diff(self, diff):
         return diff
 
+    def process_diff_item(self, diff_item):
+        return diff_item
+
     @property
     def label(self):
         return self._meta.label
@@ -1,5 +1,10 @@
+import os
 import shlex
+import signal
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import PIPE
 
 import sys
@@ -8,6 +13,41 @@ from cement.core.foundation import CementApp
 
 from syschangemon.cli.ext.pluginbase import StatePluginBase, StatePluginInterface, UnsupportedException
 
+# characters read from command output at once
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputReader(threading.Thread):
+    """
+    Read a command output stream to its end, keeping only the first limit characters
+
+    The rest is read and dropped, so the command does not block on a full pipe.
+    """
+
+    def __init__(self, stream, limit):
+        super(OutputReader, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.limit = limit
+        self.value = ''
+        self.size = 0
+        self.start()
+
+    def run(self):
+        chunks = []
+        while True:
+            chunk = self.stream.read(CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            if self.size < self.limit:
+                chunks.append(chunk[:self.limit - self.size])
+            self.size += len(chunk)
+        self.value = ''.join(chunks)
+
+    @property
+    def truncated(self):
+        return self.size > self.limit
+
 
 class CommandPlugin(StatePluginBase):
     """
@@ -17,17 +57,36 @@ class CommandPlugin(StatePluginBase):
         label = 'command'
         interface = StatePluginInterface
 
+    phases = ('collect',)
+
     def __init__(self):
         super(CommandPlugin, self).__init__()
         self.commands = {}
+        self.timeouts = {}
+        self.timeout = 30
+        self.max_workers = 4
+        self.output_limit = 1048576
 
     def setup(self, app_obj):
         super(CommandPlugin, self).setup(app_obj)
+        # urls are named after the label of subclasses too
+        self.url_schemes = (self.Meta.label,)
         c = self.app.config
         for k, v in c.get_section_dict(self.Meta.label).items():
             if str(k).startswith('command.'):
                 url = self.Meta.label + "://" + str(k)[8:]
                 self.commands[url] = str(v)
+            elif str(k).startswith('timeout.'):
+                url = self.Meta.label + "://" + str(k)[8:]
+                self.timeouts[url] = float(v)
+
+        conf_keys = c.keys(self.Meta.label)
+        if 'timeout' in conf_keys:
+            self.timeout = float(c.get(self.Meta.label, 'timeout'))
+        if 'max_workers' in conf_keys:
+            self.max_workers = int(c.get(self.Meta.label, 'max_workers'))
+        if 'output_limit' in conf_keys:
+            self.output_limit = int(c.get(self.Meta.label, 'output_limit'))
 
     def list_urls(self):
         return list(self.commands.keys())
@@ -39,18 +98,44 @@ class CommandPlugin(StatePluginBase):
             #args = shlex.split(cmd) # not for shell=True
             self.app.log.debug("running %s" % cmd)
             args = [cmd]
-            with subprocess.Popen(args, shell=True, bufsize=-1, close_fds=True, stderr=PIPE, stdout=PIPE, universal_newlines=True) as proc:
+            start = time.time()
+            # own session, so the shell can be killed along with its children on timeout
+            with subprocess.Popen(args, shell=True, bufsize=-1, close_fds=True, stderr=PIPE, stdout=PIPE,
+                                  universal_newlines=True, start_new_session=True) as proc:
+                readers = {'stdout': OutputReader(proc.stdout, self.output_limit),
+                           'stderr': OutputReader(proc.stderr, self.output_limit)}
                 if sys.version_info < (3, 3):  # no timeout parameter under python 3.3
-                    stdout, stderr = proc.communicate()
+                    proc.wait()
                 else:
-                    stdout, stderr = proc.communicate(timeout=30)
-                res['stdout'] = stdout
-                res['stderr'] = stderr
+                    timeout = self.timeouts.get(url, self.timeout)
+                    try:
+                        proc.wait(timeout=timeout)
+                    except subprocess.TimeoutExpired:
+                        self.app.log.warn("%s timed out after %s seconds - killing it" % (cmd, timeout))
+                        os.killpg(proc.pid, signal.SIGKILL)
+                        proc.wait()
+                        res['timed_out'] = True
+                for key, reader in readers.items():
+                    reader.join()
+                    res[key] = reader.value
+                    if reader.truncated:
+                        res[key + '_truncated'] = reader.size
                 res['return_code'] = proc.returncode
+            res['duration'] = round(time.time() - start, 3)
             return res
         else:
             raise UnsupportedException
 
+    def get_states(self, urls):
+        # commands are few, run all of them at once up to max_workers
+        urls = [url for url in urls if url in self.commands.keys()]
+        if len(urls) == 0:
+            return
+        with ThreadPoolExecutor(max(1, self.max_workers)) as executor:
+            futures = [(url, executor.submit(self.get_state, url)) for url in urls]
+            for url, future in futures:
+                yield url, future.result()
+
 
 def load(app):
     handler.register(CommandPlugin)
@@ -5,10 +5,10 @@ try:
 except ImportError:
     from urlparse import urlparse
 
-from binaryornot.check import is_binary
 from cement.core import handler
 from syschangemon.cli.ext.pluginbase import StatePluginBase, StatePluginInterface
-import globre
+from syschangemon.core.fileread import read_file
+from syschangemon.core.globset import GlobSet
 
 
 class ConffilePlugin(StatePluginBase):
@@ -19,6 +19,10 @@ class ConffilePlugin(StatePluginBase):
         label = 'conffile'
         interface = StatePluginInterface
 
+    phases = ('collect',)
+
+    url_schemes = ()
+
     def setup(self, app):
         super(ConffilePlugin, self).setup(app)
 
@@ -29,12 +33,15 @@ class ConffilePlugin(StatePluginBase):
         self.exclude[:] = [v.strip() for v in self.exclude]  # strip all elements
         self.exclude[:] = [v for v in self.exclude if len(v) != 0]  # throw out empty elements
 
-        self.excludepats = []
-        for pat in self.exclude:
-            self.excludepats.append(globre.compile(pat, flags=globre.EXACT, split_prefix=False))
+        self.excludepats = GlobSet(self.exclude)
 
         self.size_limit = int(c.get(self._meta.label, 'size_limit'))
 
+    def content_limit(self, path, size):
+        if (size is not None and size > self.size_limit) or self.excludepats.match(path):
+            return 0
+        return self.size_limit
+
     def process_state(self, state):
         if str(state['url']).startswith("file://"):
             path = state['url'][7:]
@@ -49,17 +56,22 @@ class ConffilePlugin(StatePluginBase):
                 self.app.log.debug("%s is above size limit - skipping" % (path))
                 return state
         # filter out excludes
-        for pat in self.excludepats:
-            if pat.match(path):
-                self.app.log.debug("%s excluded by %s" % (path, pat))
-                return state
+        if self.excludepats.match(path):
+            self.app.log.debug("%s excluded by %s" % (path, self.excludepats.matching_pattern(path)))
+            return state
         try:
-            if is_binary(path):
+            # use the read of the file plugin if it kept the contents, read the file once otherwise
+            read = state.get('_read')
+            if read is None or read.content is None:
+                read = read_file(path, self.size_limit, digest=False)
+            if read.is_binary:
                 self.app.log.debug("%s seems to be binary - skipping" % (path))
                 return state
-            with open(path, mode='rb') as file:
-                state['content'] = file.read().decode('utf-8', 'replace')
-                #self.app.log.debug("reading conffile contents: %s" % (path))
+            if read.content is None or len(read.content) > self.size_limit:
+                self.app.log.debug("%s is above size limit - skipping" % (path))
+                return state
+            state['content'] = read.content.decode('utf-8', 'replace')
+            #self.app.log.debug("reading conffile contents: %s" % (path))
         except:
             e = sys.exc_info()[1]
             state['content_error'] = e
@@ -1,18 +1,24 @@
 """Filesystem Plugin for syschangemon."""
 import binascii
+import collections
 import datetime
 import re
 
-import globre
 import grp
-import hashlib
 import os
 import pwd
 import sys
-from stat import *
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from syschangemon.core.exc import SysChangeMonConfigError
+from syschangemon.core.filemode import FileMode
+from syschangemon.core.fileread import read_file
+from syschangemon.core.filewalk import walk_files
+from syschangemon.core.globset import GlobSet
+from syschangemon.core.hashcache import HashCache
+from syschangemon.core.namecache import NameCache
 from syschangemon.core.model import Model, Session
-from syschangemon.core.partialhash import compute_from_path
 
 try:
     from urllib.parse import urlparse
@@ -25,78 +31,6 @@ from tzlocal.unix import get_localzone
 from syschangemon.cli.ext.pluginbase import StatePluginBase, StatePluginInterface, UnsupportedException
 
 
-def st_mode_repr(mode):
-    """
-    Calculate textual representation of binary inode mode.
-
-    Sample output for regular file with mode 0644: 'u=rw-,g=r--,o=r--'
-
-    :param mode: st_mode integer returned by os.stat()
-    :return: textual representation of st_mode
-    """
-    res = ""
-    if S_ISBLK(mode):
-        res += "blk "
-    if S_ISCHR(mode):
-        res += "chr "
-    if S_ISDIR(mode):
-        res += "dir "
-    if S_ISFIFO(mode):
-        res += "fifo "
-    if S_ISLNK(mode):
-        res += "sym "
-    if S_ISSOCK(mode):
-        res += "sock "
-    if mode | S_ISUID == mode:
-        res += "setuid "
-    if mode | S_ISGID == mode:
-        res += "setgid "
-    if mode | S_ISVTX == mode:
-        res += "sticky "
-    res += "u="
-    if mode | S_IRUSR == mode:
-        res += "r"
-    else:
-        res += "-"
-    if mode | S_IWUSR == mode:
-        res += "w"
-    else:
-        res += "-"
-    if mode | S_IXUSR == mode:
-        res += "x"
-    else:
-        res += "-"
-    res += ",g="
-    if mode | S_IRGRP == mode:
-        res += "r"
-    else:
-        res += "-"
-    if mode | S_IWGRP == mode:
-        res += "w"
-    else:
-        res += "-"
-    if mode | S_IXGRP == mode:
-        res += "x"
-    else:
-        res += "-"
-    res += ",o="
-    if mode | S_IROTH == mode:
-        res += "r"
-    else:
-        res += "-"
-    if mode | S_IWOTH == mode:
-        res += "w"
-    else:
-        res += "-"
-    if mode | S_IXOTH == mode:
-        res += "x"
-    else:
-        res += "-"
-
-    return res
-
-
-
 class FilePlugin(StatePluginBase):
     """
     filesystem plugin base class
@@ -105,15 +39,32 @@ class FilePlugin(StatePluginBase):
         label = 'file'
         interface = StatePluginInterface
 
+    phases = ('collect',)
+
+    url_schemes = ('file',)
+
     def __init__(self, **kw):
         super().__init__(**kw)
         self.include = []
         self.exclude = []
-        self.include_pats = []
-        self.exclude_pats = []
+        self.include_pats = GlobSet([])
+        self.exclude_pats = GlobSet([])
+        self.prune_pats = GlobSet([])
+        self.assume_change_pats = GlobSet([])
         self.assume_nochange = []
         self.assume_change = []
         self.last_session = None
+        self.last_index = None
+        self.hash_cache_enabled = False
+        self.hash_cache_verify = 0.0
+        self.hash_cache = None
+        self.hash_workers = 1
+        self.hash_pool = 'thread'
+        self.hash_queue_depth = 0
+        self.max_content_size = 100000
+        self.user_names = NameCache(lambda uid: pwd.getpwuid(uid).pw_name)
+        self.group_names = NameCache(lambda gid: grp.getgrgid(gid).gr_name)
+        self.preload_names = False
         self.tz = get_localzone()
 
     @staticmethod
@@ -176,6 +127,30 @@ class FilePlugin(StatePluginBase):
 
         return list(set(flat)), list(set(deep))
 
+    @staticmethod
+    def _find_prune_patterns(l):
+        """
+        find directory patterns in exclude pattern list which exclude everything below them
+
+        an exclude pattern in the form of 'P**' matches every path below a directory
+        'd' if 'd' or 'd/' matches 'P' - such directories need not be walked at all
+
+        :param l: exclude pattern list
+        :return: list of string patterns matching directories that can be pruned
+        """
+
+        res = []
+        for e in l:
+            if not e.endswith('**'):
+                continue
+            prefix = e[:-2]
+            if len(prefix) == 0 or prefix.endswith('*'):
+                continue
+            if (len(prefix) - len(prefix.rstrip('\\'))) % 2 == 1:
+                continue  # escaped asterisk
+            res.append(prefix)
+        return res
+
     def setup(self, app):
         super(FilePlugin, self).setup(app)
 
@@ -188,92 +163,110 @@ class FilePlugin(StatePluginBase):
             self.include = self._process_pattern_list(c.get(self._meta.label, 'include').split('\n'))
         if 'exclude' in conf_keys:
             self.exclude = self._process_pattern_list(c.get(self._meta.label, 'exclude').split('\n'))
-        if 'no_assume_nochange' in conf_keys:
+        if 'assume_change' in conf_keys:
+            self.assume_change = self._process_pattern_list(c.get(self._meta.label, 'assume_change').split('\n'))
+        elif 'no_assume_nochange' in conf_keys:
             self.assume_change = self._process_pattern_list(c.get(self._meta.label, 'no_assume_nochange').split('\n'))
 
-        # compile globre patterns for include and exclude
-        self.include_pats = []
-        for pat in self.include:
-            self.include_pats.append(globre.compile(pat, flags=globre.EXACT, split_prefix=False))
-
-        self.exclude_pats = []
-        for pat in self.exclude:
-            self.exclude_pats.append(globre.compile(pat, flags=globre.EXACT, split_prefix=False))
+        # compile globre patterns for include, exclude and assume_change
+        self.include_pats = GlobSet(self.include)
+        self.exclude_pats = GlobSet(self.exclude)
+        self.prune_pats = GlobSet(self._find_prune_patterns(self.exclude))
+        self.assume_change_pats = GlobSet(self.assume_change)
 
         os.stat_float_times(True)
 
         if 'assume_nochange' in conf_keys:
             self.assume_nochange = [x.strip() for x in c.get(self._meta.label, 'assume_nochange').split(',')]
 
-    @staticmethod
-    def _matches_pat_list(path, pat_list):
-        for pat in pat_list:
-            if pat.match(path):
-                return True
-        return False
+        if 'hash_cache' in conf_keys:
+            self.hash_cache_enabled = c.get(self._meta.label, 'hash_cache').strip().lower() in ['1', 'true', 'yes', 'on']
+        if 'hash_cache_verify' in conf_keys:
+            self.hash_cache_verify = float(c.get(self._meta.label, 'hash_cache_verify'))
 
-    def list_urls(self):
-        res = []
+        if 'hash_workers' in conf_keys:
+            self.hash_workers = int(c.get(self._meta.label, 'hash_workers'))
+        if 'hash_pool' in conf_keys:
+            self.hash_pool = c.get(self._meta.label, 'hash_pool').strip().lower()
+            if self.hash_pool not in ['thread', 'process']:
+                raise SysChangeMonConfigError("invalid hash_pool: %s - use 'thread' or 'process'" % self.hash_pool)
+        # keep a few jobs per worker in flight while stat()-ing ahead
+        self.hash_queue_depth = self.hash_workers * 4
+
+        if 'max_content_size' in conf_keys:
+            self.max_content_size = int(c.get(self._meta.label, 'max_content_size'))
+
+        if 'preload_names' in conf_keys:
+            self.preload_names = c.get(self._meta.label, 'preload_names').strip().lower() in ['1', 'true', 'yes', 'on']
+
+    def _is_pruned_dir(self, path):
+        return self.prune_pats.match(path) or self.prune_pats.match(path + os.sep)
 
+    def list_urls(self):
         # find base dirs for include
         self.app.log.debug("enumerating using include: %s exclude: %s" % (self.include, self.exclude))
         (flat, deep) = self._find_base_dirs(self.include)
 
         self.app.log.debug("walk destinations: flat: %s deep: %s" % (flat, deep))
 
-        # collect flat includes
-        for f in flat:
-            for name in os.listdir(f):
-                filename = os.path.join(f, name)
-                if os.path.isfile(filename) and self._matches_pat_list(filename, self.include_pats):
-                        res.append(filename)
-
-        # collect deep (recursive) includes
-        for d in deep:
-            for root, dirs, files in os.walk(d):
-                for name in files:
-                    filename = os.path.join(root, name)
-                    if os.path.isfile(filename) and self._matches_pat_list(filename, self.include_pats):
-                            res.append(filename)
-
-        # filter out excludes
-        filtered_res = []
-        for f in res:
-            if not self._matches_pat_list(f, self.exclude_pats):
-                filtered_res.append(self._meta.label+'://'+f)
-
-        res = filtered_res
-
-        #self.app.log.debug("filelist: %s" % filelist)
-
         # we cannot run this piece of code in setup() since storage is not set up there
         db = self.app.storage.db
         assert isinstance(db, Model)
         self.last_session = db.last_closed_session()
 
-        return res
+        # load previous states at once for assume_nochange lookups
+        self.last_index = None
+        if self.last_session is not None and len(self.assume_nochange) > 0:
+            # resolved here, _stat_state() runs in a collector worker thread
+            self.last_index = self.last_session.state_index(resolve_blobs=True)
+            self.app.log.debug("loaded %d states of previous session" % len(self.last_index))
+
+        if self.hash_cache_enabled:
+            self.hash_cache = HashCache(db, verify_ratio=self.hash_cache_verify)
+
+        if self.preload_names:
+            for (names, path) in [(self.user_names, '/etc/passwd'), (self.group_names, '/etc/group')]:
+                try:
+                    names.load(path)
+                except OSError as e:
+                    self.app.log.warn("cannot preload names from %s: %s" % (path, e))
+
+        files = walk_files(flat, deep,
+                           include=self.include_pats.match,
+                           exclude=self.exclude_pats.match,
+                           prune=self._is_pruned_dir)
+
+        return (self._meta.label + '://' + f for f in files)
 
     # noinspection PyBroadException
-    def get_state(self, url):
-        if str(url).startswith("file://"):
-            path = url[7:]
-        else:
-            raise UnsupportedException
+    def _stat_state(self, url):
+        """
+        Collect state of a file except its content hash.
+
+        May run in a collector worker thread: the previous session is read from the StateIndex
+        loaded by list_urls() with blob texts resolved, the hash cache loaded there is only read
+        and marked in memory, it is written in process_session().
+
+        :param url: file url
+        :return: tuple (res, job) - state dict and hash job, job is None if no hashing is needed
+        """
+        path = url[7:]
         res = {}
+        stat = None
         try:
             stat = os.stat(path)
             res['size'] = stat.st_size
             res['ctime'] = datetime.datetime.fromtimestamp(stat.st_ctime, tz=self.tz)
             res['mtime'] = datetime.datetime.fromtimestamp(stat.st_mtime, tz=self.tz)
-            res['mode'] = st_mode_repr(stat.st_mode)
-            res['uid'] = str(stat.st_uid)
-            res['gid'] = str(stat.st_gid)
-            uidname = pwd.getpwuid(stat.st_uid).pw_name
+            res['mode'] = FileMode(stat.st_mode)
+            res['uid'] = stat.st_uid
+            res['gid'] = stat.st_gid
+            uidname = self.user_names.get(stat.st_uid)
             if uidname is not None and len(uidname) > 0:
-                res['uid'] = res['uid'] + " (" + uidname + ")"
-            gidname = grp.getgrgid(stat.st_gid).gr_name
+                res['user'] = uidname
+            gidname = self.group_names.get(stat.st_gid)
             if gidname is not None and len(gidname) > 0:
-                res['gid'] = res['gid'] + " (" + gidname + ")"
+                res['group'] = gidname
         except:
             e = sys.exc_info()[1]
             res['stat_error'] = e
@@ -288,35 +281,136 @@ class FilePlugin(StatePluginBase):
         #    res['xattr_error'] = e
 
         compute_hash = True
-        if not self._matches_pat_list(path, self.assume_change) \
-                and self.last_session is not None \
-                and len(self.assume_nochange) > 0:
+        if self.last_index is not None \
+                and url in self.last_index \
+                and not self.assume_change_pats.match(path):
             try:
-                prev = self.last_session.get_state(url)
-                no_change = True
-                for attr in self.assume_nochange:
-                    if res[attr] != prev[attr]:
-                        no_change = False
-                if no_change:
-                    for k, v in prev.items():
-                        # copy all 'non special' values from previous state record
-                        if k not in res.keys() and k not in ['url', 'plugin', 'sessionid', 'id']:
-                            res[k] = v
+                if self.last_index.equals(url, res, self.assume_nochange):
+                    # copy all 'non special' values from previous state record
+                    skip = set(res.keys()) | {'url', 'plugin', 'sessionid', 'id'}
+                    res.update(self.last_index.values(url, skip=skip))
                     res['assume_nochange'] = True
                     compute_hash = False
             except KeyError:
-                pass  # expected if previous session contains no such url
+                pass  # expected if stat failed
+
+        if not compute_hash:
+            if self.hash_cache is not None and stat is not None:
+                # not looked up, but the file is still there - keep its entry on flush()
+                self.hash_cache.touch(stat)
+            return res, None
+
+        res['assume_nochange'] = False
+        status = None
+        if self.hash_cache is not None and stat is not None:
+            (digest, status) = self.hash_cache.lookup(stat)
+            if status == 'hit':
+                res['hash'] = binascii.hexlify(digest).decode('utf-8', 'ignore')
+                return res, None
+
+        # keep contents only for plugins reading them, see StatePluginBase.content_limit()
+        limit = min(self.max_content_size, self.wanted_content(path, stat.st_size if stat is not None else None))
+        return res, (path, stat, status, limit)
+
+    def _hash_state(self, res, job, read=None, error=None):
+        """
+        Complete state with the content hash computed for job
+
+        The FileRead is passed on to process_state() of other plugins in the transient '_read' key,
+        so they need not open the file again.
+
+        :param res: state dict returned by _stat_state()
+        :param job: hash job returned by _stat_state()
+        :param read: FileRead of the file
+        :param error: exception raised while reading the file
+        :return: completed state dict
+        """
+        (path, stat, status, limit) = job
+        if error is not None:
+            res['hash_error'] = error
+            return res
+        res['_read'] = read
+        digest = read.digest
+        if status is not None:
+            status = self.hash_cache.update(stat, digest, status)
+            if status == 'mismatch':
+                self.app.log.warn("%s content changed but its timestamps did not" % path)
+                res['hash_cache_mismatch'] = True
+        res['hash'] = binascii.hexlify(digest).decode('utf-8', 'ignore')
+        return res
 
-        if compute_hash:
-            res['assume_nochange'] = False
+    # noinspection PyBroadException
+    def get_state(self, url):
+        if not str(url).startswith("file://"):
+            raise UnsupportedException
+        (res, job) = self._stat_state(url)
+        if job is None:
+            return res
+        try:
+            read = read_file(job[0], job[3])
+        except:
+            return self._hash_state(res, job, error=sys.exc_info()[1])
+        return self._hash_state(res, job, read=read)
+
+    def get_states(self, urls):
+        if self.hash_workers <= 1:
+            return super(FilePlugin, self).get_states(urls)
+        return self._get_states_parallel(urls)
+
+    # noinspection PyBroadException
+    def _get_states_parallel(self, urls):
+        """
+        Collect states hashing file contents in a worker pool.
+
+        Stat stays in the calling thread, results are yielded in input order
+        so the caller remains the single writer.
+
+        :param urls: iterable of urls
+        :return: generator of (url, state dict) tuples
+        """
+        if self.hash_pool == 'process':
+            executor = ProcessPoolExecutor(self.hash_workers)
+        else:
+            executor = ThreadPoolExecutor(self.hash_workers)
+
+        def complete(item):
+            (url, res, job, future) = item
+            if future is None:
+                return url, res
             try:
-                digest = compute_from_path(path, hash_algorithm=hashlib.sha256)
-                res['hash'] = binascii.hexlify(digest).decode('utf-8', 'ignore')
+                read = future.result()
             except:
-                e = sys.exc_info()[1]
-                res['hash_error'] = e
+                return url, self._hash_state(res, job, error=sys.exc_info()[1])
+            return url, self._hash_state(res, job, read=read)
 
-        return res
+        pending = collections.deque()
+        try:
+            for url in urls:
+                if not str(url).startswith("file://"):
+                    continue
+                (res, job) = self._stat_state(url)
+                future = None
+                if job is not None:
+                    future = executor.submit(read_file, job[0], job[3])
+                pending.append((url, res, job, future))
+                while len(pending) > self.hash_queue_depth:
+                    yield complete(pending.popleft())
+            while len(pending) > 0:
+                yield complete(pending.popleft())
+        finally:
+            executor.shutdown(wait=True)
+
+    def process_session(self, session):
+        if self.hash_cache is not None:
+            self.hash_cache.flush()
+            self.app.log.debug("%s" % self.hash_cache)
+        self.app.log.debug("user names: %s" % self.user_names)
+        self.app.log.debug("group names: %s" % self.group_names)
+        # kept with the session, slow NSS backends (sssd, LDAP) show up across runs
+        lookup_time = self.user_names.lookup_time + self.group_names.lookup_time
+        session['name_lookup_time'] = round(lookup_time, 3)
+        self.app.log.info("resolved %d user and %d group names in %.3fs" %
+                          (self.user_names.misses, self.group_names.misses, lookup_time))
 
 
 def load(app):
@@ -6,7 +6,8 @@ from cement.core import hook
 
 import os
 
-from syschangemon.core.model import Model
+from syschangemon.core.exc import SysChangeMonConfigError
+from syschangemon.core.model import Model, cache
 
 
 class Storage():
@@ -30,6 +31,13 @@ def extend_app(app):
     # get api info from this plugins configuration
     sdir = app.config.get('storage', 'dir')
 
+    if 'state_cache_size' in app.config.keys('storage'):
+        try:
+            cache.capacity = int(app.config.get('storage', 'state_cache_size'))
+        except ValueError:
+            raise SysChangeMonConfigError("invalid state_cache_size: %s - use a number of states" %
+                                          app.config.get('storage', 'state_cache_size'))
+
     # create an api object and authenticate1
     storage = Storage(sdir, app)
 
@@ -23,6 +23,10 @@ class SysInfoPlugin(StatePluginBase):
         label = 'sysinfo'
         interface = StatePluginInterface
 
+    phases = ('collect',)
+
+    url_schemes = ('sysinfo',)
+
     def setup(self, app):
         super(SysInfoPlugin, self).setup(app)
 
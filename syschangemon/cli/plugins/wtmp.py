@@ -2,13 +2,17 @@
 # Contains code from https://github.com/hjacobs/utmp
 #
 
+import mmap
+import os
 from time import strftime
 
 from cement.core.foundation import CementApp
 from syschangemon.cli.ext.pluginbase import StatePluginBase, StatePluginInterface
 from cement.core import handler
 from syschangemon.core.dictdiff import DictDiff
+from syschangemon.core.intervalindex import IntervalIndex
 from syschangemon.core.sessiondiff import SessionDiff
+from syschangemon.core.wtmpstore import WtmpStore
 from tzlocal.unix import get_localzone
 
 import collections
@@ -51,13 +55,135 @@ class UTmpRecord(collections.namedtuple('UTmpRecord',
 STRUCT = struct.Struct('hi32s4s32s256shhiii4i20s')
 
 
-def utmp_read(buf):
-    offset = 0
-    while offset < len(buf):
+def utmp_read(buf, offset=0, end=None):
+    if end is None:
+        end = len(buf)
+    while offset < end:
         yield UTmpRecord._make(map(convert_string, STRUCT.unpack_from(buf, offset)))
         offset += STRUCT.size
 
 
+# record types pair_sessions() looks at
+BOOT_TIME = UTmpRecordType.boot_time.value
+USER_PROCESS = UTmpRecordType.user_process.value
+DEAD_PROCESS = UTmpRecordType.dead_process.value
+
+# byte offsets of STRUCT fields decoded by utmp_read_logins()
+_LINE = struct.calcsize('hi')
+_USER = struct.calcsize('hi32s4s')
+_HOST = struct.calcsize('hi32s4s32s')
+_SEC = struct.calcsize('hi32s4s32s256shhi')
+_USEC = _SEC + struct.calcsize('i')
+
+# records decoded at once by utmp_read_logins()
+BLOCK_RECORDS = 65536
+
+UTmpLogin = collections.namedtuple('UTmpLogin', 'type line user host sec usec')
+
+
+def _read_logins_block(buf, mv, offset, count):
+    # type, sec and usec columns as strided views of the block, strings only of the records paired
+    block = mv[offset:offset + count * STRUCT.size]
+    types = block.cast('h')[::STRUCT.size // 2].tolist()
+    ints = block.cast('i')
+    secs = ints[_SEC // 4::STRUCT.size // 4].tolist()
+    usecs = ints[_USEC // 4::STRUCT.size // 4].tolist()
+    seq = offset // STRUCT.size
+    base = offset - STRUCT.size
+    for (n, rtype) in enumerate(types):
+        base += STRUCT.size
+        if rtype == USER_PROCESS:
+            yield seq + n, UTmpLogin(rtype,
+                                     buf[base + _LINE:base + _LINE + 32].rstrip(b'\0').decode(),
+                                     buf[base + _USER:base + _USER + 32].rstrip(b'\0').decode(),
+                                     buf[base + _HOST:base + _HOST + 256].rstrip(b'\0').decode(),
+                                     secs[n], usecs[n])
+        elif rtype == DEAD_PROCESS:
+            yield seq + n, UTmpLogin(rtype, buf[base + _LINE:base + _LINE + 32].rstrip(b'\0').decode(),
+                                     '', '', secs[n], usecs[n])
+        elif rtype == BOOT_TIME:
+            yield seq + n, UTmpLogin(rtype, '', '', '', secs[n], usecs[n])
+
+
+def utmp_read_logins(buf, offset=0, end=None):
+    """
+    Decode the records pair_sessions() needs: user_process, dead_process and boot_time
+
+    Record types and times are read column-wise block by block, other records are skipped
+    without creating any object for them. Only fields pairing uses are decoded.
+
+    :param buf: bytes-like wtmp contents, eg. mmap
+    :param offset: byte offset of the first record
+    :param end: byte offset after the last record, end of buf if None
+    :return: generator of (seq, UTmpLogin) tuples, seq is the record number in buf
+    """
+    if end is None:
+        end = len(buf)
+    if (end - offset) % STRUCT.size != 0:
+        raise struct.error("incomplete utmp record")
+    if not hasattr(memoryview, 'cast'):  # python < 3.3
+        for (n, entry) in enumerate(utmp_read(buf, offset, end), offset // STRUCT.size):
+            if entry[0] in (USER_PROCESS, DEAD_PROCESS, BOOT_TIME):
+                yield n, UTmpLogin(entry[0], entry.line, entry.user, entry.host, entry.sec, entry.usec)
+        return
+    with memoryview(buf) as mv:
+        while offset < end:
+            count = min(BLOCK_RECORDS, (end - offset) // STRUCT.size)
+            for item in _read_logins_block(buf, mv, offset, count):
+                yield item
+            offset += count * STRUCT.size
+
+
+def _record_time(entry):
+    return entry.sec + entry.usec*0.000001
+
+
+def pair_sessions(records, open_sessions=()):
+    """
+    Pair login records with the logout or boot records ending them
+
+    Single pass: sessions are open by line until a dead_process record of their line or a
+    boot_time record ends them.
+
+    :param records: iterable of (seq, UTmpRecord or UTmpLogin) tuples in file order, seq is the record
+                    number in the file
+    :param open_sessions: sessions not ended by records read before, see WtmpStore
+    :return: list of session dicts with keys seq, user, host, line, start and end, open sessions
+             first, then sessions started by records - start and end are timestamps, end is
+             None if no record ended the session yet
+    """
+    wtmp_sessions = []
+    open_by_line = {}
+
+    def start(sess):
+        sess['end'] = None
+        wtmp_sessions.append(sess)
+        open_by_line.setdefault(sess['line'], []).append(sess)
+
+    for sess in open_sessions:
+        start(dict(sess))
+    for (seq, entry) in records:
+        # raw type, UTmpRecord.type converts to UTmpRecordType
+        rtype = entry[0]
+        if rtype == USER_PROCESS:
+            start({
+                'seq': seq,
+                'user': entry.user,
+                'host': entry.host,
+                'line': entry.line,
+                'start': _record_time(entry)
+            })
+        elif rtype == DEAD_PROCESS:
+            for sess in open_by_line.pop(entry.line, ()):
+                sess['end'] = _record_time(entry)
+        elif rtype == BOOT_TIME:
+            for sessions in open_by_line.values():
+                for sess in sessions:
+                    sess['end'] = _record_time(entry)
+            open_by_line.clear()
+    return wtmp_sessions
+
+
 class WtmpPlugin(StatePluginBase):
     """
     wtmp plugin base class
@@ -66,57 +192,78 @@ class WtmpPlugin(StatePluginBase):
         label = 'wtmp'
         interface = StatePluginInterface
 
+    phases = ('diff',)
+
+    url_schemes = ()
+
     def __init__(self):
         super(WtmpPlugin, self).__init__()
 
         self.tz = get_localzone()
-        self.wtmp_sessions = []
+        self.path = None
+        # parsed on demand by process_diff()
+        self.wtmp_sessions = None
+        # built by process_diff(), values are positions in wtmp_sessions
+        self.index = None
+        self.reprs = {}
+        self.relevant = set()
+        self.extra = {}
 
     def setup(self, app):
         super(WtmpPlugin, self).setup(app)
 
         c = app.config
 
-        path = c.get(self._meta.label, 'wtmp_path')
-        self.wtmp_sessions = self.parse_wtmp(path)
+        self.path = c.get(self._meta.label, 'wtmp_path')
+
+    def _sessions(self, sessions):
+        # timestamps to datetimes, open sessions last until now
+        now = datetime.now(self.tz)
+        return [{
+            'user': sess['user'],
+            'host': sess['host'],
+            'line': sess['line'],
+            'start': datetime.fromtimestamp(sess['start'], self.tz),
+            'end': datetime.fromtimestamp(sess['end'], self.tz) if sess['end'] is not None else now
+        } for sess in sessions]
 
     def parse_wtmp(self, path):
-        entries = []
+        """
+        Parse login sessions of a whole wtmp file
+
+        :param path: wtmp file path
+        :return: list of session dicts
+        """
         with open(path, 'rb') as fd:
             buf = fd.read()
-            for entry in utmp_read(buf):
-                entries.append(entry)
-
-        wtmp_sessions = []
-        idx = 0
-        now = datetime.now(self.tz)
-        for entry in entries:
-            if entry.type == UTmpRecordType.user_process:
-                found = False
-                for nentry in entries[idx:]:
-                    if nentry.type == UTmpRecordType.dead_process and nentry.line == entry.line:
-                        found = True
-                    if nentry.type == UTmpRecordType.boot_time:
-                        found = True
-                    if found:
-                        wtmp_sessions.append({
-                            'user': entry.user,
-                            'host': entry.host,
-                            'line': entry.line,
-                            'start': datetime.fromtimestamp(entry.sec + entry.usec*0.000001, self.tz),
-                            'end': datetime.fromtimestamp(nentry.sec + nentry.usec*0.000001, self.tz)
-                        })
-                        break
-                if not found:
-                    wtmp_sessions.append({
-                        'user': entry.user,
-                        'host': entry.host,
-                        'line': entry.line,
-                        'start': datetime.fromtimestamp(entry.sec + entry.usec*0.000001, self.tz),
-                        'end': now
-                    })
-            idx += 1
-        return wtmp_sessions
+        records = list(utmp_read_logins(buf))
+        return self._sessions(pair_sessions(records))
+
+    def read_wtmp(self, model):
+        """
+        Get login sessions of the wtmp file, parsing only records appended since the last call
+
+        :param model: storage Model keeping parsed sessions
+        :return: list of session dicts
+        """
+        store = WtmpStore(model, self.path)
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            self.app.log.warn("cannot read %s: %s" % (self.path, e))
+            return []
+        offset = store.resume_offset(stat)
+        # a record being written is left for the next call
+        end = stat.st_size - stat.st_size % STRUCT.size
+        if end > offset:
+            with open(self.path, 'rb') as fd:
+                with mmap.mmap(fd.fileno(), end, access=mmap.ACCESS_READ) as buf:
+                    records = list(utmp_read_logins(buf, offset, end))
+            sessions = pair_sessions(records, store.sessions(open_only=True))
+            store.update(stat, end, sessions)
+            self.app.log.debug("parsed %d wtmp records, %d sessions started or ended" %
+                               ((end - offset) // STRUCT.size, len(sessions)))
+        return self._sessions(store.sessions())
 
     @staticmethod
     def wtmp_sess_repr(sess):
@@ -128,38 +275,52 @@ class WtmpPlugin(StatePluginBase):
 
     def process_diff(self, diff):
 
-        relevant = []
+        self.relevant = set()
+        self.extra = diff.extra
+        if self.wtmp_sessions is None:
+            self.wtmp_sessions = self.read_wtmp(self.app.storage.db)
+
+        self.index = IntervalIndex((sess['start'], sess['end'], idx) for (idx, sess) in enumerate(self.wtmp_sessions))
+        self.reprs = {}
 
         oldstamp = diff.old_session['stamp']
         newstamp = diff.new_session['stamp']
-        for sess in self.wtmp_sessions:
-            if sess['start'] < oldstamp < sess['end'] or \
-                                    sess['start'] < newstamp < sess['end'] or \
-                                    oldstamp < sess['start'] < newstamp or \
-                                    oldstamp < sess['end'] < newstamp:
-                relevant.append(self.wtmp_sess_repr(sess))
-
-        for d in diff.diffs:
-            assert isinstance(d, DictDiff)
-            ts = None
-            if 'mtime' in d.both_neq_tuple.keys():
-                ts = d.both_neq_tuple['mtime'][1]
-            if 'ctime' in d.both_neq_tuple.keys():
-                ts = d.both_neq_tuple['ctime'][1]
-            if ts is not None:
-                #print(type(mtime))
-                res = ""
-                for sess in self.wtmp_sessions:
-                    #print(sess)
-                    if sess['start'] < ts < sess['end']:
-                        relevant.append(self.wtmp_sess_repr(sess))
-
-        if len(relevant) > 0:
-            res = "".join(sorted(set(relevant)))
-            diff.extra['relevant_wtmp'] = res
+        for (start, end, idx) in self.index.overlapping(oldstamp, newstamp):
+            self.relevant.add(self._repr(idx))
+        self._update_extra()
 
         return diff
 
+    def _repr(self, idx):
+        try:
+            return self.reprs[idx]
+        except KeyError:
+            res = self.reprs[idx] = self.wtmp_sess_repr(self.wtmp_sessions[idx])
+            return res
+
+    def process_diff_item(self, diff_item):
+        # diff items are generated while the report is rendered, extra is shown after them
+        assert isinstance(diff_item, DictDiff)
+        ts = None
+        if 'mtime' in diff_item.both_neq_tuple.keys():
+            ts = diff_item.both_neq_tuple['mtime'][1]
+        if 'ctime' in diff_item.both_neq_tuple.keys():
+            ts = diff_item.both_neq_tuple['ctime'][1]
+        if ts is not None:
+            relevant = set(self._repr(idx) for (start, end, idx) in self.index.containing(ts))
+            if len(relevant) > 0:
+                diff_item.plus_info['relevant_wtmp'] = "".join(sorted(relevant))
+                count = len(self.relevant)
+                self.relevant |= relevant
+                if len(self.relevant) > count:
+                    self._update_extra()
+
+        return diff_item
+
+    def _update_extra(self):
+        if len(self.relevant) > 0:
+            self.extra['relevant_wtmp'] = "".join(sorted(self.relevant))
+
 
 def load(app):
     handler.register(WtmpPlugin)
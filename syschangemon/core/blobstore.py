@@ -0,0 +1,119 @@
+"""Content-addressed storage for large state values."""
+import binascii
+import hashlib
+import json
+import zlib
+from functools import lru_cache
+
+
+class BlobStore:
+    """
+    Deduplicated, zlib compressed texts in the 'blobs' table of the storage database.
+
+    Texts are keyed by the sha256 digest of their utf-8 encoding, states reference them
+    by digest. Storing a text that is already stored costs a set lookup only.
+    Blobs no longer referenced by any state are removed by gc().
+    """
+
+    def __init__(self, model, level=6):
+        """
+        :param model: storage Model
+        :param level: zlib compression level
+        """
+        self.model = model
+        self.level = level
+        self.known = None
+        self.stored = 0
+        self.reused = 0
+        self.model.query('CREATE TABLE IF NOT EXISTS blobs ('
+                         'digest BLOB NOT NULL PRIMARY KEY, codec TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'data BLOB NOT NULL)')
+        self.get = lru_cache(maxsize=256)(self._load)
+
+    def put(self, text):
+        """
+        Store text unless already stored
+
+        :param text: string
+        :return: hex digest of text
+        """
+        data = text.encode('utf-8', 'surrogatepass')
+        digest = hashlib.sha256(data).digest()
+        if self.known is None:
+            self.known = set(bytes(row[0]) for row in self.model.query('SELECT digest FROM blobs'))
+        if digest in self.known:
+            self.reused += 1
+        else:
+            packed = zlib.compress(data, self.level)
+            if len(packed) < len(data):
+                self.model.query('INSERT OR IGNORE INTO blobs (digest, codec, size, data) VALUES (?, ?, ?, ?)',
+                                 [digest, 'zlib', len(data), packed])
+            else:
+                self.model.query('INSERT OR IGNORE INTO blobs (digest, codec, size, data) VALUES (?, ?, ?, ?)',
+                                 [digest, 'raw', len(data), data])
+            self.known.add(digest)
+            self.stored += 1
+        return binascii.hexlify(digest).decode('ascii')
+
+    @staticmethod
+    def _decode(codec, data):
+        data = bytes(data)
+        if codec == 'zlib':
+            data = zlib.decompress(data)
+        return data.decode('utf-8', 'surrogatepass')
+
+    def _load(self, hexdigest):
+        row = self.model.query('SELECT codec, data FROM blobs WHERE digest = ?', [binascii.unhexlify(hexdigest)]).fetchone()
+        if row is None:
+            raise KeyError("blob %s not found" % hexdigest)
+        return self._decode(row[0], row[1])
+
+    def get_many(self, hexdigests, chunk_size=500):
+        """
+        Load several texts, a query per chunk of digests
+
+        :param hexdigests: iterable of hex digests
+        :param chunk_size: number of digests per query
+        :return: dict of hex digest -> text
+        """
+        hexdigests = sorted(set(hexdigests))
+        res = {}
+        for idx in range(0, len(hexdigests), chunk_size):
+            chunk = [binascii.unhexlify(d) for d in hexdigests[idx:idx + chunk_size]]
+            for row in self.model.query('SELECT digest, codec, data FROM blobs WHERE digest IN (%s)' %
+                                        ', '.join('?' * len(chunk)), chunk):
+                res[binascii.hexlify(bytes(row[0])).decode('ascii')] = self._decode(row[1], row[2])
+        for hexdigest in hexdigests:
+            if hexdigest not in res:
+                raise KeyError("blob %s not found" % hexdigest)
+        return res
+
+    def gc(self):
+        """
+        Remove blobs not referenced by any state
+
+        :return: number of removed blobs
+        """
+        referenced = set()
+        for row in self.model.query('SELECT extras FROM states WHERE extras LIKE ?', ['%"blob":%']):
+            for v in json.loads(row[0]).values():
+                if isinstance(v, dict) and 'blob' in v:
+                    referenced.add(binascii.unhexlify(v['blob']))
+        unreferenced = [(bytes(row[0]),) for row in self.model.query('SELECT digest FROM blobs')
+                        if bytes(row[0]) not in referenced]
+        with self.model.transaction():
+            self.model.executemany('DELETE FROM blobs WHERE digest = ?', unreferenced)
+        self.known = None
+        self.get.cache_clear()
+        return len(unreferenced)
+
+    def delete(self):
+        """
+        Remove all blobs
+        """
+        self.model.query('DELETE FROM blobs')
+        self.known = None
+        self.get.cache_clear()
+
+    def __repr__(self):
+        return "blob store: %d stored, %d reused" % (self.stored, self.reused)
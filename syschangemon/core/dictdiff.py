@@ -1,26 +1,17 @@
-try:
-    from urllib.parse import urlparse, unquote
-except ImportError:
-    from urlparse import urlparse
-    from urllib import unquote
-
-from diff_match_patch.diff_match_patch import diff_match_patch
+from syschangemon.core.textdiff import TextDiff
 
 
 class DictDiff:
 
+    # multi-line values are diffed without caching unless a TextDiff is passed
+    default_text_diff = TextDiff()
+
     def _diff_text(self, t1, t2):
-        diff = diff_match_patch()
-        diff.Diff_Timeout = 1
-        a = diff.diff_linesToChars(t1, t2)
-        diffs = diff.diff_main(a[0], a[1], False)
-        diff.diff_charsToLines(diffs, a[2])
-        diff.diff_cleanupEfficiency(diffs)
-        patch = diff.patch_make(diffs)
-        return unquote(diff.patch_toText(patch).replace('%0A', ''))
+        return self.text_diff.diff(t1, t2)
 
-    def __init__(self, dict1, label1, dict2, label2, ignore_keys=[]):
+    def __init__(self, dict1, label1, dict2, label2, ignore_keys=[], text_diff=None):
 
+        self.text_diff = text_diff if text_diff is not None else self.default_text_diff
         self.plus_info = {}
         self.label1 = label1
         self.label2 = label2
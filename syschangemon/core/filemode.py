@@ -0,0 +1,123 @@
+"""File mode values stored as st_mode integers and shown in textual form."""
+from stat import *
+
+
+def st_mode_repr(mode):
+    """
+    Calculate textual representation of binary inode mode.
+
+    Sample output for regular file with mode 0644: 'u=rw-,g=r--,o=r--'
+
+    :param mode: st_mode integer returned by os.stat()
+    :return: textual representation of st_mode
+    """
+    res = ""
+    if S_ISBLK(mode):
+        res += "blk "
+    if S_ISCHR(mode):
+        res += "chr "
+    if S_ISDIR(mode):
+        res += "dir "
+    if S_ISFIFO(mode):
+        res += "fifo "
+    if S_ISLNK(mode):
+        res += "sym "
+    if S_ISSOCK(mode):
+        res += "sock "
+    if mode | S_ISUID == mode:
+        res += "setuid "
+    if mode | S_ISGID == mode:
+        res += "setgid "
+    if mode | S_ISVTX == mode:
+        res += "sticky "
+    res += "u="
+    if mode | S_IRUSR == mode:
+        res += "r"
+    else:
+        res += "-"
+    if mode | S_IWUSR == mode:
+        res += "w"
+    else:
+        res += "-"
+    if mode | S_IXUSR == mode:
+        res += "x"
+    else:
+        res += "-"
+    res += ",g="
+    if mode | S_IRGRP == mode:
+        res += "r"
+    else:
+        res += "-"
+    if mode | S_IWGRP == mode:
+        res += "w"
+    else:
+        res += "-"
+    if mode | S_IXGRP == mode:
+        res += "x"
+    else:
+        res += "-"
+    res += ",o="
+    if mode | S_IROTH == mode:
+        res += "r"
+    else:
+        res += "-"
+    if mode | S_IWOTH == mode:
+        res += "w"
+    else:
+        res += "-"
+    if mode | S_IXOTH == mode:
+        res += "x"
+    else:
+        res += "-"
+
+    return res
+
+
+_type_flags = [('blk', S_IFBLK), ('chr', S_IFCHR), ('dir', S_IFDIR), ('fifo', S_IFIFO), ('sym', S_IFLNK),
+               ('sock', S_IFSOCK)]
+_special_flags = [('setuid', S_ISUID), ('setgid', S_ISGID), ('sticky', S_ISVTX)]
+_perm_flags = [('u', S_IRUSR, S_IWUSR, S_IXUSR), ('g', S_IRGRP, S_IWGRP, S_IXGRP), ('o', S_IROTH, S_IWOTH, S_IXOTH)]
+
+
+def parse_mode_repr(text):
+    """
+    Convert output of st_mode_repr() back to st_mode, used for migrating textual modes.
+
+    File type bits are set to a regular file unless the text names another type.
+
+    :param text: textual representation of st_mode
+    :return: st_mode integer
+    :raises ValueError: if text is not in st_mode_repr() format
+    """
+    words = text.split(' ')
+    perms = words.pop().split(',')
+    mode = S_IFREG
+    for word in words:
+        types = [flag for name, flag in _type_flags if name == word]
+        specials = [flag for name, flag in _special_flags if name == word]
+        if len(types) > 0:
+            mode = (mode & ~S_IFMT(mode)) | types[0]
+        elif len(specials) > 0:
+            mode |= specials[0]
+        else:
+            raise ValueError("invalid mode: %s" % text)
+    if len(perms) != 3:
+        raise ValueError("invalid mode: %s" % text)
+    for perm, (who, r, w, x) in zip(perms, _perm_flags):
+        if len(perm) != 5 or perm[0:2] != who + '=':
+            raise ValueError("invalid mode: %s" % text)
+        for char, letter, flag in zip(perm[2:], 'rwx', (r, w, x)):
+            if char == letter:
+                mode |= flag
+            elif char != '-':
+                raise ValueError("invalid mode: %s" % text)
+    return mode
+
+
+class FileMode(int):
+    """
+    st_mode integer printed in st_mode_repr() form
+    """
+
+    def __str__(self):
+        return st_mode_repr(self)
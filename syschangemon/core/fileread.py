@@ -0,0 +1,65 @@
+"""Single pass file reading for hashing, binary detection and content capture."""
+import collections
+import hashlib
+
+from binaryornot.helpers import is_binary_string
+
+# number of leading bytes binary detection looks at, same as binaryornot.check.is_binary()
+SNIFF_SIZE = 1024
+
+# read buffer size
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileRead(collections.namedtuple('FileRead', 'path size digest head content')):
+    """
+    Result of read_file()
+
+    size is the number of bytes read, digest the sha256 digest of them (None if not computed),
+    head the first SNIFF_SIZE bytes and content all bytes, or None if the file was larger
+    than the content limit.
+    """
+
+    @property
+    def is_binary(self):
+        # binaryornot.check.is_binary() also treats compiled python files as binary
+        if self.path.endswith('.pyc'):
+            return True
+        return is_binary_string(self.head)
+
+
+def read_file(path, content_limit=0, digest=True):
+    """
+    Read a file once, feeding the same buffers to the hasher, binary detection and content capture
+
+    :param path: file path
+    :param content_limit: keep contents of files up to this many bytes
+    :param digest: compute sha256 digest
+    :return: FileRead
+    """
+    hasher = hashlib.sha256() if digest else None
+    chunks = []
+    head = b''
+    size = 0
+    with open(path, mode='rb') as fd:
+        while True:
+            chunk = fd.read(CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            if size < SNIFF_SIZE:
+                head += chunk[:SNIFF_SIZE - size]
+            size += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            if chunks is not None:
+                if size <= content_limit:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+                    if hasher is None and len(head) >= SNIFF_SIZE:
+                        # nothing else to read for
+                        break
+    return FileRead(path, size,
+                    hasher.digest() if hasher is not None else None,
+                    head,
+                    b''.join(chunks) if chunks is not None else None)
@@ -0,0 +1,143 @@
+"""Lazy filesystem enumeration built on os.scandir."""
+import os
+
+try:
+    from os import scandir
+except ImportError:  # python < 3.5
+    scandir = None
+
+
+class _ListdirEntry:
+    """
+    Minimal os.DirEntry stand-in for interpreters without os.scandir
+    """
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isfile(self.path)
+
+
+def _list_dir(path):
+    """
+    List directory entries, type information is cached by the OS where possible
+
+    :param path: directory path
+    :return: list of DirEntry-like objects, empty list if path is not readable
+    """
+    try:
+        if scandir is not None:
+            return list(scandir(path))
+        return [_ListdirEntry(path, name) for name in os.listdir(path)]
+    except OSError:
+        # unreadable or vanished directory - os.walk() ignores these as well
+        return []
+
+
+def _is_file(entry):
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def _is_walkable_dir(entry):
+    try:
+        # do not follow symlinks to directories, same as os.walk()
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def _is_below(path, base):
+    """
+    Check whether path equals base or lies below it
+
+    :param path: normalized path
+    :param base: normalized base path
+    :return: True if path is inside base
+    """
+    if path == base:
+        return True
+    if not base.endswith(os.sep):
+        base += os.sep
+    return path.startswith(base)
+
+
+def normalize_bases(flat, deep):
+    """
+    Remove walk destinations already covered by a recursive walk, so no file is enumerated twice
+
+    :param flat: list of directories to list without recursion
+    :param deep: list of directories to walk recursively
+    :return: tuple of two lists (flat, deep) without overlapping entries
+    """
+    deep_res = []
+    for d in sorted(set(deep), key=lambda x: len(os.path.normpath(x))):
+        if not any(_is_below(os.path.normpath(d), os.path.normpath(x)) for x in deep_res):
+            deep_res.append(d)
+
+    flat_res = []
+    for f in sorted(set(flat)):
+        if not any(_is_below(os.path.normpath(f), os.path.normpath(x)) for x in deep_res):
+            flat_res.append(f)
+
+    return flat_res, deep_res
+
+
+def walk_files(flat, deep, include=None, exclude=None, prune=None):
+    """
+    Lazily enumerate files (or symlinks to files) below a set of base directories.
+
+    Directory entry types are taken from os.scandir() so regular files and
+    directories cost no extra stat() call. Directories accepted by the prune
+    predicate are not descended into at all.
+
+    :param flat: list of directories whose immediate children are enumerated
+    :param deep: list of directories enumerated recursively
+    :param include: predicate on file paths, only accepted files are yielded
+    :param exclude: predicate on file paths, accepted files are skipped
+    :param prune: predicate on directory paths, accepted directories are skipped with all their contents
+    :return: generator of file paths
+    """
+    (flat, deep) = normalize_bases(flat, deep)
+
+    def accept(path):
+        if include is not None and not include(path):
+            return False
+        if exclude is not None and exclude(path):
+            return False
+        return True
+
+    # collect flat includes
+    for f in flat:
+        if prune is not None and prune(f):
+            continue
+        for entry in _list_dir(f):
+            if _is_file(entry) and accept(entry.path):
+                yield entry.path
+
+    # collect deep (recursive) includes, depth first in os.walk(topdown=True) order
+    for d in deep:
+        if prune is not None and prune(d):
+            continue
+        stack = [d]
+        while stack:
+            root = stack.pop()
+            subdirs = []
+            for entry in _list_dir(root):
+                if _is_walkable_dir(entry):
+                    if prune is None or not prune(entry.path):
+                        subdirs.append(entry.path)
+                elif _is_file(entry) and accept(entry.path):
+                    yield entry.path
+            stack.extend(reversed(subdirs))
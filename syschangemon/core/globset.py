@@ -0,0 +1,114 @@
+"""Glob pattern lists compiled into a single matcher."""
+import re
+
+import globre
+from globre import Tokenizer
+
+
+class GlobSet:
+    """
+    Set of globre patterns matched in one pass.
+
+    Patterns are sorted into buckets by shape: literal paths are looked up in
+    a set, 'prefix**' and '**suffix' patterns are checked with one
+    str.startswith() / str.endswith() call each, everything else is compiled
+    into a single regex alternation. Answers are the same as trying every
+    ``globre.compile(pat, flags=globre.EXACT)`` in turn.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.regexes = [globre.compile(pat, flags=globre.EXACT, split_prefix=False) for pat in self.patterns]
+
+        self.literals = set()
+        prefixes = []
+        suffixes = []
+        self.wild_regexes = []
+        for pat, regex in zip(self.patterns, self.regexes):
+            tokens = self._tokenize(pat)
+            kinds = [token[0] for token in tokens]
+            if kinds == [Tokenizer.LITERAL]:
+                self.literals.add(tokens[0][1])
+            elif kinds == [Tokenizer.ANY]:
+                prefixes.append('')
+            elif kinds == [Tokenizer.LITERAL, Tokenizer.ANY]:
+                prefixes.append(tokens[0][1])
+            elif kinds == [Tokenizer.ANY, Tokenizer.LITERAL]:
+                suffixes.append(tokens[1][1])
+            else:
+                self.wild_regexes.append(regex)
+
+        self.prefixes = tuple(prefixes)
+        self.suffixes = tuple(suffixes)
+
+        self.regex = None
+        if len(self.wild_regexes) > 0:
+            try:
+                self.regex = re.compile('|'.join('(?:%s)' % r.pattern for r in self.wild_regexes))
+            except (re.error, AssertionError):
+                # inlined {...} regex expressions may not combine, eg. too many groups
+                self.regex = None
+
+    @staticmethod
+    def _tokenize(pat):
+        """
+        tokenize glob pattern merging adjacent literal tokens (eg. around escaped characters)
+
+        :param pat: glob pattern
+        :return: list of (kind, value) tokens
+        """
+        res = []
+        for token in Tokenizer(pat).tokens():
+            if token[0] == Tokenizer.LITERAL and len(res) > 0 and res[-1][0] == Tokenizer.LITERAL:
+                res[-1] = (Tokenizer.LITERAL, res[-1][1] + token[1])
+            else:
+                res.append((token[0], token[1]))
+        return res
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __repr__(self):
+        return 'GlobSet(%r)' % self.patterns
+
+    @staticmethod
+    def _match_any(path, regexes):
+        for regex in regexes:
+            if regex.match(path):
+                return True
+        return False
+
+    def match(self, path):
+        """
+        Check whether path matches any pattern of the set
+
+        :param path: path string
+        :return: True if at least one pattern matches
+        """
+        if '\n' in path:
+            # '.' does not match newlines while '$' matches before a trailing one
+            # leave these rare paths to the per-pattern expressions
+            return self._match_any(path, self.regexes)
+        if path in self.literals:
+            return True
+        if self.prefixes and path.startswith(self.prefixes):
+            return True
+        if self.suffixes and path.endswith(self.suffixes):
+            return True
+        if self.regex is not None:
+            return self.regex.match(path) is not None
+        if self.wild_regexes:
+            return self._match_any(path, self.wild_regexes)
+        return False
+
+    def matching_pattern(self, path):
+        """
+        Find the first pattern matching path, useful for diagnostics
+
+        :param path: path string
+        :return: matching pattern string or None
+        """
+        for pat, regex in zip(self.patterns, self.regexes):
+            if regex.match(path):
+                return pat
+        return None
@@ -0,0 +1,161 @@
+""" Persistent content hash cache """
+import random
+import time
+
+
+def stat_ns(stat):
+    """
+    Get (mtime, ctime) of a stat result in nanoseconds
+
+    :param stat: os.stat() result
+    :return: tuple of two integers
+    """
+    if hasattr(stat, 'st_mtime_ns'):
+        return stat.st_mtime_ns, stat.st_ctime_ns
+    # python < 3.3
+    return int(stat.st_mtime * 1000000000), int(stat.st_ctime * 1000000000)
+
+
+class HashCache:
+    """
+    Map of file identity (device, inode) and (size, mtime, ctime) to the last computed content digest.
+
+    Entries live in the 'hashcache' table of the storage database, independent of sessions,
+    so they survive session cleanup, database reset and file renames. The whole table is
+    loaded at once and written back by flush(), which also evicts entries for inodes that
+    were not seen during the run.
+    """
+
+    # do not trust timestamps this close (in ns) to the run start, the file may still be written
+    racy_window = 2 * 1000000000
+
+    def __init__(self, model, verify_ratio=0.0):
+        """
+        :param model: storage Model
+        :param verify_ratio: ratio (0.0 - 1.0) of cache hits to re-hash for detecting forged timestamps
+        """
+        self.model = model
+        self.verify_ratio = float(verify_ratio)
+        self.random = random.SystemRandom()
+        self.start_ns = int(time.time() * 1000000000)
+
+        self.model.query('CREATE TABLE IF NOT EXISTS hashcache ('
+                         'dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, '
+                         'mtime_ns INTEGER NOT NULL, ctime_ns INTEGER NOT NULL, digest BLOB NOT NULL, '
+                         'PRIMARY KEY (dev, ino))')
+
+        self.entries = {}
+        for row in self.model.query('SELECT dev, ino, size, mtime_ns, ctime_ns, digest FROM hashcache'):
+            self.entries[(row[0], row[1])] = (row[2], row[3], row[4], bytes(row[5]))
+
+        self.seen = set()
+        self.dirty = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.verified = 0
+        self.mismatches = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(stat):
+        (mtime_ns, ctime_ns) = stat_ns(stat)
+        return (stat.st_dev, stat.st_ino), (stat.st_size, mtime_ns, ctime_ns)
+
+    def touch(self, stat):
+        """
+        Keep the entry of a file not looked up, eg. because its state was assumed unchanged
+
+        :param stat: os.stat() result of the file
+        """
+        self.seen.add(self._key(stat)[0])
+
+    def lookup(self, stat):
+        """
+        Look up cached digest of a file
+
+        :param stat: os.stat() result of the file taken before reading its contents
+        :return: tuple (digest, status), status is 'hit' if digest can be used as is,
+                 'verify' if the file should be hashed anyway and passed to update(),
+                 'miss' (digest is None) if the file must be hashed and passed to update()
+        """
+        (ident, key) = self._key(stat)
+        self.seen.add(ident)
+
+        entry = self.entries.get(ident)
+        if entry is not None and entry[0:3] == key:
+            if self.verify_ratio <= 0 or self.random.random() >= self.verify_ratio:
+                self.hits += 1
+                return entry[3], 'hit'
+            return entry[3], 'verify'
+
+        self.misses += 1
+        return None, 'miss'
+
+    def update(self, stat, digest, status):
+        """
+        Store digest computed after lookup() returned 'miss' or 'verify'
+
+        :param stat: os.stat() result passed to lookup()
+        :param digest: freshly computed digest
+        :param status: status returned by lookup()
+        :return: final status: 'miss', 'verified' or 'mismatch'
+        """
+        (ident, key) = self._key(stat)
+        if status == 'verify':
+            self.verified += 1
+            entry = self.entries.get(ident)
+            if entry is not None and entry[3] == digest:
+                return 'verified'
+            self.mismatches += 1
+            status = 'mismatch'
+        self._put(ident, key, digest)
+        return status
+
+    def get(self, path, stat, compute):
+        """
+        Get content digest of a file, computing it only if the cache has no valid entry
+
+        :param path: file path
+        :param stat: os.stat() result of path taken before reading its contents
+        :param compute: callable computing the digest of a path
+        :return: tuple (digest, status), status is one of 'hit', 'miss', 'verified' or 'mismatch'
+        """
+        (digest, status) = self.lookup(stat)
+        if status == 'hit':
+            return digest, status
+        digest = compute(path)
+        return digest, self.update(stat, digest, status)
+
+    def _put(self, ident, key, digest):
+        if key[1] >= self.start_ns - self.racy_window or key[2] >= self.start_ns - self.racy_window:
+            # recently modified - may be modified again within timestamp resolution
+            self.entries.pop(ident, None)
+        else:
+            self.entries[ident] = key + (digest,)
+        self.dirty.add(ident)
+
+    def flush(self, evict=True):
+        """
+        Write changed entries back to the database
+
+        :param evict: also remove entries of inodes not seen since this cache was loaded
+        """
+        if evict:
+            unseen = set(self.entries.keys()) - self.seen
+            for ident in unseen:
+                del self.entries[ident]
+            self.dirty |= unseen
+            self.evictions += len(unseen)
+
+        with self.model.transaction():
+            self.model.executemany('DELETE FROM hashcache WHERE dev = ? AND ino = ?',
+                                   [ident for ident in self.dirty if ident not in self.entries])
+            self.model.executemany('INSERT OR REPLACE INTO hashcache (dev, ino, size, mtime_ns, ctime_ns, digest) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   [ident + self.entries[ident] for ident in self.dirty if ident in self.entries])
+        self.dirty = set()
+
+    def __repr__(self):
+        return "hash cache: %d entries, %d hits, %d misses, %d verified, %d mismatches, %d evictions" % \
+               (len(self.entries), self.hits, self.misses, self.verified, self.mismatches, self.evictions)
@@ -0,0 +1,98 @@
+""" Static interval index for stabbing and overlap queries """
+import bisect
+
+
+class _Node:
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+
+class IntervalIndex:
+    """
+    Centered interval tree of (start, end, value) tuples, built once.
+
+    Each node keeps the intervals containing its center sorted by start and by end, intervals
+    ending before the center go to the left subtree, the ones starting after it to the right.
+    Queries cost O(log n + k) for k results. Bounds are compared strictly: an interval
+    (start, end) contains t if start < t < end.
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: iterable of (start, end, value) tuples
+        """
+        intervals = sorted(intervals, key=lambda x: x[0])
+        # empty or reversed intervals contain no point
+        self.root = self._build([i for i in intervals if i[0] < i[1]])
+        self.starts = [i[0] for i in intervals]
+        self.by_start = intervals
+        self.by_end = sorted(intervals, key=lambda x: x[1])
+        self.ends = [i[1] for i in self.by_end]
+
+    def __len__(self):
+        return len(self.by_start)
+
+    @classmethod
+    def _build(cls, intervals):
+        # intervals are sorted by start
+        if len(intervals) == 0:
+            return None
+        node = _Node()
+        node.center = intervals[len(intervals) // 2][0]
+        left = []
+        right = []
+        here = []
+        for i in intervals:
+            if i[1] < node.center:
+                left.append(i)
+            elif i[0] > node.center:
+                right.append(i)
+            else:
+                here.append(i)
+        node.by_start = here
+        node.by_end = sorted(here, key=lambda x: x[1], reverse=True)
+        node.left = cls._build(left)
+        node.right = cls._build(right)
+        return node
+
+    def containing(self, t):
+        """
+        Generate intervals containing t
+
+        :param t: point
+        :return: generator of (start, end, value) tuples
+        """
+        node = self.root
+        while node is not None:
+            if t < node.center:
+                # all intervals of node end at or after center
+                for i in node.by_start:
+                    if i[0] >= t:
+                        break
+                    yield i
+                node = node.left
+            elif t > node.center:
+                # all intervals of node start at or before center
+                for i in node.by_end:
+                    if i[1] <= t:
+                        break
+                    yield i
+                node = node.right
+            else:
+                for i in node.by_start:
+                    if i[0] < t < i[1]:
+                        yield i
+                return
+
+    def overlapping(self, t1, t2):
+        """
+        Get intervals containing t1 or t2, or starting or ending between them
+
+        :param t1: window start
+        :param t2: window end
+        :return: set of (start, end, value) tuples
+        """
+        res = set(self.containing(t1))
+        res.update(self.containing(t2))
+        res.update(self.by_start[bisect.bisect_right(self.starts, t1):bisect.bisect_left(self.starts, t2)])
+        res.update(self.by_end[bisect.bisect_right(self.ends, t1):bisect.bisect_left(self.ends, t2)])
+        return res
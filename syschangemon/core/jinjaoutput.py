@@ -114,6 +114,20 @@ class JinjaOutputHandler(TemplateOutputHandler):
         jt = self.env.get_template(template)
         return jt.render(data_dict, **kw)
 
+    def stream(self, data_dict, fd, **kw):
+        """
+        Render template into a file object chunk by chunk, without joining the output into one string first
+
+        :param data_dict: template variables
+        :param fd: text file object to write to
+        """
+        template = kw.get('template', None)
+
+        LOG.debug("streaming output using '%s' as a template." % template)
+        jt = self.env.get_template(template)
+        for chunk in jt.generate(data_dict, **kw):
+            fd.write(chunk)
+
     def render_from_string(self, source, data_dict, gglobals=None, template_class=None, **kw):
         jt = self.env.from_string(source, globals=gglobals, template_class=template_class)
         return jt.render(data_dict, **kw)
@@ -1,8 +1,13 @@
 # coding=utf-8
 
 """ System Change Data Model Classes """
+import base64
+import binascii
+import hashlib
+import json
 import re
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 try:
     from urllib.parse import urlparse
@@ -16,6 +21,10 @@ from playhouse.dataset import DataSet
 from playhouse.dataset import Table
 from tzlocal.unix import get_localzone
 
+from syschangemon.core.blobstore import BlobStore
+from syschangemon.core.reportstore import ReportStore
+from syschangemon.core.filemode import FileMode, parse_mode_repr
+
 
 class MyDataSet(DataSet):
 
@@ -60,23 +69,230 @@ class MyTable(Table):
 date_pat = re.compile('[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}')
 
 
+def decode_value(v):
+    """
+    Convert value read from the database back to its python representation
+
+    :param v: raw column value
+    :return: decoded value
+    """
+    try:
+        # hack string timestamps back to datetime
+        if isinstance(v, str):
+            if len(v) < 100 and date_pat.match(v):
+                v = parse(v, yearfirst=True, dayfirst=False, fuzzy=True)
+        # hack bytes back to utf8 strings
+        if isinstance(v, bytes) or isinstance(v, bytearray):
+            v = v.decode('utf-8')
+    except ValueError:
+        pass
+    return v
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def datetime_to_ns(dt):
+    """
+    Convert datetime to nanoseconds since the epoch, naive datetimes are taken as local time
+
+    :param dt: datetime
+    :return: integer
+    """
+    if dt.tzinfo is None:
+        dt = get_localzone().localize(dt)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+def ns_to_datetime(ns, tz):
+    """
+    Convert nanoseconds since the epoch to datetime
+
+    :param ns: integer
+    :param tz: time zone of the result
+    :return: datetime
+    """
+    return (EPOCH + timedelta(microseconds=ns // 1000)).astimezone(tz)
+
+
+def _encode_int(v):
+    if isinstance(v, int) and not isinstance(v, bool):
+        return int(v)
+    raise TypeError
+
+
+def _encode_str(v):
+    if isinstance(v, str):
+        return v
+    raise TypeError
+
+
+def _encode_time(v):
+    if isinstance(v, datetime):
+        return datetime_to_ns(v)
+    raise TypeError
+
+
+def _encode_hash(v):
+    # hex sha256 digests are stored as 32 byte blobs
+    if isinstance(v, str) and len(v) == 64 and v == v.lower():
+        return binascii.unhexlify(v)
+    raise TypeError
+
+
+# state key -> (column, encoder, decoder) for values stored in a typed column of the states table
+# encoders raise TypeError or ValueError for values of other types, these are stored in extras
+state_fields = OrderedDict([
+    ('plugin', ('plugin', _encode_str, None)),
+    ('size', ('size', _encode_int, None)),
+    ('mtime', ('mtime_ns', _encode_time, ns_to_datetime)),
+    ('ctime', ('ctime_ns', _encode_time, ns_to_datetime)),
+    ('mode', ('mode', _encode_int, lambda v, tz: FileMode(v))),
+    ('uid', ('uid', _encode_int, None)),
+    ('gid', ('gid', _encode_int, None)),
+    ('hash', ('hash', _encode_hash, lambda v, tz: binascii.hexlify(v).decode('ascii'))),
+])
+
+state_columns = ('sessionid', 'url') + tuple(f[0] for f in state_fields.values()) + ('fingerprint', 'extras')
+state_field_idx = dict((k, i + 2) for i, k in enumerate(state_fields.keys()))
+fingerprint_idx = state_columns.index('fingerprint')
+extras_idx = state_columns.index('extras')
+
+# keys not taken into account when comparing states of two sessions, duration is the run time of commands
+diff_ignore_keys = ['id', 'sessionid', 'uuid', 'assume_nochange', 'duration']
+
+# texts of at least this many characters are moved to the blob store
+blob_threshold = 256
+
+
+def _encode_extra(v, store_blob=None):
+    if isinstance(v, str) and store_blob is not None and len(v) >= blob_threshold:
+        return {'blob': store_blob(v)}
+    if v is None or isinstance(v, (str, bool, int, float)):
+        return v
+    if isinstance(v, datetime):
+        return {'dt': datetime_to_ns(v)}
+    if isinstance(v, (bytes, bytearray)):
+        return {'b': base64.b64encode(v).decode('ascii')}
+    # eg. exceptions - stored as text like before
+    return str(v)
+
+
+def _decode_extra(v, tz, load_blob=None):
+    if isinstance(v, dict):
+        if 'blob' in v:
+            if load_blob is None:
+                raise ValueError("state references blob %s but no blob store is given" % v['blob'])
+            return load_blob(v['blob'])
+        if 'dt' in v:
+            return ns_to_datetime(v['dt'], tz)
+        if 'b' in v:
+            return base64.b64decode(v['b'].encode('ascii'))
+    return v
+
+
+def fingerprint(typed, extras):
+    """
+    Compute 64 bit fingerprint of an encoded state
+
+    The url and keys in diff_ignore_keys are left out, so states with equal fingerprints
+    compare equal in SessionDiff. Long texts are fingerprinted by their blob digest.
+
+    :param typed: values of the typed columns in state_fields order
+    :param extras: dict of encoded extra values
+    :return: signed integer fitting a sqlite INTEGER
+    """
+    values = [binascii.hexlify(v).decode('ascii') if isinstance(v, bytes) else v for v in typed]
+    extras = dict((k, v) for k, v in extras.items() if k not in diff_ignore_keys)
+    data = json.dumps([values, extras], sort_keys=True, separators=(',', ':'))
+    return int.from_bytes(hashlib.md5(data.encode('utf-8', 'surrogatepass')).digest()[:8], 'big', signed=True)
+
+
+def encode_state(state, store_blob=None):
+    """
+    Convert state to a row of the states table
+
+    Keys without a typed column and values not fitting their column are packed into the JSON extras column.
+    Transient keys starting with '_' are not stored.
+
+    :param state: state dict
+    :param store_blob: callable storing a long text and returning its digest, texts are kept inline if None
+    :return: tuple of values in state_columns order
+    """
+    row = [state['sessionid'], state['url']] + [None] * (len(state_columns) - 2)
+    extras = {}
+    for k, v in state.items():
+        if k == 'sessionid' or k == 'url' or k.startswith('_'):
+            continue
+        idx = state_field_idx.get(k)
+        if idx is not None and v is not None:
+            try:
+                row[idx] = state_fields[k][1](v)
+                continue
+            except (TypeError, ValueError):
+                pass
+        extras[k] = _encode_extra(v, store_blob)
+    row[fingerprint_idx] = fingerprint(row[2:fingerprint_idx], extras)
+    if len(extras) > 0:
+        row[extras_idx] = json.dumps(extras, sort_keys=True, separators=(',', ':'))
+    return tuple(row)
+
+
+def decode_state(row, tz, load_blob=None):
+    """
+    Convert row of the states table to a state dict
+
+    :param row: tuple of values in state_columns order
+    :param tz: time zone of timestamps
+    :param load_blob: callable returning the text stored under a digest
+    :return: dict
+    """
+    res = {'sessionid': row[0], 'url': row[1]}
+    for (key, (column, encoder, decoder)), v in zip(state_fields.items(), row[2:fingerprint_idx]):
+        if v is not None:
+            res[key] = v if decoder is None else decoder(v, tz)
+    if row[extras_idx] is not None:
+        for k, v in json.loads(row[extras_idx]).items():
+            res[k] = _decode_extra(v, tz, load_blob)
+    return res
+
+
+legacy_id_pat = re.compile('^([0-9]+)(?: \\((.*)\\))?$')
+
+
+def legacy_state(d):
+    """
+    Convert row of the dynamic column states table used before the typed schema
+
+    :param d: dict of column name -> raw value
+    :return: state dict
+    """
+    res = {}
+    for k, v in d.items():
+        if k != 'id' and v is not None:
+            res[k] = decode_value(v)
+    if isinstance(res.get('mode'), str):
+        try:
+            res['mode'] = FileMode(parse_mode_repr(res['mode']))
+        except ValueError:
+            pass
+    # uid and gid used to be stored as '0 (root)'
+    for key, name_key in [('uid', 'user'), ('gid', 'group')]:
+        m = legacy_id_pat.match(res[key]) if isinstance(res.get(key), str) else None
+        if m is not None:
+            res[key] = int(m.group(1))
+            if m.group(2) is not None:
+                res[name_key] = m.group(2)
+    return res
+
+
 class State(dict):
 
     @staticmethod
-    def from_dict(model, d):
+    def from_row(model, row):
         res = State(model, None)
-        for k, v in d.items():
-            try:
-                # hack string timestamps back to datetime
-                if isinstance(v, str):
-                    if len(v) < 100 and date_pat.match(v):
-                        v = parse(v, yearfirst=True, dayfirst=False, fuzzy=True)
-                # hack bytes back to utf8 strings
-                if isinstance(v, bytes) or isinstance(v, bytearray):
-                    v = v.decode('utf-8')
-            except ValueError:
-                pass
-            res[k] = v
+        res.update(decode_state(row, model.tz, model.blobs.get))
         return res
 
     def __init__(self, model, sessionid, url=None, **kwargs):
@@ -88,14 +304,25 @@ class State(dict):
         self['sessionid'] = sessionid
         self['url'] = url
 
-    def save(self):
+    def validate(self):
         if 'sessionid' not in self or self['sessionid'] is None:
             raise ValueError("value for key 'session_id' is required to save state")
         url = urlparse(self['url'])
         if len(url.scheme) == 0:
             raise ValueError("value for key 'url' must have valid format, eg: scheme://path")
+
+    def drop_transient(self):
+        """
+        Remove transient keys starting with '_', eg. data passed between plugins while collecting
+        """
+        for key in [key for key in self.keys() if key.startswith('_')]:
+            del self[key]
+
+    def save(self):
+        self.validate()
+        self.drop_transient()
         cache.put(self)
-        return self._model.states.upsert(columns=['url', 'sessionid'], **self)
+        return self._model.write_states([self])
 
     def __repr__(self):
         res = '{'
@@ -111,44 +338,263 @@ class State(dict):
 
 
 class StateCache:
+    """
+    Bounded LRU cache of State objects keyed by (sessionid, url)
+    """
 
-    def __init__(self):
-        self.cache = {}
-
-    @staticmethod
-    def key(sessionid, url):
-        return str(sessionid) + str(url)
+    def __init__(self, capacity=10000):
+        """
+        :param capacity: maximum number of cached states, 0 disables the cache
+        """
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def has(self, sessionid, url):
-        #return False  # disable cache
-        return self.key(sessionid, url) in self.cache.keys()
+        return (sessionid, url) in self.cache
 
     def get(self, sessionid, url):
-        return self.cache[self.key(sessionid, url)]
+        """
+        Get cached state
+
+        :param sessionid: session uuid
+        :param url: state url
+        :return: State, None if not cached
+        """
+        key = (sessionid, url)
+        res = self.cache.get(key)
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return res
 
     def put(self, state):
-        self.cache[self.key(state['sessionid'], state['url'])] = state
+        key = (state['sessionid'], state['url'])
+        self.cache[key] = state
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, sessionid):
+        """
+        Remove cached states of a session
+
+        :param sessionid: session uuid
+        """
+        for key in [key for key in self.cache.keys() if key[0] == sessionid]:
+            del self.cache[key]
+
+    def clear(self):
+        self.cache.clear()
+
+    def __repr__(self):
+        return "state cache: %d/%d entries, %d hits, %d misses, %d evictions" % \
+               (len(self.cache), self.capacity, self.hits, self.misses, self.evictions)
+
 
 cache = StateCache()
 
 
+class StateIndex:
+    """
+    In-memory url -> row index of all states of a session, loaded with a single query.
+
+    Rows are kept as raw database tuples, values are decoded on demand only. Texts stored in
+    the blob store are loaded on demand too, unless resolve_blobs is given: then all of them are
+    loaded up front and the index does not access the database any more, so it can be read
+    from other threads.
+    """
+
+    def __init__(self, model, chain, resolve_blobs=False):
+        """
+        :param model: storage Model
+        :param chain: list of session uuids, see Session.chain()
+        :param resolve_blobs: load all referenced blob texts now
+        """
+        self.tz = model.tz
+        self.rows = {}
+        self.extras = {}
+        for row in model.resolved_states(chain):
+            self.rows[row[1]] = row
+        self.load_blob = model.blobs.get
+        if resolve_blobs:
+            digests = set()
+            for row in self.rows.values():
+                raw = row[extras_idx]
+                if raw is not None and '"blob":' in raw:
+                    digests.update(v['blob'] for v in json.loads(raw).values() if isinstance(v, dict) and 'blob' in v)
+            self.load_blob = model.blobs.get_many(digests).__getitem__
+
+    def __contains__(self, url):
+        return url in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _extras(self, url):
+        if url not in self.extras:
+            raw = self.rows[url][extras_idx]
+            res = {}
+            if raw is not None:
+                for k, v in json.loads(raw).items():
+                    res[k] = _decode_extra(v, self.tz, self.load_blob)
+            self.extras[url] = res
+        return self.extras[url]
+
+    def get(self, url, key):
+        """
+        Get decoded value of a single key
+
+        :param url: state url
+        :param key: state key
+        :return: decoded value, None if the state has no such key
+        """
+        row = self.rows[url]
+        idx = state_field_idx.get(key)
+        if idx is not None and row[idx] is not None:
+            decoder = state_fields[key][2]
+            return row[idx] if decoder is None else decoder(row[idx], self.tz)
+        return self._extras(url).get(key)
+
+    def equals(self, url, values, keys):
+        """
+        Check whether given values are equal to the indexed state
+
+        Values of typed columns are encoded and compared to the raw column first, values are only decoded if those differ.
+
+        :param url: state url
+        :param values: dict of values to compare
+        :param keys: keys to compare
+        :return: True if all values are equal
+        """
+        row = self.rows[url]
+        for key in keys:
+            value = values[key]
+            idx = state_field_idx.get(key)
+            if idx is not None and row[idx] is not None and value is not None:
+                try:
+                    if state_fields[key][1](value) == row[idx]:
+                        continue
+                except (TypeError, ValueError):
+                    pass
+            if value != self.get(url, key):
+                return False
+        return True
+
+    def values(self, url, skip=()):
+        """
+        Get decoded values of indexed state
+
+        :param url: state url
+        :param skip: keys to leave out
+        :return: dict of key -> decoded value
+        """
+        res = decode_state(self.rows[url], self.tz, self.load_blob)
+        for key in skip:
+            res.pop(key, None)
+        return res
+
+
+class StateWriter:
+    """
+    Buffered bulk writer for states of one session.
+
+    States are collected in memory and written with one executemany() per batch instead of
+    a statement per state. Stored states of the same url are replaced, fresh sessions use
+    plain inserts as they cannot have any states yet. Call flush() within a transaction
+    after the last add().
+
+    Writers of delta sessions skip states equal to the state resolved through the parent
+    session and write tombstones for parent urls not added, see delete_missing().
+    """
+
+    def __init__(self, model, sessionid, fresh=False, batch_size=1000, base=None):
+        """
+        :param model: storage Model
+        :param sessionid: uuid of the session states belong to
+        :param fresh: True if the session has no stored states yet
+        :param batch_size: number of buffered states triggering an automatic flush()
+        :param base: StateIndex of the parent session of a delta session
+        """
+        self.model = model
+        self.sessionid = sessionid
+        self.fresh = fresh
+        self.batch_size = batch_size
+        self.base = base
+        self.pending = []
+        self.urls = set()
+        self.written = 0
+        self.unchanged = 0
+        self.tombstones = 0
+
+    def add(self, state):
+        """
+        Queue state for writing, replaces a stored state of the same url
+
+        :param state: State of this writer's session
+        """
+        state.validate()
+        if state['sessionid'] != self.sessionid:
+            raise ValueError("state of session %s added to writer of session %s" % (state['sessionid'], self.sessionid))
+        state.drop_transient()
+        cache.put(state)
+        self.pending.append(state)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write queued states to the database
+        """
+        if len(self.pending) == 0:
+            return
+        replace = not self.fresh
+        rows = []
+        inherited = []
+        for state in self.pending:
+            row = encode_state(state, self.model.blobs.put)
+            if row[1] in self.urls:
+                replace = True
+            self.urls.add(row[1])
+            if self.base is not None and row[1:] == self.base.rows.get(row[1], (None,))[1:]:
+                # same as parent, drop a version written before by this writer
+                inherited.append((self.sessionid, row[1]))
+                continue
+            rows.append(row)
+        if replace and len(inherited) > 0:
+            self.model.executemany('DELETE FROM states WHERE sessionid = ? AND url = ?', inherited)
+        self.model.write_rows(rows, replace=replace)
+        self.written += len(rows)
+        self.unchanged += len(inherited)
+        self.pending = []
+
+    def delete_missing(self):
+        """
+        Write tombstones for urls of the parent session not added to this writer, delta sessions only
+        """
+        self.flush()
+        if self.base is None:
+            return
+        missing = [(self.sessionid, url) for url in self.base.rows.keys() if url not in self.urls]
+        self.model.executemany('INSERT OR REPLACE INTO states (sessionid, url, deleted) VALUES (?, ?, 1)', missing)
+        self.tombstones += len(missing)
+
+    def __repr__(self):
+        return "state writer: %d written, %d unchanged, %d tombstones" % (self.written, self.unchanged, self.tombstones)
+
+
 class Session(dict):
 
     @staticmethod
     def from_dict(model, d):
         res = Session(model)
         for k, v in d.items():
-            try:
-                # hack string timestamps back to datetime
-                if isinstance(v, str):
-                    if len(v) < 100 and date_pat.match(v):
-                        v = parse(v, yearfirst=True, dayfirst=False, fuzzy=True)
-                # hack bytes back to utf8 strings
-                if isinstance(v, bytes) or isinstance(v, bytearray):
-                    v = v.decode('utf-8')
-            except ValueError:
-                pass
-            res[k] = v
+            res[k] = decode_value(v)
         return res
 
     def __init__(self, model, uuid=None, stamp=None, closed=False, **kwargs):
@@ -162,44 +608,110 @@ class Session(dict):
         self['uuid'] = uuid
         self['stamp'] = stamp
         self['closed'] = closed
+        self._chain = None
 
     def save(self):
+        self._chain = None
         return self._model.sessions.upsert(columns=['uuid'], **self)
 
     def new_state(self, **kwargs):
         return State(self._model, self['uuid'], **kwargs)
 
+    def chain(self):
+        """
+        Get uuids of this session and its ancestors, newest first
+
+        A session without parent stores all of its states. A delta session only stores states
+        differing from its parent session and tombstones for urls missing since.
+
+        :return: list of session uuids
+        """
+        if self._chain is None:
+            res = [self['uuid']]
+            parent = self.get('parent')
+            while parent is not None:
+                if parent in res:
+                    raise ValueError("session %s has a cyclic parent chain" % self['uuid'])
+                res.append(parent)
+                row = self._model.sessions.find_one(uuid=parent)
+                if row is None:
+                    raise KeyError("parent session %s of session %s not found" % (parent, res[-2]))
+                parent = row.get('parent')
+            self._chain = res
+        return self._chain
+
     def get_state(self, url):
-        if cache.has(self['uuid'], url):
-            return cache.get(self['uuid'], url)
-        res = self._model.states.find_one(url=url, sessionid=self['uuid'])
+        res = cache.get(self['uuid'], url)
         if res is not None:
-            res = State.from_dict(self._model, res)
+            return res
+        rows = list(self._model.resolved_states(self.chain(), urls=[url]))
+        if len(rows) > 0:
+            res = State.from_row(self._model, rows[0])
             cache.put(res)
             return res
         else:
             raise KeyError("state with url:"+url+" for session:"+self['uuid']+" not found")
 
+    def state_index(self, resolve_blobs=False):
+        return StateIndex(self._model, self.chain(), resolve_blobs=resolve_blobs)
+
+    def state_writer(self, fresh=False):
+        base = None
+        if self.get('parent') is not None:
+            base = StateIndex(self._model, self.chain()[1:])
+        return StateWriter(self._model, self['uuid'], fresh=fresh, base=base)
+
     def all_urls(self):
-        res = self._model.query('select url from states where sessionid = ?', [self['uuid']]).fetchall()
-        res = [x[0] for x in res]
-        return res
+        return [row[1] for row in self._model.resolved_states(self.chain(), columns=('sessionid', 'url'))]
 
     def find_states(self, **kwargs):
         res = []
-        for state in self._model.states.find(sessionid=self['uuid'], **kwargs):
-            if cache.has(state['sessionid'], state['url']):
-                stateobj = cache.get(state['sessionid'], state['url'])
-            else:
-                stateobj = State.from_dict(self._model, state)
+        for row in self._model.resolved_states(self.chain()):
+            stateobj = cache.get(row[0], row[1])
+            if stateobj is None:
+                stateobj = State.from_row(self._model, row)
                 cache.put(stateobj)
-            res.append(stateobj)
+            if all(stateobj.get(k) == v for k, v in kwargs.items()):
+                res.append(stateobj)
         return res
 
+    def iter_states(self, prefix=None):
+        """
+        Generate states of this session without caching them
+
+        :param prefix: only states with urls starting with this, eg. 'file://'
+        :return: generator of State
+        """
+        for row in self._model.resolved_states(self.chain(), prefix=prefix):
+            yield State.from_row(self._model, row)
+
+    def children(self):
+        """
+        Get delta sessions having this session as parent
+        """
+        if 'parent' not in self._model.sessions.columns:
+            return []
+        return self._model.find_sessions(parent=self['uuid'])
+
+    def _fold_into(self, child):
+        # copy states not overridden by the child, the child takes over this session's parent
+        columns = ', '.join(state_columns[1:] + ('deleted',))
+        self._model.query('insert into states (sessionid, %s) select ?, %s from states '
+                          'where sessionid = ? and url not in (select url from states where sessionid = ?)' %
+                          (columns, columns), [child['uuid'], self['uuid'], child['uuid']])
+        if self.get('parent') is None:
+            # child becomes a full session, its tombstones hide nothing anymore
+            self._model.query('delete from states where sessionid = ? and deleted = 1', [child['uuid']])
+        child['parent'] = self.get('parent')
+        child.save()
+
     def delete(self):
         with self._model.transaction():
-            self._model.states.delete(sessionid=self['uuid'])
+            for child in self.children():
+                self._fold_into(child)
+            self._model.query('delete from states where sessionid = ?', [self['uuid']])
             self._model.sessions.delete(uuid=self['uuid'])
+        cache.invalidate(self['uuid'])
 
 
 class Report(dict):
@@ -224,31 +736,211 @@ class Report(dict):
     def save(self):
         return self._model.reports.upsert(columns=['uuid'], **self)
 
+    def writer(self, part):
+        """
+        Get writer storing a report part chunk by chunk, see ReportStore
+
+        :param part: 'text' or 'html'
+        :return: ReportWriter
+        """
+        return self._model.report_store.writer(self['uuid'], part)
+
+    def chunks(self, part):
+        """
+        Generate a report part chunk by chunk, reports saved with the part as a column yield it at once
+
+        :param part: 'text' or 'html'
+        :return: generator of strings
+        """
+        if self.get(part) is not None:
+            yield self[part]
+            return
+        for chunk in self._model.report_store.read(self['uuid'], part):
+            yield chunk
+
+    def text(self, part):
+        """
+        Get a whole report part
+
+        :param part: 'text' or 'html'
+        :return: string
+        """
+        return ''.join(self.chunks(part))
+
     def delete(self):
         with self._model.transaction():
             self._model.reports.delete(uuid=self['uuid'])
+            self._model.report_store.delete(self['uuid'])
 
 
 class Model:
     def __init__(self, db_uri="sqlite:///:memory:"):
         self.db = MyDataSet(db_uri)
+        self.tz = get_localzone()
         self.sessions = self.db['sessions']
-        self.states = self.db['states']
         self.reports = self.db['reports']
+        self.blobs = BlobStore(self)
+        self.report_store = ReportStore(self)
+
+        columns = [row[1] for row in self.query('PRAGMA table_info(states)').fetchall()]
+        if len(columns) > 0 and 'extras' not in columns:
+            self._migrate_legacy_states()
+        else:
+            if len(columns) > 0 and 'deleted' not in columns:
+                self.query('ALTER TABLE states ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0')
+            if len(columns) > 0 and 'fingerprint' not in columns:
+                self._add_fingerprints()
+            self._create_states_table()
 
         # create indexes
         try:
             self.db.query('CREATE UNIQUE INDEX IF NOT EXISTS idx_session_uuid ON sessions(uuid)')
             self.db.query('CREATE INDEX IF NOT EXISTS idx_session_stamp ON sessions(stamp)')
-            self.db.query('CREATE INDEX IF NOT EXISTS idx_state_sessionid ON states(sessionid)')
-            self.db.query('CREATE INDEX IF NOT EXISTS idx_state_url ON states(url)')
-            self.db.query('CREATE INDEX IF NOT EXISTS idx_state_url_sessionid ON states(url,sessonid)')
-            self.db.query('CREATE INDEX IF NOT EXISTS idx_state_plugin ON states(plugin)')
             self.db.query('CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_uuid ON reports(uuid)')
             self.db.query('CREATE INDEX IF NOT EXISTS idx_reports_stamp ON reports(stamp)')
         except OperationalError:
             pass
 
+    def _create_states_table(self):
+        self.query('CREATE TABLE IF NOT EXISTS states ('
+                   'sessionid TEXT NOT NULL, url TEXT NOT NULL, plugin TEXT, '
+                   'size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, mode INTEGER, uid INTEGER, gid INTEGER, '
+                   'hash BLOB, fingerprint INTEGER, extras TEXT, deleted INTEGER NOT NULL DEFAULT 0)')
+        self.query('CREATE UNIQUE INDEX IF NOT EXISTS idx_states_sessionid_url ON states(sessionid, url)')
+        self.query('CREATE INDEX IF NOT EXISTS idx_states_url ON states(url)')
+
+    def _migrate_legacy_states(self):
+        """
+        Convert states table with dynamic columns guessed by playhouse.dataset to the typed schema
+        """
+        with self.transaction():
+            self.query('ALTER TABLE states RENAME TO states_legacy')
+            self._create_states_table()
+            cursor = self.query('SELECT * FROM states_legacy')
+            names = [d[0] for d in cursor.description]
+            self.write_states(legacy_state(dict(zip(names, row))) for row in cursor)
+            self.query('DROP TABLE states_legacy')
+
+    def _add_fingerprints(self):
+        """
+        Add fingerprint column to a states table created without it and compute it for stored states
+        """
+        with self.transaction():
+            self.query('ALTER TABLE states ADD COLUMN fingerprint INTEGER')
+            cursor = self.query('SELECT rowid, %s, extras FROM states WHERE deleted = 0' %
+                                ', '.join(state_columns[2:fingerprint_idx]))
+            self.executemany('UPDATE states SET fingerprint = ? WHERE rowid = ?',
+                             [(fingerprint(row[1:-1], json.loads(row[-1]) if row[-1] is not None else {}), row[0])
+                              for row in cursor])
+
+    def write_states(self, states, replace=True):
+        """
+        Write states with a single executemany()
+
+        :param states: iterable of state dicts
+        :param replace: replace stored states of the same session and url, fails on duplicates otherwise
+        """
+        return self.write_rows((encode_state(state, self.blobs.put) for state in states), replace=replace)
+
+    def write_rows(self, rows, replace=True):
+        """
+        Write rows returned by encode_state() with a single executemany()
+
+        :param rows: iterable of tuples in state_columns order
+        :param replace: replace stored states of the same session and url, fails on duplicates otherwise
+        """
+        return self.executemany('%s INTO states (%s) VALUES (%s)' %
+                                ('INSERT OR REPLACE' if replace else 'INSERT', ', '.join(state_columns),
+                                 ', '.join('?' * len(state_columns))), rows)
+
+    def _query_chunked(self, sql, params, urls):
+        # stay below the sqlite limit of 999 host parameters
+        urls = list(urls)
+        for idx in range(0, len(urls), 500):
+            chunk = urls[idx:idx + 500]
+            for row in self.query(sql + ' and url in (%s)' % ', '.join('?' * len(chunk)), params + chunk):
+                yield row
+
+    def resolved_states(self, chain, urls=None, columns=state_columns, prefix=None):
+        """
+        Get state rows of a session, delta sessions are resolved through their parents
+
+        :param chain: list of session uuids, newest first, see Session.chain()
+        :param urls: only get states of these urls
+        :param columns: columns to select, the first two must be sessionid and url
+        :param prefix: only get states with urls starting with this, eg. 'file://'
+        :return: iterable of row tuples, sessionid is set to chain[0]
+        """
+        sql = 'select %s, deleted from states where sessionid in (%s)' % (', '.join(columns), ', '.join('?' * len(chain)))
+        params = list(chain)
+        if len(chain) == 1:
+            sql += ' and deleted = 0'
+        if prefix:
+            # range scan on the (sessionid, url) index
+            sql += ' and url >= ? and url < ?'
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if urls is None:
+            rows = self.query(sql, params)
+        else:
+            rows = self._query_chunked(sql, params, urls)
+        if len(chain) == 1:
+            return (row[:-1] for row in rows)
+
+        # newest version of each url wins
+        prio = dict((uuid, idx) for idx, uuid in enumerate(chain))
+        best = {}
+        for row in rows:
+            other = best.get(row[1])
+            if other is None or prio[row[0]] < prio[other[0]]:
+                best[row[1]] = row
+        return ((chain[0],) + row[1:-1] for row in best.values() if not row[-1])
+
+    def diff_states(self, old_chain, new_chain):
+        """
+        Find urls whose stored states differ between two sessions
+
+        States are compared by their fingerprint, which leaves out keys in diff_ignore_keys. Sessions
+        resolving through a common ancestor are only compared on urls stored above it, two full
+        sessions are compared with a join in sqlite.
+
+        :param old_chain: chain of the old session, see Session.chain()
+        :param new_chain: chain of the new session
+        :return: tuple of url lists (found, lost, changed)
+        """
+        common = [uuid for uuid in new_chain if uuid in old_chain]
+        if len(common) == 0 and len(old_chain) == 1 and len(new_chain) == 1:
+            changed = []
+            lost = []
+            for row in self.query('select o.url, n.url is null from states o '
+                                  'left join states n on n.sessionid = ? and n.url = o.url and n.deleted = 0 '
+                                  'where o.sessionid = ? and o.deleted = 0 '
+                                  'and (n.url is null or o.fingerprint is not n.fingerprint)',
+                                  [new_chain[0], old_chain[0]]):
+                if row[1]:
+                    lost.append(row[0])
+                else:
+                    changed.append(row[0])
+            found = self.query('select url from states where sessionid = ? and deleted = 0 and url not in '
+                               '(select url from states where sessionid = ? and deleted = 0)',
+                               [new_chain[0], old_chain[0]])
+            return [x[0] for x in found], lost, changed
+
+        urls = None
+        if len(common) > 0:
+            # everything below the common ancestor resolves to the same rows
+            segment = new_chain[:new_chain.index(common[0])] + old_chain[:old_chain.index(common[0])]
+            if len(segment) == 0:
+                return [], [], []
+            urls = set(x[0] for x in self.query('select distinct url from states where sessionid in (%s)' %
+                                                ', '.join('?' * len(segment)), segment))
+        columns = ('sessionid', 'url', 'fingerprint')
+        old = dict((row[1], row[2]) for row in self.resolved_states(old_chain, urls=urls, columns=columns))
+        new = dict((row[1], row[2]) for row in self.resolved_states(new_chain, urls=urls, columns=columns))
+        found = [url for url in new.keys() if url not in old]
+        lost = [url for url in old.keys() if url not in new]
+        changed = [url for url, fp in new.items() if url in old and old[url] != fp]
+        return found, lost, changed
+
     def new_session(self, **kwargs):
         return Session(self, **kwargs)
 
@@ -292,6 +984,15 @@ class Model:
             cnt += 1
         return res
 
+    def delete_sessions(self, sessions):
+        """
+        Delete sessions newest first, so delta states are folded into the surviving child sessions only once
+
+        :param sessions: list of Session
+        """
+        for sess in sorted(sessions, key=lambda x: str(x['stamp']), reverse=True):
+            sess.delete()
+
     def find_sessions(self, **kwargs):
         res = []
         for sess in self.sessions.find(**kwargs):
@@ -307,11 +1008,25 @@ class Model:
     def delete(self):
         with self.transaction():
             self.sessions.delete()
-            self.states.delete()
+            self.query('DELETE FROM states')
+            self.blobs.delete()
             self.reports.delete()
+            self.report_store.delete()
+        cache.clear()
 
     def query(self, sql, params=None, commit=None):
         return self.db.query(sql, params, commit)
 
+    def connection(self):
+        """
+        Get the sqlite3 connection of the calling thread, eg. for executemany() or iterdump()
+
+        playhouse.dataset does not expose it, no other code should reach into self.db for it.
+        """
+        return self.db._database.get_conn()
+
+    def executemany(self, sql, seq_of_params):
+        return self.connection().executemany(sql, seq_of_params)
+
     def transaction(self):
         return self.db.transaction()
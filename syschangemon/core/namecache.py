@@ -0,0 +1,83 @@
+""" User and group name resolution cache """
+import time
+
+
+def read_id_names(path):
+    """
+    Read id -> name pairs of a passwd(5) or group(5) style file
+
+    :param path: file path, eg. /etc/passwd
+    :return: list of (id, name) tuples, in file order
+    """
+    res = []
+    with open(path, encoding='utf-8', errors='replace') as fd:
+        for line in fd:
+            fields = line.split(':')
+            if len(fields) < 3 or line.startswith('#'):
+                continue
+            try:
+                res.append((int(fields[2]), fields[0]))
+            except ValueError:
+                pass  # eg. NIS +/- entries
+    return res
+
+
+class NameCache:
+    """
+    Map of uid or gid to name, resolved once per run.
+
+    Ids unknown to the resolver are cached as None as well, so NSS backends going over the
+    network (sssd, LDAP) are asked at most once per id. Time spent resolving is accounted
+    in lookup_time.
+    """
+
+    def __init__(self, resolve):
+        """
+        :param resolve: callable returning the name of an id, raising KeyError for unknown ids,
+                        eg. lambda uid: pwd.getpwuid(uid).pw_name
+        """
+        self.resolve = resolve
+        self.names = {}
+        self.hits = 0
+        self.misses = 0
+        self.unknown = 0
+        self.lookup_time = 0.0
+
+    def load(self, path):
+        """
+        Pre-load names of a passwd(5) or group(5) style file, first entries of an id win
+
+        :param path: file path
+        """
+        start = time.time()
+        for (id_, name) in read_id_names(path):
+            self.names.setdefault(id_, name)
+        self.lookup_time += time.time() - start
+
+    def get(self, id_):
+        """
+        Get name of an id
+
+        :param id_: uid or gid
+        :return: name, None if unknown
+        """
+        try:
+            name = self.names[id_]
+            self.hits += 1
+            return name
+        except KeyError:
+            pass
+        self.misses += 1
+        start = time.time()
+        try:
+            name = self.resolve(id_)
+        except KeyError:
+            name = None
+            self.unknown += 1
+        self.lookup_time += time.time() - start
+        self.names[id_] = name
+        return name
+
+    def __repr__(self):
+        return "%d names, %d hits, %d misses, %d unknown, %.3fs resolving" % \
+               (len(self.names), self.hits, self.misses, self.unknown, self.lookup_time)
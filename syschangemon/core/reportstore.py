@@ -0,0 +1,100 @@
+""" Rendered report texts stored in chunks """
+
+
+class ReportWriter:
+    """
+    Text file like writer of one report part, inserting a row per chunk_size characters written
+    """
+
+    def __init__(self, store, uuid, part):
+        """
+        :param store: ReportStore
+        :param uuid: report uuid
+        :param part: report part, eg. 'text' or 'html'
+        """
+        self.store = store
+        self.uuid = uuid
+        self.part = part
+        self.seq = 0
+        self.buf = []
+        self.size = 0
+
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= self.store.chunk_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.size == 0:
+            return
+        self.store.model.query('INSERT INTO report_chunks (uuid, part, seq, text) VALUES (?, ?, ?, ?)',
+                               [self.uuid, self.part, self.seq, ''.join(self.buf)])
+        self.seq += 1
+        self.buf = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReportStore:
+    """
+    Report texts in the 'report_chunks' table of the storage database.
+
+    Reports are written while they are rendered and read back chunk by chunk, so neither holds
+    a whole report in memory. A report has several parts, eg. its 'text' and 'html' rendering,
+    each stored as rows of at most about chunk_size characters, ordered by seq.
+    """
+
+    def __init__(self, model, chunk_size=65536):
+        """
+        :param model: storage Model
+        :param chunk_size: characters per stored chunk
+        """
+        self.model = model
+        self.chunk_size = chunk_size
+        self.model.query('CREATE TABLE IF NOT EXISTS report_chunks ('
+                         'uuid TEXT NOT NULL, part TEXT NOT NULL, seq INTEGER NOT NULL, text TEXT NOT NULL, '
+                         'PRIMARY KEY (uuid, part, seq))')
+
+    def writer(self, uuid, part):
+        """
+        Get writer of a report part, replacing stored chunks of it
+
+        :param uuid: report uuid
+        :param part: report part, eg. 'text' or 'html'
+        :return: ReportWriter, close it after the last write
+        """
+        self.model.query('DELETE FROM report_chunks WHERE uuid = ? AND part = ?', [uuid, part])
+        return ReportWriter(self, uuid, part)
+
+    def read(self, uuid, part):
+        """
+        Generate stored chunks of a report part
+
+        :param uuid: report uuid
+        :param part: report part
+        :return: generator of strings
+        """
+        for row in self.model.query('SELECT text FROM report_chunks WHERE uuid = ? AND part = ? ORDER BY seq',
+                                    [uuid, part]):
+            yield row[0]
+
+    def delete(self, uuid=None):
+        """
+        Remove stored chunks of a report, of all reports if uuid is None
+
+        :param uuid: report uuid
+        """
+        if uuid is None:
+            self.model.query('DELETE FROM report_chunks')
+        else:
+            self.model.query('DELETE FROM report_chunks WHERE uuid = ?', [uuid])
@@ -1,48 +1,123 @@
+from collections import namedtuple
+
 from syschangemon.core.dictdiff import DictDiff
-from syschangemon.core.model import Session
+from syschangemon.core.model import Session, State, diff_ignore_keys
+
+# url of a lost, found or changed state, old or new is None for found and lost states
+Change = namedtuple('Change', ['url', 'old', 'new', 'diff'])
 
 
 class SessionDiff:
+    """
+    Difference of two sessions
+
+    Only the urls of lost, found and changed states are kept, states and their DictDiffs are
+    loaded in chunks while iterating, sorted by url, and are not cached.
+    """
+
+    # number of states loaded with one query while iterating
+    chunk_size = 500
 
-    def __init__(self, old_session, new_session):
+    def __init__(self, old_session, new_session, text_diff=None):
+        """
+        :param old_session: Session
+        :param new_session: Session
+        :param text_diff: TextDiff for multi-line values, see DictDiff
+        """
 
         self.old_session = old_session
         self.new_session = new_session
+        self.text_diff = text_diff
 
-        old_urls = set(old_session.all_urls())
-        new_urls = set(new_session.all_urls())
+        # let the database find urls with differing fingerprints, only those are decoded and compared key by key
+        (found, lost, changed) = new_session._model.diff_states(old_session.chain(), new_session.chain())
 
-        self.found_urls = new_urls - old_urls
-        self.lost_urls = old_urls - new_urls
-        self.equal_urls = old_urls & new_urls
+        self.found_urls = set(found)
+        self.lost_urls = set(lost)
+        self.changed_urls = set(changed)
 
-        self.diffs = []
-        for url in self.equal_urls:
-            old_state = old_session.get_state(url)
-            old_label = old_state['url']
-            new_state = new_session.get_state(url)
-            new_label = new_state['url']
-            diff = DictDiff(old_state, old_label, new_state, new_label, ['id', 'sessionid', 'uuid', 'assume_nochange'])
-            if not diff.is_empty():
-                self.diffs.append(diff)
+        # callables applied to each DictDiff when it is generated, see StatePluginBase.process_diff_item()
+        self.item_processors = []
 
         self.extra = {}
 
+    def _states(self, session, urls):
+        model = session._model
+        rows = dict((row[1], row) for row in model.resolved_states(session.chain(), urls=urls))
+        return dict((url, State.from_row(model, row)) for url, row in rows.items())
+
+    def _changes(self, urls, process=True):
+        urls = sorted(urls)
+        for idx in range(0, len(urls), self.chunk_size):
+            chunk = urls[idx:idx + self.chunk_size]
+            old_states = self._states(self.old_session, [url for url in chunk if url not in self.found_urls])
+            new_states = self._states(self.new_session, [url for url in chunk if url not in self.lost_urls])
+            for url in chunk:
+                old_state = old_states.get(url)
+                new_state = new_states.get(url)
+                diff = None
+                if old_state is not None and new_state is not None:
+                    diff = DictDiff(old_state, old_state['url'], new_state, new_state['url'], diff_ignore_keys,
+                                    self.text_diff)
+                    if diff.is_empty():
+                        continue
+                    if process:
+                        for processor in self.item_processors:
+                            diff = processor(diff)
+                yield Change(url, old_state, new_state, diff)
+
+    def changes(self):
+        """
+        Generate all changes sorted by url
+
+        :return: generator of Change
+        """
+        return self._changes(self.found_urls | self.lost_urls | self.changed_urls)
+
+    def lost_states(self):
+        """
+        Generate states of the old session missing from the new one, sorted by url
+        """
+        return (change.old for change in self._changes(self.lost_urls))
+
+    def found_states(self):
+        """
+        Generate states of the new session missing from the old one, sorted by url
+        """
+        return (change.new for change in self._changes(self.found_urls))
+
+    @property
+    def diffs(self):
+        """
+        Generate DictDiffs of changed states sorted by url, each access starts over
+        """
+        return (change.diff for change in self._changes(self.changed_urls))
+
+    @property
+    def equal_urls(self):
+        return set(self.old_session.all_urls()) & set(self.new_session.all_urls())
+
     @property
     def is_empty(self):
-        return len(self.diffs) == 0 and len(self.lost_urls) == 0 and len(self.found_urls) == 0
+        if len(self.lost_urls) > 0 or len(self.found_urls) > 0:
+            return False
+        # urls with differing fingerprints may still be equal when decoded, these are left out of
+        # diffs too - stop at the first one that is not, without running item_processors
+        for change in self._changes(self.changed_urls, process=False):
+            return False
+        return True
 
     def __repr__(self):
         res = ""
         res += "- old session @ %s\n" % self.old_session['stamp']
-        for url in self.lost_urls:
+        for url in sorted(self.lost_urls):
             res += "  " + url
 
         res += "+ new session @ %s\n" % self.new_session['stamp']
-        for url in self.found_urls:
+        for url in sorted(self.found_urls):
             res += "  " + url
 
-        if self.is_empty():
+        if self.is_empty:
             res += "= no difference"
         else:
             for diff in self.diffs:
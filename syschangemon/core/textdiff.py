@@ -0,0 +1,223 @@
+"""Line based text diff with a persistent result cache."""
+import hashlib
+import time
+from collections import Counter
+
+
+def _myers(a, b, max_edits):
+    """
+    Find shortest edit script of two sequences with the Myers O(ND) algorithm
+
+    :param a: list of line ids
+    :param b: list of line ids
+    :param max_edits: give up if more lines than this differ
+    :return: list of (tag, i, j) tuples in order, tag is '=', '-' or '+', i and j are positions in a and b,
+             None if the sequences differ in more than max_edits lines
+    """
+    n = len(a)
+    m = len(b)
+    max_d = min(n + m, max_edits)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace, x, y):
+    ops = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        # trace[d] holds diagonals -d-1 .. d+1 of the state before step d
+        k = x - y
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d + 1] if d > 0 else 0
+        prev_y = prev_x - prev_k if d > 0 else 0
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            ops.append(('=', x, y))
+        if d > 0:
+            if x == prev_x:
+                ops.append(('+', x, prev_y))
+            else:
+                ops.append(('-', prev_x, y))
+        x = prev_x
+        y = prev_y
+    ops.reverse()
+    return ops
+
+
+def line_ops(lines1, lines2, max_edits=1000):
+    """
+    Diff two lists of lines
+
+    Lines are replaced by integer ids and the common head and tail are skipped before the
+    edit script of the remaining lines is searched.
+
+    :param lines1: old lines
+    :param lines2: new lines
+    :param max_edits: give up if more lines than this differ
+    :return: list of (tag, i, j) tuples, see _myers(), None if there are too many differences
+    """
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in lines1]
+    b = [ids.setdefault(line, len(ids)) for line in lines2]
+
+    head = 0
+    while head < len(a) and head < len(b) and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < len(a) - head and tail < len(b) - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    a_mid = a[head:len(a) - tail]
+    b_mid = b[head:len(b) - tail]
+    # lines not present on the other side at all are a lower bound of the edit distance
+    common = sum((Counter(a_mid) & Counter(b_mid)).values())
+    if len(a_mid) + len(b_mid) - 2 * common > max_edits:
+        return None
+    ops = _myers(a_mid, b_mid, max_edits)
+    if ops is None:
+        return None
+    res = [('=', i, i) for i in range(head)]
+    res.extend((tag, i + head, j + head) for (tag, i, j) in ops)
+    res.extend(('=', len(a) - tail + i, len(b) - tail + i) for i in range(tail))
+    return res
+
+
+def unified(lines1, lines2, ops, context=3):
+    """
+    Format diff as unified diff hunks without file headers
+
+    :param lines1: old lines
+    :param lines2: new lines
+    :param ops: result of line_ops()
+    :param context: number of unchanged lines around changes
+    :return: string
+    """
+    changes = [idx for idx, op in enumerate(ops) if op[0] != '=']
+    res = []
+    start = 0
+    while start < len(changes):
+        end = start
+        while end + 1 < len(changes) and changes[end + 1] - changes[end] <= 2 * context + 1:
+            end += 1
+        hunk = ops[max(0, changes[start] - context):changes[end] + context + 1]
+        len1 = sum(1 for op in hunk if op[0] != '+')
+        len2 = sum(1 for op in hunk if op[0] != '-')
+        res.append('@@ -%d,%d +%d,%d @@\n' % (hunk[0][1] + (1 if len1 > 0 else 0), len1,
+                                             hunk[0][2] + (1 if len2 > 0 else 0), len2))
+        for (tag, i, j) in hunk:
+            if tag == '+':
+                res.append('+' + lines2[j] + '\n')
+            elif tag == '-':
+                res.append('-' + lines1[i] + '\n')
+            else:
+                res.append(' ' + lines1[i] + '\n')
+        start = end + 1
+    return ''.join(res)
+
+
+class TextDiff:
+    """
+    Line diff of multi-line state values, eg. config files or command output.
+
+    Results are cached by the sha256 digests of both texts in the 'textdiffs' table of the
+    storage database, as the same change shows up again in later reports. Texts above
+    max_size characters or differing in more than max_edits lines are only summarized.
+    """
+
+    def __init__(self, model=None, max_size=1000000, max_edits=1000, context=3):
+        """
+        :param model: storage Model to keep results in, results are not cached if None
+        :param max_size: summarize texts with more characters than this (both texts together)
+        :param max_edits: summarize texts with more changed lines than this
+        :param context: number of unchanged lines shown around changes
+        """
+        self.model = model
+        self.max_size = int(max_size)
+        self.max_edits = int(max_edits)
+        self.context = int(context)
+        self.hits = 0
+        self.misses = 0
+        self.summaries = 0
+
+        if self.model is not None:
+            self.model.query('CREATE TABLE IF NOT EXISTS textdiffs ('
+                             'old_digest BLOB NOT NULL, new_digest BLOB NOT NULL, diff TEXT NOT NULL, '
+                             'used INTEGER NOT NULL, PRIMARY KEY (old_digest, new_digest))')
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).digest()
+
+    def summary(self, t1, t2, reason):
+        self.summaries += 1
+        return "@@ %d lines, %d characters -> %d lines, %d characters (%s) @@\n" % \
+               (t1.count('\n') + 1, len(t1), t2.count('\n') + 1, len(t2), reason)
+
+    def diff(self, t1, t2):
+        """
+        Diff two texts
+
+        :param t1: old text
+        :param t2: new text
+        :return: unified diff hunks or a summary line
+        """
+        if len(t1) + len(t2) > self.max_size:
+            return self.summary(t1, t2, 'too large to diff')
+
+        key = None
+        if self.model is not None:
+            key = [self._digest(t1), self._digest(t2)]
+            row = self.model.query('SELECT diff FROM textdiffs WHERE old_digest = ? AND new_digest = ?', key).fetchone()
+            if row is not None:
+                self.hits += 1
+                self.model.query('UPDATE textdiffs SET used = ? WHERE old_digest = ? AND new_digest = ?',
+                                 [int(time.time())] + key)
+                return row[0]
+
+        self.misses += 1
+        lines1 = t1.split('\n')
+        lines2 = t2.split('\n')
+        ops = line_ops(lines1, lines2, self.max_edits)
+        if ops is None:
+            res = self.summary(t1, t2, 'more than %d lines differ' % self.max_edits)
+        else:
+            res = unified(lines1, lines2, ops, self.context)
+        if key is not None:
+            self.model.query('INSERT OR REPLACE INTO textdiffs (old_digest, new_digest, diff, used) VALUES (?, ?, ?, ?)',
+                             key + [res, int(time.time())])
+        return res
+
+    def gc(self, max_age=30 * 86400):
+        """
+        Remove cached results not used for a while
+
+        :param max_age: age in seconds
+        :return: number of removed results
+        """
+        if self.model is None:
+            return 0
+        cursor = self.model.query('DELETE FROM textdiffs WHERE used < ?', [int(time.time()) - max_age])
+        return cursor.rowcount
+
+    def __repr__(self):
+        return "text diff: %d hits, %d misses, %d summaries" % (self.hits, self.misses, self.summaries)
@@ -0,0 +1,81 @@
+""" Persistent wtmp login sessions """
+
+
+class WtmpStore:
+    """
+    Login sessions parsed from a wtmp file, with the byte offset parsing stopped at.
+
+    Sessions live in the 'wtmp_sessions' table of the storage database, keyed by file path and
+    record number (seq) of their login record. Open sessions have no end yet and are paired
+    again with records appended later. The checkpoint in the 'wtmp_checkpoints' table keeps the
+    inode and size of the file, a different inode or a smaller size means the file was rotated
+    or truncated, so its sessions are dropped and parsing starts over.
+    """
+
+    def __init__(self, model, path):
+        """
+        :param model: storage Model
+        :param path: wtmp file path
+        """
+        self.model = model
+        self.path = path
+
+        self.model.query('CREATE TABLE IF NOT EXISTS wtmp_checkpoints ('
+                         'path TEXT NOT NULL PRIMARY KEY, '
+                         'ino INTEGER NOT NULL, size INTEGER NOT NULL, "offset" INTEGER NOT NULL)')
+        self.model.query('CREATE TABLE IF NOT EXISTS wtmp_sessions ('
+                         'path TEXT NOT NULL, seq INTEGER NOT NULL, '
+                         'user TEXT, host TEXT, line TEXT, start REAL NOT NULL, "end" REAL, '
+                         'PRIMARY KEY (path, seq))')
+
+    def resume_offset(self, stat):
+        """
+        Get offset to resume parsing at, forgetting sessions of a rotated or truncated file
+
+        :param stat: os.stat() result of the file
+        :return: byte offset
+        """
+        row = self.model.query('SELECT ino, size, "offset" FROM wtmp_checkpoints WHERE path = ?',
+                               [self.path]).fetchone()
+        if row is None:
+            return 0
+        (ino, size, offset) = row
+        if ino != stat.st_ino or stat.st_size < size:
+            self.model.query('DELETE FROM wtmp_sessions WHERE path = ?', [self.path])
+            self.model.query('DELETE FROM wtmp_checkpoints WHERE path = ?', [self.path])
+            return 0
+        return offset
+
+    def update(self, stat, offset, sessions):
+        """
+        Store sessions and move the checkpoint
+
+        :param stat: os.stat() result of the file passed to resume_offset()
+        :param offset: byte offset parsing stopped at
+        :param sessions: new or changed session dicts with keys seq, user, host, line, start and end,
+                         start and end are timestamps, end is None for open sessions
+        """
+        with self.model.transaction():
+            self.model.executemany('INSERT OR REPLACE INTO wtmp_sessions (path, seq, user, host, line, start, "end") '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   [(self.path, s['seq'], s['user'], s['host'], s['line'], s['start'], s['end'])
+                                    for s in sessions])
+            self.model.executemany('INSERT OR REPLACE INTO wtmp_checkpoints (path, ino, size, "offset") '
+                                   'VALUES (?, ?, ?, ?)',
+                                   [(self.path, stat.st_ino, stat.st_size, offset)])
+
+    def sessions(self, open_only=False):
+        """
+        Get stored sessions in file order
+
+        :param open_only: only sessions not ended yet
+        :return: list of session dicts, see update()
+        """
+        sql = 'SELECT seq, user, host, line, start, "end" FROM wtmp_sessions WHERE path = ?'
+        if open_only:
+            sql += ' AND "end" IS NULL'
+        res = []
+        for row in self.model.query(sql + ' ORDER BY seq', [self.path]):
+            res.append({'seq': row[0], 'user': row[1], 'host': row[2], 'line': row[3],
+                        'start': row[4], 'end': row[5]})
+        return res
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark: GlobSet against the per-pattern loop FilePlugin._matches_pat_list used before.
+
+Patterns are taken from the shipped plugin configuration, paths from the local
+/etc, /bin and /usr/bin trees. Run from the source root:
+
+    python -m tests.benchmark.bench_globset
+"""
+import configparser
+import os
+import timeit
+
+import globre
+
+from syschangemon.cli.plugins.file import FilePlugin
+from syschangemon.core.globset import GlobSet
+
+config_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'config', 'plugins.d')
+
+
+def _matches_pat_list(path, pat_list):
+    # FilePlugin._matches_pat_list before GlobSet was introduced
+    for pat in pat_list:
+        if pat.match(path):
+            return True
+    return False
+
+
+def load_patterns():
+    res = {}
+    for conf, section, key in [('file.conf', 'file', 'include'), ('file.conf', 'file', 'exclude'),
+                               ('file.conf', 'file', 'assume_change'), ('conffile.conf', 'conffile', 'exclude')]:
+        c = configparser.ConfigParser()
+        c.read(os.path.join(config_dir, conf))
+        res[section + '.' + key] = FilePlugin._process_pattern_list(c.get(section, key).split('\n'))
+    return res
+
+
+def load_paths(limit=200000):
+    res = []
+    for base in ['/etc', '/bin', '/sbin', '/usr/bin', '/usr/sbin', '/usr/lib']:
+        for root, dirs, files in os.walk(base):
+            for name in files:
+                res.append(os.path.join(root, name))
+                if len(res) >= limit:
+                    return res
+    return res
+
+
+def main():
+    paths = load_paths()
+    print("%d paths" % len(paths))
+    for name, patterns in sorted(load_patterns().items()):
+        pats = [globre.compile(p, flags=globre.EXACT, split_prefix=False) for p in patterns]
+        gs = GlobSet(patterns)
+
+        assert [_matches_pat_list(p, pats) for p in paths] == [gs.match(p) for p in paths]
+
+        t_loop = min(timeit.repeat(lambda: [_matches_pat_list(p, pats) for p in paths], number=3, repeat=5))
+        t_set = min(timeit.repeat(lambda: [gs.match(p) for p in paths], number=3, repeat=5))
+        print("%-22s %2d patterns: loop %.3fs globset %.3fs (%.1fx)" %
+              (name, len(patterns), t_loop, t_set, t_loop / t_set if t_set > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark: diffing two full sessions with a few changed states.
+
+Compares the per-url get_state() and DictDiff loop SessionDiff used before with the
+join in Model.diff_states(). Run from the source root:
+
+    python -m tests.benchmark.bench_sessiondiff [rows] [changes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from syschangemon.core.dictdiff import DictDiff
+from syschangemon.core.filemode import FileMode
+from syschangemon.core.model import Model, cache
+from syschangemon.core.sessiondiff import SessionDiff
+
+
+def collect(model, count, changed=()):
+    stamp = datetime(2016, 4, 5, 20, 48, 16)
+    session = model.new_session(closed=True)
+    session.save()
+    with model.transaction():
+        writer = session.state_writer(fresh=True)
+        for i in range(count):
+            writer.add(session.new_state(url='file:///bench/%08d' % i, plugin='file', size=i,
+                                         mode=FileMode(0o100644), uid=0, gid=0, user='root', group='root',
+                                         mtime=stamp, ctime=stamp, hash='%064x' % (i + (i in changed))))
+        writer.flush()
+    return session
+
+
+def legacy_diff(old_session, new_session):
+    # SessionDiff.__init__ before the comparison moved to the database
+    old_urls = set(old_session.all_urls())
+    new_urls = set(new_session.all_urls())
+    diffs = []
+    for url in old_urls & new_urls:
+        diff = DictDiff(old_session.get_state(url), url, new_session.get_state(url), url,
+                        ['id', 'sessionid', 'uuid', 'assume_nochange'])
+        if not diff.is_empty():
+            diffs.append(diff)
+    return diffs
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    changes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    tmpdir = tempfile.mkdtemp()
+    try:
+        model = Model('sqlite:///' + os.path.join(tmpdir, 'db.sqlite'))
+        old = collect(model, count)
+        new = collect(model, count, changed=set(range(0, count, max(1, count // changes))))
+
+        cache.clear()
+        start = time.time()
+        diff = SessionDiff(old, new)
+        diff_count = len(list(diff.diffs))
+        t_join = time.time() - start
+
+        cache.clear()
+        start = time.time()
+        diffs = legacy_diff(old, new)
+        t_legacy = time.time() - start
+    finally:
+        shutil.rmtree(tmpdir)
+
+    assert len(diffs) == diff_count
+    print("%d states, %d changed: per url %.2fs, join %.2fs (%.1fx)" %
+          (count, diff_count, t_legacy, t_join, t_legacy / t_join if t_join > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: run time of each subcommand and the state plugins it sets up.
+
+Copies the test sandbox to a temporary directory, collects and diffs two sessions there,
+then runs each subcommand a few times in a fresh application, as the command line does.
+Plugin setup of all state plugins, which every command paid before plugins were set up
+per phase, is timed as well. Run from the source root:
+
+    python -m tests.benchmark.bench_startup [runs]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import StringIO
+
+from cement.utils.misc import init_defaults
+
+from syschangemon.cli.main import SysChangeMonApp
+
+sandbox = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'sandbox')
+config_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'config')
+
+commands = [['list-sessions'], ['list-reports'], ['print-report'], ['export'], ['cleanup'], ['diff'], ['collect']]
+
+
+def make_app(etc):
+    class BenchApp(SysChangeMonApp):
+        class Meta:
+            config_defaults = init_defaults('syschangemon')
+            label = 'syschangemon'
+            exit_on_close = False
+            config_section = 'syschangemon'
+            plugin_config_dirs = [etc + '/plugins.d']
+            config_files = [etc + '/syschangemon.conf']
+    return BenchApp
+
+
+def run(app_class, argv):
+    """
+    :return: tuple (seconds, labels of state plugins set up)
+    """
+    backup = sys.stdout
+    sys.stdout = StringIO()
+    start = time.time()
+    try:
+        app = app_class(argv=list(argv))
+        with app:
+            app.run()
+            plugins = sorted(app.controller.plugins.keys())
+    except SystemExit:
+        plugins = []
+    finally:
+        sys.stdout = backup
+    return time.time() - start, plugins
+
+
+def setup_all(app_class):
+    app = app_class(argv=['list-sessions'])
+    with app:
+        start = time.time()
+        for h in app.handler.list('state_plugin'):
+            h().setup(app)
+        return time.time() - start
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    base = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        for name in ['etc', 'files', 'log']:
+            shutil.copytree(os.path.join(sandbox, name), os.path.join(base, name))
+        os.chdir(base)
+        app_class = make_app(base + '/etc')
+        run(app_class, ['collect'])
+        with open(os.path.join(base, 'files', 'testfile'), 'w') as fd:
+            fd.write('test file content')
+        run(app_class, ['collect'])
+        run(app_class, ['diff'])
+
+        print("setting up all state plugins: %.1fms, %.1fms with the shipped configuration" %
+              (setup_all(app_class) * 1000, setup_all(make_app(config_dir)) * 1000))
+        for argv in commands:
+            times = []
+            for i in range(runs):
+                (seconds, plugins) = run(app_class, argv)
+                times.append(seconds)
+            print("%-14s %7.1fms  plugins set up: %s" % (' '.join(argv), min(times) * 1000, ', '.join(plugins) or '-'))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: writing the states of a fresh session.
+
+Compares the playhouse.dataset upsert per row used before the typed states schema,
+State.save() per row and StateWriter. Each run writes file plugin like states into
+a new on-disk database. Run from the source root:
+
+    python -m tests.benchmark.bench_state_write [rows]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from syschangemon.core.filemode import FileMode
+from syschangemon.core.model import Model, MyDataSet, cache
+
+
+def make_states(session, count):
+    stamp = datetime(2016, 4, 5, 20, 48, 16)
+    res = []
+    for i in range(count):
+        res.append(session.new_state(url='file:///bench/%08d' % i, plugin='file', size=i, mode=FileMode(0o100644),
+                                     uid=0, gid=0, user='root', group='root', mtime=stamp, ctime=stamp,
+                                     hash='%064x' % i))
+    return res
+
+
+def run(uri, count, write):
+    model = Model(uri)
+    session = model.new_session()
+    session.save()
+    states = make_states(session, count)
+    cache.clear()
+
+    start = time.time()
+    table = write(model, session, states)
+    elapsed = time.time() - start
+
+    assert model.query('select count(*) from %s' % table).fetchone()[0] == count
+    return elapsed
+
+
+def write_dataset_upsert(model, session, states):
+    # dynamic column table with guessed types, as states were stored before
+    dataset = MyDataSet(model.db._url)
+    table = dataset['legacy_states']
+    with dataset.transaction():
+        for state in states:
+            row = dict(state)
+            row['mode'] = str(row['mode'])
+            table.upsert(columns=['url', 'sessionid'], **row)
+    dataset.close()
+    return 'legacy_states'
+
+
+def write_save(model, session, states):
+    with model.transaction():
+        for state in states:
+            state.save()
+    return 'states'
+
+
+def write_bulk(model, session, states):
+    with model.transaction():
+        writer = session.state_writer(fresh=True)
+        for state in states:
+            writer.add(state)
+        writer.flush()
+    return 'states'
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, write in [('dataset upsert', write_dataset_upsert), ('State.save', write_save),
+                            ('StateWriter', write_bulk)]:
+            elapsed = run('sqlite:///' + os.path.join(tmpdir, write.__name__ + '.db'), count, write)
+            print("%d states: %-15s %.2fs (%.0f rows/s)" % (count, name, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
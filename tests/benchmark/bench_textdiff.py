@@ -0,0 +1,91 @@
+"""
+Benchmark: diffing changed multi-line values.
+
+Reads the text files below a directory (default /etc) and diffs each against a copy with
+a few lines edited and against a wholesale rewrite (lines shuffled). Compares the
+diff_match_patch based DictDiff._diff_text used before with TextDiff, without and with
+its result cache. Needs diff_match_patch, which syschangemon itself does not use any more,
+install it with the 'bench' extra (pip install -e .[bench]). Run from the source root:
+
+    python -m tests.benchmark.bench_textdiff [directory] [max files]
+"""
+import os
+import random
+import sys
+import time
+from urllib.parse import unquote
+
+from diff_match_patch.diff_match_patch import diff_match_patch
+
+from syschangemon.core.model import Model
+from syschangemon.core.textdiff import TextDiff
+
+
+def legacy_diff_text(t1, t2):
+    # DictDiff._diff_text before TextDiff
+    diff = diff_match_patch()
+    diff.Diff_Timeout = 1
+    a = diff.diff_linesToChars(t1, t2)
+    diffs = diff.diff_main(a[0], a[1], False)
+    diff.diff_charsToLines(diffs, a[2])
+    diff.diff_cleanupEfficiency(diffs)
+    patch = diff.patch_make(diffs)
+    return unquote(diff.patch_toText(patch).replace('%0A', ''))
+
+
+def read_texts(base, limit):
+    res = []
+    for root, dirs, files in os.walk(base):
+        for name in sorted(files):
+            try:
+                with open(os.path.join(root, name), encoding='utf-8') as fd:
+                    text = fd.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            if text.count('\n') > 1:
+                res.append(text)
+            if len(res) >= limit:
+                return res
+    return res
+
+
+def churn(texts, rnd):
+    edited = []
+    rewritten = []
+    for text in texts:
+        lines = text.split('\n')
+        for i in range(3):
+            idx = rnd.randrange(len(lines))
+            lines[idx] = '# edited ' + lines[idx]
+        edited.append((text, '\n'.join(lines)))
+        lines = text.split('\n')
+        rnd.shuffle(lines)
+        rewritten.append((text, '\n'.join(lines)))
+    return edited, rewritten
+
+
+def timed(pairs, diff):
+    start = time.time()
+    for t1, t2 in pairs:
+        diff(t1, t2)
+    return time.time() - start
+
+
+def main():
+    base = sys.argv[1] if len(sys.argv) > 1 else '/etc'
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    texts = read_texts(base, limit)
+    (edited, rewritten) = churn(texts, random.Random(1))
+
+    for name, pairs in [('edited', edited), ('rewritten', rewritten)]:
+        chars = sum(len(t1) + len(t2) for t1, t2 in pairs)
+        text_diff = TextDiff(Model('sqlite:///:memory:'))
+        t_legacy = timed(pairs, legacy_diff_text)
+        t_new = timed(pairs, text_diff.diff)
+        t_cached = timed(pairs, text_diff.diff)
+        print("%d %s files (%d chars): diff_match_patch %.2fs, TextDiff %.2fs, cached %.2fs (%d summarized)" %
+              (len(pairs), name, chars, t_legacy, t_new, t_cached, text_diff.summaries))
+
+
+if __name__ == '__main__':
+    main()
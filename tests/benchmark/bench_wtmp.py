@@ -0,0 +1,102 @@
+"""
+Benchmark: decoding wtmp records and pairing logins and logouts.
+
+Writes a synthetic wtmp file in the STRUCT layout (default one million records: logins and
+logouts on random ttys, a reboot every 100000 records, every fifth record of a type pairing
+ignores). Compares utmp_read() with the column-wise utmp_read_logins() and the nested forward scan
+used before with pair_sessions(). The nested scan only gets a prefix of the records, its
+results are checked against pair_sessions() on the same prefix. Run from the source root:
+
+    python -m tests.benchmark.bench_wtmp [records] [legacy records]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from syschangemon.cli.plugins.wtmp import STRUCT, UTmpRecordType, pair_sessions, utmp_read, utmp_read_logins
+
+
+def legacy_pair_sessions(records):
+    # WtmpPlugin.parse_wtmp before pair_sessions(), on (seq, record) tuples
+    entries = [entry for (seq, entry) in records]
+    wtmp_sessions = []
+    idx = 0
+    for entry in entries:
+        if entry.type == UTmpRecordType.user_process:
+            end = None
+            for nentry in entries[idx:]:
+                if (nentry.type == UTmpRecordType.dead_process and nentry.line == entry.line) or \
+                        nentry.type == UTmpRecordType.boot_time:
+                    end = nentry.sec + nentry.usec*0.000001
+                    break
+            wtmp_sessions.append({'seq': records[idx][0], 'user': entry.user, 'host': entry.host,
+                                  'line': entry.line, 'start': entry.sec + entry.usec*0.000001, 'end': end})
+        idx += 1
+    return wtmp_sessions
+
+
+def write_wtmp(path, count, rnd):
+    with open(path, 'wb') as fd:
+        sec = 1000000000
+        for i in range(count):
+            sec += rnd.randrange(60)
+            if i % 100000 == 0:
+                (rtype, line, user, host) = (UTmpRecordType.boot_time, '~', 'reboot', '')
+            elif i % 5 == 0:
+                (rtype, line, user, host) = (UTmpRecordType.login_process, 'tty1', 'LOGIN', '')
+            else:
+                line = 'pts/%d' % rnd.randrange(200)
+                # logins outnumber logouts, many stay open until the next reboot
+                if rnd.random() < 0.6:
+                    (rtype, user, host) = (UTmpRecordType.user_process, 'user%d' % rnd.randrange(50),
+                                           '10.0.%d.%d' % (rnd.randrange(256), rnd.randrange(256)))
+                else:
+                    (rtype, user, host) = (UTmpRecordType.dead_process, '', '')
+            fd.write(STRUCT.pack(rtype.value, i, line.encode(), b'', user.encode(), host.encode(),
+                                 0, 0, 0, sec, 0, 0, 0, 0, 0, b''))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    legacy_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        write_wtmp(path, count, random.Random(1))
+        with open(path, 'rb') as fd:
+            buf = fd.read()
+
+        start = time.time()
+        records = [(seq, entry) for (seq, entry) in enumerate(utmp_read(buf))
+                   if entry.type in (UTmpRecordType.user_process, UTmpRecordType.dead_process,
+                                     UTmpRecordType.boot_time)]
+        print("utmp_read: %d of %d records in %.2fs" % (len(records), count, time.time() - start))
+
+        start = time.time()
+        logins = list(utmp_read_logins(buf))
+        print("utmp_read_logins: %d of %d records in %.2fs" % (len(logins), count, time.time() - start))
+        assert [seq for (seq, entry) in records] == [seq for (seq, entry) in logins]
+
+        start = time.time()
+        sessions = pair_sessions(records)
+        print("pair_sessions: %d sessions in %.2fs" % (len(sessions), time.time() - start))
+
+        prefix = records[:legacy_count]
+        start = time.time()
+        legacy = legacy_pair_sessions(prefix)
+        legacy_time = time.time() - start
+        start = time.time()
+        linear = pair_sessions(prefix)
+        linear_time = time.time() - start
+        assert legacy == linear
+        print("first %d records: nested scan %.2fs, pair_sessions %.3fs, %d sessions equal" %
+              (len(prefix), legacy_time, linear_time, len(linear)))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+from unittest import TestCase
+
+from syschangemon.cli.ext.collector import Collector
+from syschangemon.cli.ext.pluginbase import StatePluginBase, UnsupportedException
+from syschangemon.core.model import Model, cache
+from syschangemon.utils.test import TestLogHandler
+
+
+class ListPlugin(StatePluginBase):
+    class Meta:
+        label = 'list'
+
+    def get_state(self, url):
+        if not url.startswith('list://'):
+            raise UnsupportedException
+        return {'size': len(url), '_transient': True}
+
+
+class ManyPlugin(StatePluginBase):
+    class Meta:
+        label = 'many'
+
+    url_schemes = ('many',)
+
+    def list_urls(self):
+        return ('many://%05d' % i for i in range(1000))
+
+    def get_state(self, url):
+        if url == 'many://00500' and self.fail:
+            raise ValueError(url)
+        return {'n': int(url[7:])}
+
+
+class UpperPlugin(StatePluginBase):
+    class Meta:
+        label = 'upper'
+
+    url_schemes = ()
+
+    def __init__(self):
+        super(UpperPlugin, self).__init__()
+        self.seen = []
+
+    def process_state(self, state):
+        self.seen.append(state['url'])
+        self.transient = state.get('_transient')
+        state['upper'] = state['url'].upper()
+        return state
+
+
+class CountPlugin(StatePluginBase):
+    class Meta:
+        label = 'count'
+
+    url_schemes = ()
+
+    post_process_prefixes = ('list://a',)
+
+    def __init__(self):
+        super(CountPlugin, self).__init__()
+        self.seen = []
+
+    def post_process_state(self, state):
+        self.seen.append(state['url'])
+        if state['url'] == 'list://a1':
+            state['counted'] = True
+        return state
+
+
+class TestCollector(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+        cache.clear()
+
+    def test_collect(self):
+        session = self.model.new_session()
+        session.save()
+        plugins = {'list': ListPlugin(), 'upper': UpperPlugin(), 'count': CountPlugin()}
+        collector = Collector(session, plugins, TestLogHandler())
+        self.assertListEqual([plugins['upper']], collector.stages)
+        self.assertListEqual([plugins['count']], collector.post_stages)
+        self.assertSetEqual({'list'}, collector.routed)
+
+        writer = collector.run(['list://a1', 'list://a2', 'list://b', 'other://x'])
+        self.assertEqual(4, writer.written)  # a1 written again by the post-pass
+        self.assertTrue(plugins['upper'].transient)
+        self.assertListEqual(['list://a1', 'list://a2', 'list://b'], plugins['upper'].seen)
+        self.assertListEqual(['list://a1', 'list://a2'], sorted(plugins['count'].seen))
+        self.assertEqual(1, collector.post_processed)
+
+        cache.clear()
+        state = session.get_state('list://a1')
+        self.assertEqual('LIST://A1', state['upper'])
+        self.assertTrue(state['counted'])
+        self.assertNotIn('_transient', state)
+        self.assertNotIn('counted', session.get_state('list://a2'))
+
+    def test_pipeline(self):
+        session = self.model.new_session()
+        session.save()
+        plugin = ManyPlugin()
+        plugin.fail = False
+        collector = Collector(session, {'many': plugin}, TestLogHandler(), queue_depth=2)
+        writer = collector.run()
+        self.assertEqual(1000, collector.url_count)
+        self.assertEqual(1000, writer.written)
+        self.assertEqual(999, session.get_state('many://00999')['n'])
+
+    def test_failure(self):
+        session = self.model.new_session()
+        session.save()
+        plugin = ManyPlugin()
+        plugin.fail = True
+        collector = Collector(session, {'many': plugin, 'list': ListPlugin()}, TestLogHandler(), queue_depth=2)
+        self.assertListEqual(['many', 'list'], collector.route('many://00001'))
+        self.assertListEqual(['list'], collector.route('list://a'))
+        with self.assertRaises(ValueError):
+            collector.run()
@@ -1,4 +1,5 @@
 import pprint
+import time
 
 from syschangemon.cli.main import TestConfigHandler
 from syschangemon.cli.plugins.command import CommandPlugin
@@ -18,11 +19,39 @@ class TestCommandPlugin(test.SysChangeMonTestCase):
         assert isinstance(cnf, TestConfigHandler)
         cnf.add_section('command')
         cnf.set('command', 'command.echo', 'echo "stdout value" > /dev/stdout ; echo "stderr value" > /dev/stderr')
+        cnf.set('command', 'command.sleep1', 'sleep 1')
+        cnf.set('command', 'command.sleep2', 'sleep 1')
+        cnf.set('command', 'command.hang', 'echo started; sleep 10')
+        cnf.set('command', 'timeout.hang', '0.2')
+        cnf.set('command', 'command.yes', 'yes | head -c 100000')
+        cnf.set('command', 'output_limit', '1000')
 
     def test_list_urls(self):
         urls = self.plugin.list_urls()
-        self.assertListEqual(urls, ['command://echo'])
+        self.assertListEqual(sorted(urls), ['command://echo', 'command://hang', 'command://sleep1',
+                                            'command://sleep2', 'command://yes'])
 
     def test_get_state(self):
         res = self.plugin.get_state('command://echo')
+        self.assertGreaterEqual(res.pop('duration'), 0)
         self.assertDictEqual(res, {'return_code': 0, 'stderr': 'stderr value\n', 'stdout': 'stdout value\n'})
+
+    def test_timeout(self):
+        start = time.time()
+        res = self.plugin.get_state('command://hang')
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(res['timed_out'])
+        self.assertEqual('started\n', res['stdout'])
+
+    def test_output_limit(self):
+        res = self.plugin.get_state('command://yes')
+        self.assertEqual('y\n' * 500, res['stdout'])
+        self.assertEqual(100000, res['stdout_truncated'])
+        self.assertNotIn('stderr_truncated', res)
+
+    def test_get_states(self):
+        start = time.time()
+        res = list(self.plugin.get_states(['command://sleep1', 'command://sleep2', 'file://x']))
+        # run at once: below the 2s they take one after the other
+        self.assertLess(time.time() - start, 1.8)
+        self.assertListEqual(['command://sleep1', 'command://sleep2'], [url for url, state in res])
@@ -0,0 +1,72 @@
+import os
+
+from syschangemon.cli.plugins.conffile import ConffilePlugin
+from syschangemon.cli.plugins.file import FilePlugin
+from syschangemon.utils import test
+
+sandbox = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'sandbox')
+
+
+class TestFilePlugin(test.SysChangeMonTestCase):
+
+    def test_find_prune_patterns(self):
+        pats = FilePlugin._find_prune_patterns(['/var/cache/**', '/tmp**', '**.bak', '**', '/etc/*.d/**', 'foo\\**'])
+        self.assertListEqual(pats, ['/var/cache/', '/tmp', '/etc/*.d/'])
+
+    def test_is_pruned_dir(self):
+        cnf = self.app.config
+        cnf.add_section('file')
+        cnf.set('file', 'include', '/var/**')
+        cnf.set('file', 'exclude', '\n/var/cache/**\n/var/lib/*/tmp**\n**.bak')
+        plugin = FilePlugin()
+        plugin.setup(self.app)
+        self.assertTrue(plugin._is_pruned_dir('/var/cache'))
+        self.assertTrue(plugin._is_pruned_dir('/var/lib/dpkg/tmp'))
+        self.assertFalse(plugin._is_pruned_dir('/var'))
+        self.assertFalse(plugin._is_pruned_dir('/var/cache.bak'))
+        self.assertFalse(plugin._is_pruned_dir('/var/lib/dpkg'))
+
+    def get_states(self, workers, pool='thread'):
+        cnf = self.app.config
+        if not cnf.has_section('file'):
+            cnf.add_section('file')
+        cnf.set('file', 'include', os.path.join(sandbox, 'files', '**'))
+        cnf.set('file', 'hash_workers', str(workers))
+        cnf.set('file', 'hash_pool', pool)
+        self.app.storage.db.new_session().save()  # open session, not used for assume_nochange
+        plugin = FilePlugin()
+        plugin.setup(self.app)
+        urls = sorted(plugin.list_urls()) + ['command://echo']
+        return [(url, res['hash']) for url, res in plugin.get_states(urls)]
+
+    def test_get_states_serial(self):
+        res = self.get_states(1)
+        self.assertEqual(6, len(res))
+        self.assertIn(('file://' + os.path.join(sandbox, 'files', 'passwd'),
+                       'd3ac21fe5a2a30c3e8a5608cb0a00179df0c4baf95d2a6755b401aeb0ba50028'), res)
+
+    def test_get_states_thread_pool(self):
+        self.assertListEqual(self.get_states(1), self.get_states(3))
+
+    def test_get_states_process_pool(self):
+        self.assertListEqual(self.get_states(1), self.get_states(2, 'process'))
+
+    def test_content_readers(self):
+        cnf = self.app.config
+        cnf.add_section('file')
+        cnf.set('file', 'include', os.path.join(sandbox, 'files', '**'))
+        cnf.add_section('conffile')
+        cnf.set('conffile', 'size_limit', '100')
+        cnf.set('conffile', 'exclude', '**/latin*')
+        self.app.storage.db.new_session().save()
+        plugin = FilePlugin()
+        plugin.setup(self.app)
+        urls = sorted(plugin.list_urls())
+        self.assertTrue(all(res['_read'].content is None for url, res in plugin.get_states(urls)))
+
+        conffile = ConffilePlugin()
+        conffile.setup(self.app)
+        plugin.content_readers = [conffile]
+        kept = [os.path.basename(url) for url, res in plugin.get_states(urls) if res['_read'].content is not None]
+        # passwd is above the size limit
+        self.assertListEqual(['conffile', 'unicode', 'utf16'], kept)
@@ -1,15 +1,48 @@
+import os
 import pprint
+import shutil
 import struct
+import tempfile
+from datetime import datetime, timezone
 
-from syschangemon.cli.plugins.wtmp import WtmpPlugin, utmp_read
+from syschangemon.cli.plugins import wtmp
+from syschangemon.cli.plugins.wtmp import STRUCT, UTmpRecordType, WtmpPlugin, pair_sessions, utmp_read, \
+    utmp_read_logins
+from syschangemon.core.dictdiff import DictDiff
+from syschangemon.core.model import Model
 from syschangemon.utils import test
 
+
+def record(type, line, user='', host='', sec=0):
+    return STRUCT.pack(type.value, 1, line.encode(), b'', user.encode(), host.encode(), 0, 0, 0, sec, 0,
+                       0, 0, 0, 0, b'')
+
+
 class TestSysInfoPlugin(test.SysChangeMonTestCase):
 
     def setUp(self):
         super(TestSysInfoPlugin, self).setUp()
         #self.plugin = WtmpPlugin()
         #self.plugin.setup(self.app)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'wtmp')
+
+    def tearDown(self):
+        super(TestSysInfoPlugin, self).tearDown()
+        shutil.rmtree(self.dir)
+
+    def write(self, records, mode='ab'):
+        with open(self.path, mode) as fd:
+            fd.write(b''.join(records))
+
+    def new_plugin(self):
+        plugin = WtmpPlugin()
+        plugin.app = self.app
+        plugin.path = self.path
+        return plugin
+
+    def sessions(self, sessions):
+        return [(s['user'], s['line'], s['start'].timestamp(), s['end'].timestamp()) for s in sessions]
 
     def test_read_empty(self):
         for entry in utmp_read(b''):
@@ -19,3 +52,97 @@ class TestSysInfoPlugin(test.SysChangeMonTestCase):
         with self.assertRaises(struct.error):
             for entry in utmp_read(b'123'):
                 pass
+
+    def test_read_logins(self):
+        buf = b''.join([record(UTmpRecordType.boot_time, '~', 'reboot', sec=50),
+                        record(UTmpRecordType.login_process, 'tty1', 'LOGIN', sec=60),
+                        record(UTmpRecordType.user_process, 'pts/0', 'alice', 'a.example.com', sec=100),
+                        record(UTmpRecordType.run_lvl, '~', 'runlevel', sec=150),
+                        record(UTmpRecordType.dead_process, 'pts/0', sec=200)] * 3)
+        block_records = wtmp.BLOCK_RECORDS
+        wtmp.BLOCK_RECORDS = 4
+        try:
+            logins = list(utmp_read_logins(buf, STRUCT.size))
+        finally:
+            wtmp.BLOCK_RECORDS = block_records
+        expected = [(seq, (r[0], r.line, r.user, r.host, r.sec, r.usec))
+                    for (seq, r) in enumerate(utmp_read(buf)) if r[0] in (2, 7, 8) and seq >= 1]
+        # strings of dead_process and boot_time records are not decoded except the line of logouts
+        expected = [(seq, (t, line if t != 2 else '', user if t == 7 else '', host, sec, usec))
+                    for (seq, (t, line, user, host, sec, usec)) in expected]
+        self.assertListEqual(expected, [(seq, tuple(r)) for (seq, r) in logins])
+        self.assertEqual((7, 'pts/0', 'alice', 'a.example.com', 100, 0), tuple(logins[0][1]))
+        self.assertListEqual([], list(utmp_read_logins(b'')))
+        with self.assertRaises(struct.error):
+            list(utmp_read_logins(buf[:100]))
+
+    def test_pair_sessions(self):
+        records = list(enumerate(utmp_read(b''.join([
+            record(UTmpRecordType.user_process, 'pts/0', 'alice', sec=100),
+            record(UTmpRecordType.user_process, 'pts/0', 'bob', sec=200),
+            record(UTmpRecordType.user_process, 'pts/1', 'carol', sec=300),
+            record(UTmpRecordType.dead_process, 'pts/0', sec=400),
+            record(UTmpRecordType.user_process, 'pts/2', 'dave', sec=500)])), 10))
+        open_sessions = [{'seq': 3, 'user': 'eve', 'host': '', 'line': 'pts/1', 'start': 50, 'end': None}]
+        sessions = [(s['seq'], s['user'], s['start'], s['end']) for s in pair_sessions(records, open_sessions)]
+        # one logout ends all sessions of its line
+        self.assertListEqual([(3, 'eve', 50, None), (10, 'alice', 100, 400), (11, 'bob', 200, 400),
+                              (12, 'carol', 300, None), (14, 'dave', 500, None)], sessions)
+
+    def test_read_wtmp(self):
+        model = Model('sqlite:///:memory:')
+        self.write([record(UTmpRecordType.boot_time, '~', sec=1000),
+                    record(UTmpRecordType.user_process, 'pts/0', 'alice', 'a.example.com', 1100),
+                    record(UTmpRecordType.user_process, 'pts/1', 'bob', 'b.example.com', 1200),
+                    record(UTmpRecordType.dead_process, 'pts/0', sec=1300),
+                    # half written record
+                    record(UTmpRecordType.user_process, 'pts/2', 'carol', 'c.example.com', 1400)[:100]])
+        sessions = self.sessions(self.new_plugin().read_wtmp(model))
+        self.assertEqual(('alice', 'pts/0', 1100, 1300), sessions[0])
+        self.assertEqual(('bob', 'pts/1'), sessions[1][0:2])  # still open
+
+        # complete the record, append more
+        with open(self.path, 'r+b') as fd:
+            fd.truncate(4 * STRUCT.size)
+        self.write([record(UTmpRecordType.user_process, 'pts/2', 'carol', 'c.example.com', 1400),
+                    record(UTmpRecordType.dead_process, 'pts/1', sec=1500),
+                    record(UTmpRecordType.user_process, 'pts/0', 'alice', 'a.example.com', 1600),
+                    record(UTmpRecordType.boot_time, '~', sec=1700)])
+        plugin = self.new_plugin()
+        sessions = self.sessions(plugin.read_wtmp(model))
+        self.assertListEqual(self.sessions(plugin.parse_wtmp(self.path)), sessions)
+        self.assertListEqual([('alice', 'pts/0', 1100, 1300), ('bob', 'pts/1', 1200, 1500),
+                              ('carol', 'pts/2', 1400, 1700), ('alice', 'pts/0', 1600, 1700)], sessions)
+
+        # rotated
+        os.unlink(self.path)
+        self.write([record(UTmpRecordType.user_process, 'pts/3', 'dave', 'd.example.com', 1800),
+                    record(UTmpRecordType.dead_process, 'pts/3', sec=1900)])
+        sessions = self.sessions(self.new_plugin().read_wtmp(model))
+        self.assertListEqual([('dave', 'pts/3', 1800, 1900)], sessions)
+
+    def test_process_diff(self):
+        def ts(sec):
+            return datetime.fromtimestamp(sec, timezone.utc)
+
+        plugin = self.new_plugin()
+        plugin.wtmp_sessions = [{'user': 'alice', 'host': 'a', 'line': 'pts/0', 'start': ts(100), 'end': ts(200)},
+                                {'user': 'bob', 'host': 'b', 'line': 'pts/1', 'start': ts(300), 'end': ts(400)},
+                                {'user': 'carol', 'host': 'c', 'line': 'pts/2', 'start': ts(350), 'end': ts(1000)}]
+
+        class Diff:
+            extra = {}
+            old_session = {'stamp': ts(150)}
+            new_session = {'stamp': ts(250)}
+
+        diff = plugin.process_diff(Diff())
+        self.assertRegex(diff.extra['relevant_wtmp'], '^[^\n]* alice pts/0@a\n$')
+
+        item = plugin.process_diff_item(DictDiff({'mtime': ts(0)}, 'file://x', {'mtime': ts(375)}, 'file://x'))
+        self.assertEqual(2, item.plus_info['relevant_wtmp'].count('\n'))
+        self.assertRegex(item.plus_info['relevant_wtmp'], 'bob pts/1@b\n')
+        self.assertRegex(item.plus_info['relevant_wtmp'], 'carol pts/2@c\n')
+        self.assertEqual(3, diff.extra['relevant_wtmp'].count('\n'))
+
+        item = plugin.process_diff_item(DictDiff({'mtime': ts(0)}, 'file://y', {'mtime': ts(2000)}, 'file://y'))
+        self.assertNotIn('relevant_wtmp', item.plus_info)
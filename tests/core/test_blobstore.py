@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from syschangemon.core.model import Model, cache
+
+
+class TestBlobStore(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+        self.text = 'line of text\n' * 100
+
+    def count_blobs(self):
+        return self.model.query('select count(*) from blobs').fetchone()[0]
+
+    def test_put_get(self):
+        digest = self.model.blobs.put(self.text)
+        self.assertEqual(64, len(digest))
+        self.assertEqual(digest, self.model.blobs.put(self.text))
+        self.assertEqual(1, self.count_blobs())
+        self.assertEqual(1, self.model.blobs.reused)
+        self.model.blobs.get.cache_clear()
+        self.assertEqual(self.text, self.model.blobs.get(digest))
+        self.assertEqual('\ud800' * 300, self.model.blobs.get(self.model.blobs.put('\ud800' * 300)))
+        with self.assertRaises(KeyError):
+            self.model.blobs.get('00' * 32)
+
+    def test_compressed(self):
+        self.model.blobs.put(self.text)
+        size = self.model.query('select length(data) from blobs').fetchone()[0]
+        self.assertLess(size, len(self.text) / 10)
+
+    def test_states_share_blobs(self):
+        for i in range(3):
+            sess = self.model.new_session()
+            sess.save()
+            sess.new_state(url='file:///etc/conf', content=self.text, short='short text').save()
+        self.assertEqual(1, self.count_blobs())
+        extras = self.model.query('select extras from states').fetchone()[0]
+        self.assertNotIn('line of text', extras)
+        self.assertIn('short text', extras)
+        cache.clear()
+        self.model.blobs.get.cache_clear()
+        self.assertEqual(self.text, sess.get_state('file:///etc/conf')['content'])
+        self.assertEqual(self.text, sess.state_index().get('file:///etc/conf', 'content'))
+
+    def test_gc(self):
+        sess1 = self.model.new_session()
+        sess1.save()
+        sess1.new_state(url='file:///a', content=self.text).save()
+        sess2 = self.model.new_session()
+        sess2.save()
+        sess2.new_state(url='file:///a', content=self.text + 'changed').save()
+        self.assertEqual(2, self.count_blobs())
+        self.assertEqual(0, self.model.blobs.gc())
+        sess1.delete()
+        self.assertEqual(1, self.model.blobs.gc())
+        self.assertEqual(1, self.count_blobs())
+        # removed blob is stored again when referenced again
+        sess2.new_state(url='file:///b', content=self.text).save()
+        self.assertEqual(2, self.count_blobs())
+
+    def test_resolve_blobs(self):
+        sess = self.model.new_session()
+        sess.save()
+        sess.new_state(url='file:///a', content=self.text).save()
+        sess.new_state(url='file:///b', content=self.text + 'b').save()
+        digests = [self.model.blobs.put(self.text), self.model.blobs.put(self.text + 'b')]
+        self.assertDictEqual({digests[0]: self.text, digests[1]: self.text + 'b'},
+                             self.model.blobs.get_many(digests * 2))
+        with self.assertRaises(KeyError):
+            self.model.blobs.get_many(['00' * 32])
+
+        idx = sess.state_index(resolve_blobs=True)
+
+        def fail(digest):
+            raise AssertionError("blob %s loaded from the database" % digest)
+        self.model.blobs.get = fail
+        self.assertEqual(self.text + 'b', idx.values('file:///b')['content'])
+        self.assertEqual(self.text, idx.get('file:///a', 'content'))
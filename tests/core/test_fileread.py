@@ -0,0 +1,60 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from syschangemon.core import fileread
+from syschangemon.core.fileread import read_file
+
+
+class TestFileRead(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as fd:
+            fd.write(data)
+        return path
+
+    def test_read_file(self):
+        data = b'line of text\n' * 1000
+        path = self.write('text', data)
+        read = read_file(path, content_limit=len(data))
+        self.assertEqual(hashlib.sha256(data).digest(), read.digest)
+        self.assertEqual(len(data), read.size)
+        self.assertEqual(data[:fileread.SNIFF_SIZE], read.head)
+        self.assertEqual(data, read.content)
+        self.assertFalse(read.is_binary)
+
+        read = read_file(path, content_limit=len(data) - 1)
+        self.assertEqual(hashlib.sha256(data).digest(), read.digest)
+        self.assertIsNone(read.content)
+
+        self.assertIsNone(read_file(path).content)
+        self.assertEqual(b'', read_file(self.write('empty', b''), content_limit=10).content)
+
+    def test_chunks(self):
+        data = os.urandom(3 * 1000)
+        path = self.write('random', data)
+        chunk_size = fileread.CHUNK_SIZE
+        fileread.CHUNK_SIZE = 1000
+        try:
+            read = read_file(path, content_limit=2500)
+            self.assertEqual(hashlib.sha256(data).digest(), read.digest)
+            self.assertEqual(data[:fileread.SNIFF_SIZE], read.head)
+            self.assertIsNone(read.content)
+            # no digest and contents above limit: stop after the head
+            read = read_file(path, content_limit=1500, digest=False)
+            self.assertIsNone(read.digest)
+            self.assertEqual(2000, read.size)
+        finally:
+            fileread.CHUNK_SIZE = chunk_size
+
+    def test_is_binary(self):
+        self.assertTrue(read_file(self.write('binary', b'\x00\x01\x02\xff' * 100)).is_binary)
+        self.assertTrue(read_file(self.write('x.pyc', b'text')).is_binary)
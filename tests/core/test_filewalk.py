@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from syschangemon.core.filewalk import walk_files, normalize_bases
+
+
+class TestFileWalk(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ['a', 'a/b', 'a/b/c', 'skip', 'skip/deep']:
+            os.mkdir(os.path.join(self.root, d))
+        for f in ['top', 'a/one', 'a/b/two', 'a/b/c/three', 'a/one.bak', 'skip/x', 'skip/deep/y']:
+            with open(os.path.join(self.root, f), 'w') as fd:
+                fd.write(f)
+        os.symlink(os.path.join(self.root, 'a'), os.path.join(self.root, 'dirlink'))
+        os.symlink(os.path.join(self.root, 'top'), os.path.join(self.root, 'filelink'))
+        os.symlink(os.path.join(self.root, 'nonexistent'), os.path.join(self.root, 'brokenlink'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def rel(self, paths):
+        return sorted(os.path.relpath(p, self.root) for p in paths)
+
+    def test_deep_matches_os_walk(self):
+        expected = []
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                filename = os.path.join(root, name)
+                if os.path.isfile(filename):
+                    expected.append(filename)
+        self.assertListEqual(self.rel(expected), self.rel(walk_files([], [self.root])))
+
+    def test_flat(self):
+        self.assertListEqual(['filelink', 'top'], self.rel(walk_files([self.root], [])))
+
+    def test_include_exclude(self):
+        res = walk_files([], [self.root],
+                         include=lambda p: p.startswith(os.path.join(self.root, 'a')),
+                         exclude=lambda p: p.endswith('.bak'))
+        self.assertListEqual(['a/b/c/three', 'a/b/two', 'a/one'], self.rel(res))
+
+    def test_prune(self):
+        visited = []
+
+        def prune(path):
+            visited.append(path)
+            return path.endswith('skip')
+
+        res = walk_files([], [self.root], prune=prune)
+        self.assertNotIn('skip/x', self.rel(res))
+        self.assertNotIn(os.path.join(self.root, 'skip', 'deep'), visited)
+
+    def test_missing_base(self):
+        self.assertListEqual([], list(walk_files([self.root + '/nonexistent'], [self.root + '/nonexistent'])))
+
+    def test_normalize_bases(self):
+        (flat, deep) = normalize_bases(['/etc', '/etc/ssh', '/usr/bin'], ['/etc', '/etc/ssh', '/usr/lib', '/'])
+        self.assertListEqual(['/'], deep)
+        self.assertListEqual([], flat)
+        (flat, deep) = normalize_bases(['/etc', '/etc/ssh', '/usr/bin'], ['/etc/ssh', '/usr/libexec', '/usr/lib'])
+        self.assertListEqual(['/etc', '/usr/bin'], flat)
+        self.assertListEqual(['/etc/ssh', '/usr/lib', '/usr/libexec'], sorted(deep))
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+import globre
+
+from syschangemon.core.globset import GlobSet
+
+
+class TestGlobSet(TestCase):
+    patterns = [
+        '/etc/**',
+        '/usr/bin/*',
+        '/etc/mtab',
+        '**.bak',
+        '**~',
+        '/etc/ssh/ssh_host_?sa_key',
+        'foo[0-9A-F].conf',
+        'foo-{\\\\D{2,4\\}}.txt',
+        'literal\\*star',
+    ]
+
+    paths = [
+        '/etc/passwd', '/etc/ssh/sshd_config', '/usr/bin/python', '/usr/bin/x/y', '/etc/mtab',
+        '/var/foo.bak', '/var/foo~', '/etc/ssh/ssh_host_rsa_key', 'fooA.conf', 'fooG.conf',
+        'foo-DD.txt', 'foo-012.txt', 'literal*star', 'literalxstar', '/etc/mtab\n', '', '/',
+    ]
+
+    @staticmethod
+    def loop_match(path, patterns):
+        for pat in patterns:
+            if globre.compile(pat, flags=globre.EXACT, split_prefix=False).match(path):
+                return True
+        return False
+
+    def test_same_answers_as_loop(self):
+        gs = GlobSet(self.patterns)
+        for path in self.paths:
+            self.assertEqual(self.loop_match(path, self.patterns), gs.match(path), path)
+
+    def test_single_patterns(self):
+        for pat in self.patterns:
+            gs = GlobSet([pat])
+            for path in self.paths:
+                self.assertEqual(self.loop_match(path, [pat]), gs.match(path), (pat, path))
+
+    def test_empty(self):
+        gs = GlobSet([])
+        self.assertEqual(0, len(gs))
+        self.assertFalse(gs.match('/etc/passwd'))
+        self.assertFalse(gs.match(''))
+
+    def test_matching_pattern(self):
+        gs = GlobSet(self.patterns)
+        self.assertEqual('/etc/**', gs.matching_pattern('/etc/mtab'))
+        self.assertEqual('**.bak', gs.matching_pattern('/var/foo.bak'))
+        self.assertIsNone(gs.matching_pattern('/var/foo'))
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from syschangemon.core.hashcache import HashCache
+from syschangemon.core.model import Model
+
+
+class TestHashCache(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file')
+        with open(self.path, 'w') as fd:
+            fd.write('content')
+        # make timestamps old enough to be cacheable
+        os.utime(self.path, (1000000000, 1000000000))
+        self.computed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compute(self, path):
+        self.computed.append(path)
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def new_cache(self, verify_ratio=0.0):
+        cache = HashCache(self.model, verify_ratio)
+        cache.start_ns += 10 * HashCache.racy_window  # ctime of the test file is recent
+        return cache
+
+    def test_hit_and_persist(self):
+        cache = self.new_cache()
+        self.assertEqual((b'content', 'miss'), cache.get(self.path, os.stat(self.path), self.compute))
+        self.assertEqual((b'content', 'hit'), cache.get(self.path, os.stat(self.path), self.compute))
+        self.assertEqual(1, len(self.computed))
+        cache.flush()
+
+        cache = self.new_cache()
+        self.assertEqual((b'content', 'hit'), cache.get(self.path, os.stat(self.path), self.compute))
+        self.assertEqual(1, len(self.computed))
+
+    def test_rename(self):
+        cache = self.new_cache()
+        cache.get(self.path, os.stat(self.path), self.compute)
+        cache.flush()
+        # renaming the parent directory keeps inode and ctime of the file
+        os.rename(self.dir, self.dir + '.renamed')
+        self.dir += '.renamed'
+        path = os.path.join(self.dir, 'file')
+        cache = self.new_cache()
+        self.assertEqual('hit', cache.get(path, os.stat(path), self.compute)[1])
+
+    def test_change(self):
+        cache = self.new_cache()
+        cache.get(self.path, os.stat(self.path), self.compute)
+        with open(self.path, 'w') as fd:
+            fd.write('changed')
+        os.utime(self.path, (1000000001, 1000000001))
+        self.assertEqual((b'changed', 'miss'), cache.get(self.path, os.stat(self.path), self.compute))
+
+    def test_racy_entries_not_cached(self):
+        cache = HashCache(self.model)
+        cache.get(self.path, os.stat(self.path), self.compute)
+        self.assertEqual('miss', cache.get(self.path, os.stat(self.path), self.compute)[1])
+
+    def test_eviction(self):
+        cache = self.new_cache()
+        cache.get(self.path, os.stat(self.path), self.compute)
+        cache.flush()
+        cache = self.new_cache()
+        cache.flush()
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(0, len(self.new_cache().entries))
+
+    def test_touch(self):
+        cache = self.new_cache()
+        cache.get(self.path, os.stat(self.path), self.compute)
+        cache.flush()
+        cache = self.new_cache()
+        cache.touch(os.stat(self.path))
+        cache.flush()
+        self.assertEqual(0, cache.evictions)
+        self.assertEqual(1, len(self.new_cache().entries))
+
+    def test_verify_mismatch(self):
+        cache = self.new_cache()
+        cache.get(self.path, os.stat(self.path), self.compute)
+        cache.flush()
+        # forge cached digest as if content had changed behind unchanged timestamps
+        self.model.query('UPDATE hashcache SET digest = ?', [b'forged'])
+        cache = self.new_cache(verify_ratio=1.0)
+        self.assertEqual((b'content', 'mismatch'), cache.get(self.path, os.stat(self.path), self.compute))
+        self.assertEqual((b'content', 'verified'), cache.get(self.path, os.stat(self.path), self.compute))
+        self.assertEqual(1, cache.mismatches)
@@ -0,0 +1,30 @@
+import random
+from unittest import TestCase
+
+from syschangemon.core.intervalindex import IntervalIndex
+
+
+class TestIntervalIndex(TestCase):
+    def test_random(self):
+        rnd = random.Random(1)
+        intervals = []
+        for i in range(500):
+            start = rnd.randrange(1000)
+            intervals.append((start, start + rnd.randrange(100), i))
+        # zero length and reversed (clock changes) intervals
+        intervals += [(500, 500, 'empty'), (600, 550, 'reversed')]
+        index = IntervalIndex(intervals)
+        self.assertEqual(502, len(index))
+
+        for t in range(-10, 1200, 7):
+            self.assertSetEqual(set(i for i in intervals if i[0] < t < i[1]), set(index.containing(t)))
+
+        for t1, t2 in [(0, 0), (100, 200), (540, 560), (900, 2000), (-100, -50)]:
+            expected = set(i for i in intervals if i[0] < t1 < i[1] or i[0] < t2 < i[1] or
+                           t1 < i[0] < t2 or t1 < i[1] < t2)
+            self.assertSetEqual(expected, index.overlapping(t1, t2))
+
+    def test_empty(self):
+        index = IntervalIndex([])
+        self.assertListEqual([], list(index.containing(1)))
+        self.assertSetEqual(set(), index.overlapping(0, 1))
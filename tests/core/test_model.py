@@ -1,5 +1,11 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
 from unittest import TestCase
-from syschangemon.core.model import Model, Session, State
+from syschangemon.core.filemode import FileMode
+from syschangemon.core.model import Model, MyDataSet, Session, State, StateCache, cache, encode_state, \
+    fingerprint_idx, state_columns
 
 
 class TestModel(TestCase):
@@ -7,7 +13,7 @@ class TestModel(TestCase):
         self.model = Model('sqlite:///:memory:')
 
     def dump_db(self):
-        for line in self.model.db._database.get_conn().iterdump():
+        for line in self.model.connection().iterdump():
             print(line)
 
     def test_last_session(self):
@@ -67,6 +73,31 @@ class TestModel(TestCase):
         self.assertEqual(0, len(self.model.find_sessions()))
         self.assertEqual(0, len(sess.all_urls()))
 
+    def test_state_cache(self):
+        print("begin state_cache")
+        self.model.delete()
+        sess = self.model.new_session()
+        sess.save()
+        other = self.model.new_session()
+        other.save()
+        state_cache = StateCache(capacity=2)
+        a = sess.new_state(url='file://a')
+        b = sess.new_state(url='file://b')
+        state_cache.put(a)
+        state_cache.put(b)
+        self.assertIs(a, state_cache.get(sess['uuid'], 'file://a'))
+        state_cache.put(other.new_state(url='file://a'))
+        self.assertIsNone(state_cache.get(sess['uuid'], 'file://b'))
+        self.assertEqual((1, 1, 1), (state_cache.hits, state_cache.misses, state_cache.evictions))
+        state_cache.invalidate(sess['uuid'])
+        self.assertFalse(state_cache.has(sess['uuid'], 'file://a'))
+        self.assertTrue(state_cache.has(other['uuid'], 'file://a'))
+
+        sess.new_state(url='file://c').save()
+        self.assertTrue(cache.has(sess['uuid'], 'file://c'))
+        sess.delete()
+        self.assertFalse(cache.has(sess['uuid'], 'file://c'))
+
     def test_session_delete(self):
         print("begin session_delete")
         self.model.delete()
@@ -104,3 +135,196 @@ class TestModel(TestCase):
         self.assertEqual(6, len(sess.all_urls()))
         self.assertEqual(2, len(sess.find_states(k='v1')))
         self.assertIsInstance(sess.find_states(k='v1')[0], State)
+
+    def test_state_index(self):
+        print('begin state_index')
+        self.model.delete()
+        sess = self.model.new_session()
+        sess.save()
+        stamp = datetime(2016, 4, 5, 20, 48, 16, tzinfo=timezone.utc)
+        sess.new_state(url='file://a', size=1, mtime=stamp, hash='aa', flag=True).save()
+        sess.new_state(url='command://b', stdout='out').save()
+        idx = sess.state_index()
+        self.assertEqual(2, len(idx))
+        self.assertIn('file://a', idx)
+        self.assertNotIn('file://c', idx)
+        self.assertTrue(idx.equals('file://a', {'size': 1, 'mtime': stamp, 'flag': True}, ['size', 'mtime', 'flag']))
+        self.assertTrue(idx.equals('file://a', {'mtime': stamp.astimezone(timezone(timedelta(hours=2)))}, ['mtime']))
+        self.assertFalse(idx.equals('file://a', {'size': 2, 'mtime': stamp}, ['size', 'mtime']))
+        self.assertFalse(idx.equals('file://a', {'stdout': 'out'}, ['stdout']))
+        self.assertEqual(stamp, idx.get('file://a', 'mtime'))
+        self.assertDictEqual({'size': 1, 'mtime': stamp, 'hash': 'aa', 'flag': 1},
+                             idx.values('file://a', skip=['id', 'url', 'sessionid']))
+
+    def test_state_writer(self):
+        print('begin state_writer')
+        self.model.delete()
+        sess = self.model.new_session()
+        sess.save()
+        stamp = datetime(2016, 4, 5, 20, 48, 16, tzinfo=timezone.utc)
+        with self.model.transaction():
+            writer = sess.state_writer(fresh=True)
+            writer.add(sess.new_state(url='file://a', size=1, mtime=stamp, flag=True))
+            writer.add(sess.new_state(url='command://b', stdout='out', blob=b'\x00\x01'))
+            writer.flush()
+        self.assertEqual(2, writer.written)
+        self.assertEqual(2, len(sess.find_states()))
+        row = self.model.query('select size, mtime_ns, extras from states where url = ?', ['file://a']).fetchone()
+        self.assertEqual((1, 1459889296000000000, '{"flag":true}'), row)
+
+        with self.model.transaction():
+            writer = sess.state_writer()
+            writer.add(sess.new_state(url='file://a', size=2))
+            writer.add(sess.new_state(url='file://c', size=3))
+            writer.flush()
+        self.assertEqual(3, len(sess.all_urls()))
+        self.assertEqual(2, self.model.query('select size from states where url = ?', ['file://a']).fetchone()[0])
+
+        with self.assertRaises(ValueError):
+            writer.add(sess.new_state(url='nourl'))
+
+    def test_typed_columns(self):
+        print('begin typed_columns')
+        self.model.delete()
+        sess = self.model.new_session()
+        sess.save()
+        stamp = datetime(2016, 4, 5, 20, 48, 16, 123456, tzinfo=timezone.utc)
+        digest = '%064x' % 0xabc
+        sess.new_state(url='file://a', plugin='file', size=10, mtime=stamp, ctime=stamp, mode=FileMode(0o100644),
+                       uid=0, gid=0, user='root', hash=digest, when=stamp, raw=b'\xff', err=OSError('failed'),
+                       nothing=None).save()
+        cache.clear()
+        state = sess.get_state('file://a')
+        self.assertEqual(stamp, state['mtime'])
+        self.assertEqual(stamp, state['when'])
+        self.assertEqual('u=rw-,g=r--,o=r--', str(state['mode']))
+        self.assertEqual(0o100644, state['mode'])
+        self.assertEqual(digest, state['hash'])
+        self.assertEqual(b'\xff', state['raw'])
+        self.assertEqual('failed', state['err'])
+        self.assertIsNone(state['nothing'])
+        self.assertEqual('root', state['user'])
+        row = self.model.query('select mode, uid, hash, extras from states').fetchone()
+        self.assertEqual(0o100644, row[0])
+        self.assertEqual(32, len(row[2]))
+        self.assertNotIn('mode', row[3])
+        self.assertEqual(1, len(sess.find_states(plugin='file', user='root')))
+        self.assertEqual(0, len(sess.find_states(size=11)))
+
+    def test_fingerprint(self):
+        print('begin fingerprint')
+        fp = encode_state({'sessionid': 's1', 'url': 'file://a', 'size': 1, 'text': 'x'})[fingerprint_idx]
+        self.assertEqual(fp, encode_state({'sessionid': 's2', 'url': 'file://b', 'text': 'x', 'size': 1,
+                                           'assume_nochange': True})[fingerprint_idx])
+        self.assertNotEqual(fp, encode_state({'sessionid': 's1', 'url': 'file://a', 'size': 1,
+                                              'text': 'y'})[fingerprint_idx])
+        self.assertNotEqual(fp, encode_state({'sessionid': 's1', 'url': 'file://a', 'size': '1',
+                                              'text': 'x'})[fingerprint_idx])
+
+        # tables created before the fingerprint column are filled in on open
+        tmpdir = tempfile.mkdtemp()
+        try:
+            uri = 'sqlite:///' + os.path.join(tmpdir, 'db.sqlite')
+            model = Model(uri)
+            sess = model.new_session()
+            sess.save()
+            sess.new_state(url='file://a', size=1, text='x').save()
+            model.query('ALTER TABLE states RENAME TO states_old')
+            model.query('CREATE TABLE states AS SELECT %s, deleted FROM states_old' %
+                        ', '.join(c for c in state_columns if c != 'fingerprint'))
+            model.query('DROP TABLE states_old')
+            model.db.close()
+
+            model = Model(uri)
+            self.assertEqual(fp, model.query('select fingerprint from states').fetchone()[0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_legacy_migration(self):
+        print('begin legacy_migration')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            uri = 'sqlite:///' + os.path.join(tmpdir, 'db.sqlite')
+            legacy = MyDataSet(uri)
+            legacy['sessions'].insert(uuid='s', stamp=datetime(2016, 4, 5, 20, 0, 0), closed=True)
+            legacy['states'].insert(url='file:///etc/passwd', sessionid='s', plugin='file', size=1,
+                                    mtime=datetime(2016, 4, 5, 20, 48, 16, tzinfo=timezone.utc),
+                                    mode='setuid u=rwx,g=r-x,o=r-x', uid='0 (root)', gid='42', hash='%064x' % 1,
+                                    assume_nochange=False)
+            legacy['states'].insert(url='command://ls', sessionid='s', plugin='command', stdout='out')
+            legacy.close()
+
+            model = Model(uri)
+            self.assertNotIn('id', [row[1] for row in model.query('PRAGMA table_info(states)')])
+            sess = model.last_closed_session()
+            cache.clear()
+            state = sess.get_state('file:///etc/passwd')
+            self.assertEqual(0o104755, state['mode'])
+            self.assertEqual(0, state['uid'])
+            self.assertEqual('root', state['user'])
+            self.assertEqual(42, state['gid'])
+            self.assertNotIn('group', state)
+            self.assertEqual(datetime(2016, 4, 5, 20, 48, 16, tzinfo=timezone.utc), state['mtime'])
+            self.assertNotIn('stdout', state)
+            self.assertEqual('out', sess.get_state('command://ls')['stdout'])
+            self.assertEqual(0, model.query("select count(*) from sqlite_master where name = 'states_legacy'").fetchone()[0])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def new_delta_session(self, parent, states):
+        sess = self.model.new_session(parent=parent['uuid'] if parent is not None else None, closed=True)
+        sess.save()
+        with self.model.transaction():
+            writer = sess.state_writer(fresh=True)
+            for url, values in states.items():
+                writer.add(sess.new_state(url=url, **values))
+            writer.delete_missing()
+        return sess, writer
+
+    def test_delta_session(self):
+        print('begin delta_session')
+        self.model.delete()
+        base, writer = self.new_delta_session(None, {'file://a': {'size': 1}, 'file://b': {'size': 2},
+                                                     'file://c': {'size': 3}})
+        self.assertEqual(3, writer.written)
+        delta, writer = self.new_delta_session(base, {'file://a': {'size': 1}, 'file://b': {'size': 20},
+                                                      'file://d': {'size': 4}})
+        self.assertEqual(2, writer.written)
+        self.assertEqual(1, writer.unchanged)
+        self.assertEqual(1, writer.tombstones)
+        self.assertEqual(3, self.model.query('select count(*) from states where sessionid = ?',
+                                             [delta['uuid']]).fetchone()[0])
+        self.assertListEqual([delta['uuid'], base['uuid']], delta.chain())
+        cache.clear()
+        self.assertListEqual(['file://a', 'file://b', 'file://d'], sorted(delta.all_urls()))
+        self.assertEqual(1, delta.get_state('file://a')['size'])
+        self.assertEqual(delta['uuid'], delta.get_state('file://a')['sessionid'])
+        self.assertEqual(20, delta.get_state('file://b')['size'])
+        with self.assertRaises(KeyError):
+            delta.get_state('file://c')
+        self.assertEqual(1, len(delta.find_states(size=4)))
+        self.assertEqual(3, len(delta.state_index()))
+
+    def test_delta_session_delete(self):
+        print('begin delta_session_delete')
+        self.model.delete()
+        base, writer = self.new_delta_session(None, {'file://a': {'size': 1}, 'file://b': {'size': 2}})
+        mid, writer = self.new_delta_session(base, {'file://a': {'size': 10}})
+        top, writer = self.new_delta_session(mid, {'file://a': {'size': 10}, 'file://c': {'size': 3}})
+        self.assertEqual(1, writer.written)
+
+        # deleting the middle session folds its delta into the top session
+        cache.clear()
+        self.model.delete_sessions([mid])
+        self.assertListEqual([top['uuid'], base['uuid']], self.model.find_sessions(uuid=top['uuid'])[0].chain())
+        top = self.model.find_sessions(uuid=top['uuid'])[0]
+        self.assertListEqual(['file://a', 'file://c'], sorted(top.all_urls()))
+        self.assertEqual(10, top.get_state('file://a')['size'])
+
+        # deleting the base turns the top session into a full one
+        cache.clear()
+        base.delete()
+        top = self.model.find_sessions(uuid=top['uuid'])[0]
+        self.assertIsNone(top['parent'])
+        self.assertListEqual(['file://a', 'file://c'], sorted(top.all_urls()))
+        self.assertEqual(0, self.model.query('select count(*) from states where deleted = 1').fetchone()[0])
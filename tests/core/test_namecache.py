@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from syschangemon.core.namecache import NameCache, read_id_names
+
+
+class TestNameCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.resolved = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def resolve(self, id_):
+        self.resolved.append(id_)
+        if id_ == 0:
+            return 'root'
+        raise KeyError(id_)
+
+    def test_get(self):
+        names = NameCache(self.resolve)
+        self.assertEqual('root', names.get(0))
+        self.assertEqual('root', names.get(0))
+        self.assertIsNone(names.get(1234))
+        self.assertIsNone(names.get(1234))
+        self.assertListEqual([0, 1234], self.resolved)
+        self.assertEqual(2, names.hits)
+        self.assertEqual(2, names.misses)
+        self.assertEqual(1, names.unknown)
+
+    def test_load(self):
+        path = os.path.join(self.dir, 'passwd')
+        with open(path, 'w') as fd:
+            fd.write('# comment\n'
+                     'root:x:0:0:root:/root:/bin/bash\n'
+                     'daemon:x:1:1:daemon:/usr/sbin:/usr/sbin/nologin\n'
+                     'toor:x:0:0:root:/root:/bin/sh\n'
+                     '+@netgroup::::::\n')
+        self.assertListEqual([(0, 'root'), (1, 'daemon'), (0, 'toor')], read_id_names(path))
+
+        names = NameCache(self.resolve)
+        names.load(path)
+        self.assertEqual('root', names.get(0))
+        self.assertEqual('daemon', names.get(1))
+        self.assertListEqual([], self.resolved)
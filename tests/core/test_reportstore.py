@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from syschangemon.core.model import Model
+
+
+class TestReportStore(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+        self.model.report_store.chunk_size = 10
+
+    def count_chunks(self):
+        return self.model.query('select count(*) from report_chunks').fetchone()[0]
+
+    def test_write_read(self):
+        report = self.model.new_report()
+        with report.writer('text') as fd:
+            for i in range(20):
+                fd.write('line %d\n' % i)
+        report.save()
+        self.assertEqual(''.join('line %d\n' % i for i in range(20)), report.text('text'))
+        chunks = list(self.model.last_report().chunks('text'))
+        self.assertGreater(len(chunks), 5)
+        self.assertTrue(all(len(chunk) < 20 for chunk in chunks))
+        self.assertEqual('', report.text('html'))
+
+        # written again, eg. on a second render
+        with report.writer('text') as fd:
+            fd.write('short')
+        self.assertEqual('short', report.text('text'))
+        self.assertEqual(1, self.count_chunks())
+
+    def test_column_report(self):
+        # reports saved before chunks were stored keep their parts in columns
+        report = self.model.new_report(text='report text')
+        report.save()
+        self.assertListEqual(['report text'], list(self.model.last_report().chunks('text')))
+
+    def test_delete(self):
+        reports = [self.model.new_report() for i in range(2)]
+        for report in reports:
+            with report.writer('text') as fd:
+                fd.write('x' * 25)
+            report.save()
+        reports[0].delete()
+        self.assertEqual('', reports[0].text('text'))
+        self.assertEqual('x' * 25, reports[1].text('text'))
+        self.model.delete()
+        self.assertEqual(0, self.count_chunks())
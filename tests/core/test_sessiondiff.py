@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from syschangemon.core.model import Model, cache
+from syschangemon.core.sessiondiff import SessionDiff
+
+
+class TestSessionDiff(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+        cache.clear()
+
+    def new_session(self, states, parent=None):
+        sess = self.model.new_session(closed=True)
+        if parent is not None:
+            sess['parent'] = parent['uuid']
+        sess.save()
+        with self.model.transaction():
+            writer = sess.state_writer(fresh=True)
+            for url, values in states.items():
+                writer.add(sess.new_state(url=url, **values))
+            writer.delete_missing()
+        return sess
+
+    def states(self, count=50):
+        return dict(('file://%d' % i, {'size': i, 'content': 'text %d' % i}) for i in range(count))
+
+    def check(self, diff):
+        self.assertSetEqual({'file://new'}, diff.found_urls)
+        self.assertSetEqual({'file://3'}, diff.lost_urls)
+        self.assertListEqual(['file://5', 'file://7'], sorted(d.label1 for d in diff.diffs))
+        self.assertEqual((5, 500), [d for d in diff.diffs if d.label1 == 'file://5'][0].both_neq_tuple['size'])
+        self.assertFalse(diff.is_empty)
+
+    def changed_states(self):
+        states = self.states()
+        del states['file://3']
+        states['file://new'] = {'size': 1}
+        states['file://5'] = {'size': 500, 'content': 'text 5'}
+        states['file://7'] = {'size': 7, 'content': 'changed'}
+        # ignored key only
+        states['file://9'] = {'size': 9, 'content': 'text 9', 'assume_nochange': True}
+        return states
+
+    def test_full_sessions(self):
+        old = self.new_session(self.states())
+        new = self.new_session(self.changed_states())
+        self.check(SessionDiff(old, new))
+        # fingerprints leave out ignored keys, such states are not compared at all
+        self.assertListEqual(['file://5', 'file://7'], sorted(self.model.diff_states(old.chain(), new.chain())[2]))
+
+    def test_delta_sessions(self):
+        old = self.new_session(self.states())
+        new = self.new_session(self.changed_states(), parent=old)
+        self.check(SessionDiff(old, new))
+        self.assertListEqual(['file://5', 'file://7'], sorted(self.model.diff_states(old.chain(), new.chain())[2]))
+        self.check(SessionDiff(old, self.new_session(self.changed_states(), parent=new)))
+
+    def test_changes(self):
+        old = self.new_session(self.states(1200))
+        states = self.states(1200)
+        states['file://3'] = {'size': 3}
+        del states['file://1000']
+        states['file://new'] = {'size': 1}
+        diff = SessionDiff(old, self.new_session(states))
+        diff.chunk_size = 2
+        changes = list(diff.changes())
+        self.assertListEqual(['file://1000', 'file://3', 'file://new'], [c.url for c in changes])
+        self.assertIsNone(changes[0].new)
+        self.assertEqual(1000, changes[0].old['size'])
+        self.assertDictEqual({'content': 'text 3'}, changes[1].diff.only1)
+        self.assertIsNone(changes[2].old)
+        self.assertListEqual(['file://1000'], [state['url'] for state in diff.lost_states()])
+        self.assertListEqual(['file://new'], [state['url'] for state in diff.found_states()])
+
+        seen = []
+        diff.item_processors.append(lambda d: seen.append(d.label1) or d)
+        self.assertFalse(diff.is_empty)
+        self.assertListEqual([], seen)
+        self.assertEqual(1, len(list(diff.diffs)))
+        self.assertListEqual(['file://3'], seen)
+
+    def test_unchanged(self):
+        old = self.new_session(self.states())
+        new = self.new_session(self.states())
+        self.assertTrue(SessionDiff(old, new).is_empty)
+        # differing fingerprints of states equal when decoded are neither reported nor make the diff non empty
+        diff = SessionDiff(old, new)
+        diff.changed_urls.add('file://1')
+        self.assertTrue(diff.is_empty)
+        self.assertListEqual([], list(diff.diffs))
+        self.assertTrue(SessionDiff(old, self.new_session(self.states(), parent=old)).is_empty)
@@ -0,0 +1,65 @@
+import difflib
+import random
+from unittest import TestCase
+
+from syschangemon.core.model import Model
+from syschangemon.core.textdiff import TextDiff, line_ops, unified
+
+
+class TestTextDiff(TestCase):
+    def setUp(self):
+        self.model = Model('sqlite:///:memory:')
+
+    def apply(self, lines1, lines2, ops):
+        res = []
+        for (tag, i, j) in ops:
+            if tag == '=':
+                self.assertEqual(lines1[i], lines2[j])
+                res.append(lines1[i])
+            elif tag == '+':
+                res.append(lines2[j])
+        return res
+
+    def test_line_ops(self):
+        rnd = random.Random(42)
+        for n in range(200):
+            lines1 = [rnd.choice('abcde') for i in range(rnd.randint(0, 20))]
+            lines2 = [rnd.choice('abcde') for i in range(rnd.randint(0, 20))]
+            ops = line_ops(lines1, lines2)
+            self.assertListEqual(lines2, self.apply(lines1, lines2, ops))
+            self.assertListEqual(list(range(len(lines1))), [i for (tag, i, j) in ops if tag != '+'])
+            # shortest edit script: as many kept lines as the longest common subsequence
+            matcher = difflib.SequenceMatcher(None, lines1, lines2, autojunk=False)
+            lcs = sum(block.size for block in matcher.get_matching_blocks())
+            self.assertGreaterEqual(len([op for op in ops if op[0] == '=']), lcs)
+        self.assertIsNone(line_ops(['a'] * 10, ['b'] * 10, max_edits=5))
+
+    def test_unified(self):
+        lines1 = ['line %d' % i for i in range(30)]
+        lines2 = list(lines1)
+        lines2[2] = 'changed'
+        lines2.insert(20, 'inserted')
+        del lines2[27]
+        expected = ''.join(line + '\n' for line in difflib.unified_diff(lines1, lines2, lineterm='', n=3))
+        expected = expected[expected.index('@@'):]
+        self.assertEqual(expected, unified(lines1, lines2, line_ops(lines1, lines2)))
+        self.assertEqual('@@ -0,0 +1,1 @@\n+new\n', unified([], ['new'], line_ops([], ['new'])))
+
+    def test_cache(self):
+        text_diff = TextDiff(self.model)
+        res = text_diff.diff('a\nb\nc\n', 'a\nx\nc\n')
+        self.assertEqual('@@ -1,4 +1,4 @@\n a\n-b\n+x\n c\n \n', res)
+        self.assertEqual(1, text_diff.misses)
+        self.assertEqual(res, TextDiff(self.model).diff('a\nb\nc\n', 'a\nx\nc\n'))
+        other = TextDiff(self.model)
+        other.diff('a\nb\nc\n', 'a\nx\nc\n')
+        self.assertEqual(1, other.hits)
+        self.assertEqual(0, other.gc())
+        self.assertEqual(1, other.gc(max_age=-1))
+
+    def test_summary(self):
+        text_diff = TextDiff(self.model, max_size=10, max_edits=2)
+        self.assertIn('too large', text_diff.diff('a\n' * 5, 'b\n' * 5))
+        text_diff.max_size = 1000
+        self.assertIn('more than 2 lines differ', text_diff.diff('a\n' * 5, 'b\n' * 5))
+        self.assertEqual(2, text_diff.summaries)
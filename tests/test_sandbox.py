@@ -1,5 +1,6 @@
 import csv
 import re
+import sqlite3
 from io import StringIO
 from unittest.case import TestCase
 
@@ -51,6 +52,11 @@ class SysChangeMonSandboxApp(SysChangeMonApp):
         #tepmplate_dirs = [sandbox + '/var/lib/syschangemon/templates']
 
 
+class SysChangeMonSandboxDeltaApp(SysChangeMonSandboxApp):
+    class Meta:
+        config_files = [sandbox + '/etc/syschangemon.conf', sandbox + '/etc/delta.conf']
+
+
 class TestSandbox(TestCase):
 
     def reset_sandbox(self):
@@ -65,15 +71,16 @@ class TestSandbox(TestCase):
             os.remove(sandbox + "/syschangemon.log")
 
     @capture
-    def command(self, argv):
+    def command(self, argv, app_class=SysChangeMonSandboxApp):
         """
         run syschangemon command
 
         :param argv: command line
+        :param app_class: application class, eg. SysChangeMonSandboxDeltaApp
         :return: command stdout
         """
         os.chdir(sandbox)
-        app = SysChangeMonSandboxApp(argv=argv)
+        app = app_class(argv=argv)
         try:
             with app:
                 app.run()
@@ -157,6 +164,32 @@ class TestSandbox(TestCase):
         # test sysinfo plugin
         self.assertExportContains(e, 'url', 'sysinfo://')
 
+    def hash_cache_rows(self):
+        db = sqlite3.connect(sandbox + "/storage/db.sqlite")
+        try:
+            return db.execute('SELECT COUNT(*) FROM hashcache').fetchone()[0]
+        finally:
+            db.close()
+
+    def test_hash_cache_kept(self):
+        self.reset_sandbox()
+        self.command(['collect'])
+        rows = self.hash_cache_rows()
+        self.assertGreater(rows, 1)
+        # unchanged files are assumed unchanged and not looked up, their entries must survive
+        self.command(['collect'])
+        self.assertEqual(rows, self.hash_cache_rows())
+
+    def test_name_lookup_time(self):
+        self.reset_sandbox()
+        self.command(['collect'])
+        db = sqlite3.connect(sandbox + "/storage/db.sqlite")
+        try:
+            lookup_time = db.execute('SELECT name_lookup_time FROM sessions').fetchone()[0]
+        finally:
+            db.close()
+        self.assertGreaterEqual(lookup_time, 0.0)
+
     def test_sandbox_diff(self):
         self.reset_sandbox()
         self.command(['collect'])
@@ -201,6 +234,37 @@ class TestSandbox(TestCase):
         self.assertEqual(len(re.findall('changed item', rep)), 0)
         self.assertRegex(rep, 'changed file content')
 
+    def session_state_rows(self):
+        db = sqlite3.connect(sandbox + "/storage/db.sqlite")
+        try:
+            return [row[0] for row in db.execute('SELECT COUNT(*) FROM states GROUP BY sessionid ORDER BY MIN(rowid)')]
+        finally:
+            db.close()
+
+    def test_sandbox_delta_storage(self):
+        self.reset_sandbox()
+        self.command(['collect'], app_class=SysChangeMonSandboxDeltaApp)
+        with open(sandbox + "/files/testfile", "w") as file:
+            file.write("test file content")
+        self.command(['collect'], app_class=SysChangeMonSandboxDeltaApp)
+        self.command(['diff'], app_class=SysChangeMonSandboxDeltaApp)
+        rep = self.command(['print-report'], app_class=SysChangeMonSandboxDeltaApp)
+
+        self.assertRegex(rep, 'item_count.*8.*9')
+        self.assertEqual(len(re.findall('found new item', rep)), 1)
+        self.assertEqual(len(re.findall('changed item', rep)), 0)
+        # the second session only stores what changed
+        rows = self.session_state_rows()
+        self.assertEqual(2, len(rows))
+        self.assertLess(rows[1], rows[0])
+
+        self.command(['collect'], app_class=SysChangeMonSandboxDeltaApp)
+        self.command(['cleanup'], app_class=SysChangeMonSandboxDeltaApp)
+        e = self.command(['export'], app_class=SysChangeMonSandboxDeltaApp).replace('\x00', '')
+        self.assertExportQuery(e, 'url', 'file://files/testfile', 'size', '17')
+        self.assertExportQuery(e, 'url', 'file://files/conffile', 'content', "conffile content")
+        os.unlink(sandbox + "/files/testfile")
+
     def test_empty_export(self):
         self.reset_sandbox()
         e = self.command(['export'])
@@ -239,3 +303,14 @@ class TestSandbox(TestCase):
         self.assertRegex(e, 'no previous state')
         e = self.command(['print-report'])
         self.assertRegex(e, 'no difference')
+
+    def test_plugin_phases(self):
+        self.reset_sandbox()
+        os.chdir(sandbox)
+        for argv, plugins in [(['list-sessions'], []), (['print-report'], []),
+                              (['collect'], ['command', 'conffile', 'file', 'sysinfo']),
+                              (['collect'], ['command', 'conffile', 'file', 'sysinfo']), (['diff'], ['wtmp'])]:
+            app = SysChangeMonSandboxApp(argv=argv)
+            with app:
+                capture(app.run)()
+                self.assertListEqual(plugins, sorted(app.controller.plugins.keys()))